@@ -0,0 +1,193 @@
+"""
+    Runs the decompiler over a directory of bytecodes, and compares the
+    results with a previous run.
+
+        python -m benchmarks.bulk_compare [dir] [--save=out.json]
+                                          [--baseline=base.json]
+                                          [--max-slowdown=1.25]
+
+    `dir` defaults to cache_dir()/code - the layout Loader.load_addr writes
+    to - but any directory with .bin files (hex, one contract per file) will
+    do. Nothing is fetched from the network, and the result cache is not
+    used.
+
+    Every contract runs in a fresh process, so that neither memoization nor
+    memory left over from other contracts affects its numbers. For every
+    contract, it records wall time, peak RSS, hashes of the output text and
+    json (without the profile), the functions that failed, and per function:
+    wall time and VM node count.
+
+    With --baseline, it lists contracts whose output (text, json or failed
+    functions) changed and contracts that got slower than --max-slowdown
+    times the baseline, and exits with 1 if there were any - so it can be
+    used as a gate for performance changes. Output depends on the hash seed, so run both sides with the
+    same PYTHONHASHSEED.
+
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+
+from snaps_backend.decompiler import decompile_bytecode
+from snaps_backend.utils.helpers import cache_dir
+
+# top-level stages of a function's decompilation, see decompiler.py
+FUNCTION_STAGES = ("vm", "make_whiles", "Function")
+
+
+def find_contracts(directory):
+    return sorted(Path(directory).rglob("*.bin"))
+
+
+def json_hash(decompilation):
+    # the profile has timings in it, and is only there because we asked
+    data = {k: v for k, v in decompilation.json.items() if k != "profile"}
+    dump = json.dumps(data, sort_keys=True, default=str)
+
+    return hashlib.sha256(dump.encode()).hexdigest()[:16]
+
+
+def run_contract(path):
+    logging.disable(logging.CRITICAL)
+
+    code = path.read_text().strip()
+
+    start = time.perf_counter()
+    decompilation = decompile_bytecode(code, use_cache=False, profile=True)
+    elapsed = time.perf_counter() - start
+
+    profile = decompilation.json.get("profile", {})
+
+    functions = {}
+    for hash, stages in profile.get("functions", {}).items():
+        func_time = sum(stages.get(s, {}).get("time", 0) for s in FUNCTION_STAGES)
+        functions[hash] = {
+            "time": round(func_time, 4),
+            "vm_nodes": stages.get("vm", {}).get("node_count"),
+        }
+
+    return {
+        "time": round(elapsed, 4),
+        # kilobytes on Linux
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "text_hash": hashlib.sha256(decompilation.text.encode()).hexdigest()[:16],
+        "json_hash": json_hash(decompilation),
+        "problems": sorted(decompilation.json.get("problems", {})),
+        "functions": functions,
+    }
+
+
+def run_all(paths):
+    results = {}
+
+    # maxtasksperchild=1 - a fresh process for every contract
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for path in paths:
+            res = pool.apply(run_contract, (path,))
+            results[path.stem] = res
+
+            print(
+                f"{path.stem}: {res['time']:.2f}s, {res['peak_rss'] // 1024}MB, "
+                f"{len(res['functions'])} functions, {res['text_hash']}",
+                file=sys.stderr,
+            )
+
+    return results
+
+
+def compare(baseline, results, max_slowdown):
+    """Prints the differences, returns the number of problems found."""
+
+    failures = 0
+
+    for name, res in results.items():
+        if name not in baseline:
+            print(f"{name}: not in baseline")
+            continue
+
+        base = baseline[name]
+
+        if res["text_hash"] != base["text_hash"]:
+            print(f"{name}: OUTPUT CHANGED")
+            failures += 1
+
+        # baselines saved before these were recorded don't have them
+        if res["json_hash"] != base.get("json_hash", res["json_hash"]):
+            print(f"{name}: JSON CHANGED")
+            failures += 1
+
+        if res["problems"] != base.get("problems", res["problems"]):
+            print(f"{name}: PROBLEMS CHANGED, {base['problems']} -> {res['problems']}")
+            failures += 1
+
+        if res["time"] > base["time"] * max_slowdown and res["time"] > 0.5:
+            print(f"{name}: slower, {base['time']:.2f}s -> {res['time']:.2f}s")
+            failures += 1
+
+        for hash, func in res["functions"].items():
+            base_func = base["functions"].get(hash)
+            if base_func is not None and func["vm_nodes"] != base_func["vm_nodes"]:
+                print(
+                    f"{name} {hash}: vm nodes "
+                    f"{base_func['vm_nodes']} -> {func['vm_nodes']}"
+                )
+
+    common = [name for name in results if name in baseline]
+    if common:
+        base_time = sum(baseline[name]["time"] for name in common)
+        new_time = sum(results[name]["time"] for name in common)
+        base_rss = max(baseline[name]["peak_rss"] for name in common)
+        new_rss = max(results[name]["peak_rss"] for name in common)
+
+        print(
+            f"total time: {base_time:.2f}s -> {new_time:.2f}s "
+            f"({base_time / new_time:.2f}x), "
+            f"max peak rss: {base_rss // 1024}MB -> {new_rss // 1024}MB"
+        )
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decompiles a directory of bytecodes.")
+    parser.add_argument("dir", nargs="?", default=cache_dir() / "code")
+    parser.add_argument("--save", help="write results to this file")
+    parser.add_argument("--baseline", help="compare with results saved earlier")
+    parser.add_argument("--max-slowdown", type=float, default=1.25)
+    args = parser.parse_args()
+
+    if "PYTHONHASHSEED" not in os.environ:
+        print(
+            "warning: PYTHONHASHSEED is not set, "
+            "output hashes may differ between runs",
+            file=sys.stderr,
+        )
+
+    paths = find_contracts(args.dir)
+    if not paths:
+        print(f"no .bin files in {args.dir}", file=sys.stderr)
+        exit(1)
+
+    results = run_all(paths)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if compare(baseline, results, args.max_slowdown) > 0:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+    Measures the memory cleanup pass on long straight-line traces, like the
+    ones of functions that ABI-encode a lot of values.
+
+        python -m benchmarks.cleanup_mems [--setmems=1000]
+
+    The synthetic trace stores one calldata word after another into memory,
+    reads some of them back, and returns the whole buffer. The pass itself
+    only looks at the setmems a line may touch, but the final return gets
+    one word substituted after another, each time simplifying the whole
+    buffer again - so that line still grows with the square of the number
+    of setmems. It runs with the default recursion limit, to show the pass
+    doesn't need more stack for longer traces.
+
+"""
+import argparse
+import sys
+import time
+
+from snaps_backend.simplify import cleanup_mems
+from snaps_backend.utils.helpers import cache_scope
+
+BASE = 0x80
+
+
+def synthetic_trace(setmems):
+    trace = [("setmem", ("range", 64, 32), BASE + 32 * setmems)]
+
+    for i in range(setmems):
+        trace.append(("setmem", ("range", BASE + 32 * i, 32), ("cd", 4 + 32 * i)))
+        if i % 10 == 9:
+            # reads an earlier word back, so it gets substituted
+            trace.append(("log", ("mem", ("range", BASE + 32 * (i - 5), 32)), 1))
+
+    trace.append(("return", ("mem", ("range", BASE, 32 * setmems))))
+
+    return trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures cleanup_mems.")
+    parser.add_argument("--setmems", type=int, default=1000)
+    args = parser.parse_args()
+
+    trace = synthetic_trace(args.setmems)
+
+    sys.setrecursionlimit(1000)  # the default, in case something raised it
+
+    with cache_scope():
+        start = time.perf_counter()
+        res = cleanup_mems(trace)
+        elapsed = time.perf_counter() - start
+
+    print(f"{args.setmems} setmems, {len(trace)} lines -> {len(res)} lines")
+    print(f"cleanup_mems: {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
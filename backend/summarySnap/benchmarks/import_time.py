@@ -0,0 +1,116 @@
+"""
+    Measures cold start: a fresh interpreter importing the decompiler, and
+    decompiling its first contract.
+
+        python -m benchmarks.import_time [code.bin] [--runs=5]
+
+    Every run is a new process, like a short-lived worker. It reports the
+    median of the whole process' wall time, of `import snaps_backend.decompiler`
+    and of the first decompilation (result cache off), and then the slowest
+    imports of one more run, from `python -X importtime`. The package is
+    byte-compiled first, as it would be when installed.
+
+    Without a code.bin, it decompiles a small hello-world contract.
+
+"""
+import argparse
+import compileall
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import snaps_backend
+
+HELLO_WORLD = (
+    "608060405234801561001057600080fd5b506004361061002b5760003560e01c80636d4ce63c"
+    "14610030575b600080fd5b61003861004e565b604051610045919061011b565b60405180910390"
+    "f35b60606040518060400160405280600b81526020017f48656c6c6f20576f726c640000000000"
+    "00000000000000000000000000000000000000815250905090565b600081519050919050565b60"
+    "0082825260208201905092915050565b60005b838110156100c557808201518184015260208101"
+    "90506100aa565b60008484015250505050565b6000601f19601f8301169050919050565b600061"
+    "00ed8261008b565b6100f78185610096565b93506101078185602086016100a7565b6101108161"
+    "00d1565b840191505092915050565b6000602082019050818103600083015261013581846100e2"
+    "565b90509291505056fea264697066735822122060d589c0326dc8c65fc912551940071d46baa6"
+    "0a7a71c31b811b740531ee629964736f6c63430008110033"
+)
+
+CHILD = """
+import json, logging, sys, time
+
+start = time.perf_counter()
+from snaps_backend.decompiler import decompile_bytecode
+imported = time.perf_counter()
+
+logging.disable(logging.CRITICAL)
+decompile_bytecode(sys.stdin.read(), use_cache=False)
+decompiled = time.perf_counter()
+
+print(json.dumps({"import": imported - start, "decompile": decompiled - imported}))
+"""
+
+
+def run_once(code):
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        input=code,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    elapsed = time.perf_counter() - start
+
+    return dict(json.loads(out), total=elapsed)
+
+
+def slowest_imports(limit=15):
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import snaps_backend.decompiler"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+
+    imports = []
+    for line in err.splitlines()[1:]:
+        # import time: self [us] | cumulative | imported package
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        imports.append((int(self_us), int(cumulative_us), name.rstrip()))
+
+    return sorted(imports, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures cold start.")
+    parser.add_argument("code", nargs="?", help="a .bin file with hex bytecode")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.code:
+        with open(args.code) as f:
+            code = f.read().strip()
+    else:
+        code = HELLO_WORLD
+
+    # with PYTHONDONTWRITEBYTECODE, every run would compile the sources
+    compileall.compile_dir(Path(snaps_backend.__file__).parent, quiet=1)
+
+    run_once(code)  # warms up the os caches
+
+    runs = [run_once(code) for _ in range(args.runs)]
+
+    for key in ("total", "import", "decompile"):
+        median = statistics.median(r[key] for r in runs)
+        print(f"{key}: {median * 1000:.0f}ms")
+
+    print()
+    print("slowest imports (self, cumulative, in ms):")
+    for self_us, cumulative_us, name in slowest_imports():
+        print(f"{self_us / 1000:8.1f} {cumulative_us / 1000:8.1f} {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+    Compares the single-pass Loader.load_binary with the previous
+    byte-string implementation, on max-size (24,576 byte) contracts,
+    and checks the instruction table against the old dict and next_line.
+
+        python -m benchmarks.loader [runs]
+
+"""
+import random
+import sys
+import time
+
+from snaps_backend.loader import Loader
+from snaps_backend.utils.helpers import pretty_bignum
+from snaps_backend.utils.opcode_dict import opcode_dict
+
+MAX_CODE_SIZE = 24_576
+
+
+def legacy_load_binary(source):
+    """The quadratic implementation load_binary used to have, kept for reference."""
+    stack = []
+    binary = []
+    jump_dests = []
+
+    if source[:2] == "0x":
+        source = source[2:]
+
+    while len(source[:2]) > 0:
+        num = int("0x" + source[:2], 16)
+        binary.append(num)
+        stack = [num] + stack
+        source = source[2:]
+
+    line = 0
+
+    parsed_lines = []
+
+    while len(stack) > 0:
+        popped = stack.pop()
+
+        orig_line = line
+
+        if popped not in opcode_dict:
+            op = "UNKNOWN"
+            param = popped
+
+        else:
+            param = None
+            op = opcode_dict[popped]
+
+            if op == "jumpdest":
+                jump_dests.append(line)
+
+            if op[:4] == "push":
+                num_words = int(op[4:])
+
+                param = 0
+                for i in range(num_words):
+                    try:
+                        param = param * 0x100 + stack.pop()
+                        line += 1
+                    except Exception:
+                        break
+
+        parsed_lines.append((orig_line, op, param))
+        line += 1
+
+    lines = {}
+
+    for line_no, op, param in parsed_lines:
+        if op[:4] == "push" and param > 1000000000000000:
+            param = pretty_bignum(param)
+
+        if op[:3] == "dup":
+            param = int(op[3:])
+            op = "dup"
+
+        if op[:4] == "swap":
+            param = int(op[4:])
+            op = "swap"
+
+        lines[line_no] = (line_no, op, param)
+
+    return binary, parsed_lines, lines, jump_dests, line
+
+
+def legacy_next_line(lines, last_line, i):
+    i += 1
+    while i not in lines and last_line > i:
+        i += 1
+
+    if i <= last_line:
+        return i
+    else:
+        return None
+
+
+def random_contract(seed):
+    rng = random.Random(seed)
+    return bytes(rng.randrange(256) for _ in range(MAX_CODE_SIZE)).hex()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    legacy_total = 0
+    new_total = 0
+
+    for seed in range(runs):
+        code = random_contract(seed)
+
+        start = time.perf_counter()
+        binary, parsed_lines, lines, jump_dests, last_line = legacy_load_binary(code)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loader = Loader()
+        loader.load_binary(code)
+        new_time = time.perf_counter() - start
+
+        assert bytes(binary) == loader.binary
+        assert parsed_lines == loader.parsed_lines
+        assert lines == dict(loader.lines.items())
+        assert jump_dests == loader.jump_dests
+        assert last_line == loader.last_line
+        assert all(
+            legacy_next_line(lines, last_line, i) == loader.next_line(i)
+            for i in range(-1, last_line + 2)
+        )
+
+        print(
+            f"contract {seed}: {len(parsed_lines)} instructions, "
+            f"legacy {legacy_time * 1000:.1f}ms, new {new_time * 1000:.1f}ms"
+        )
+
+        legacy_total += legacy_time
+        new_total += new_time
+
+    print(
+        f"total: legacy {legacy_total * 1000:.1f}ms, new {new_total * 1000:.1f}ms, "
+        f"{legacy_total / new_total:.1f}x faster"
+    )
+
+
+if __name__ == "__main__":
+    main()
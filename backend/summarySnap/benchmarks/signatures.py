@@ -0,0 +1,92 @@
+"""
+    Counts the supplement.db queries made while decompiling.
+
+        python -m benchmarks.signatures [code.bin ...]
+
+    Without arguments it uses the `addr_shortcuts` contracts that are already
+    in the code cache, like benchmarks.vm.
+
+    Every contract starts with empty signature caches, and the PABI cache
+    (make_abi results, kept on disk) is redirected to a temporary directory,
+    so all the lookups really go to the database. The result cache is not
+    used.
+
+"""
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import snaps_backend.loader as loader
+import snaps_backend.utils.signatures as signatures
+import snaps_backend.utils.supplement as supplement
+from benchmarks.vm import file_codes, shortcut_codes
+from snaps_backend.decompiler import decompile_bytecode
+from snaps_backend.utils.helpers import cached_dict
+
+queries = 0
+
+
+def count_queries(statement):
+    global queries
+
+    if not statement.startswith("PRAGMA"):
+        queries += 1
+
+
+def connect():
+    conn = supplement_connect()
+    conn.set_trace_callback(count_queries)
+    return conn
+
+
+supplement_connect = supplement._connect
+
+
+def clear_signature_caches():
+    for name, cache in cached_dict.items():
+        if name.startswith("snaps_backend.utils.supplement."):
+            cache.clear()
+
+    for sigs in loader.cache_sigs.values():
+        sigs.clear()
+
+
+def main():
+    global queries
+
+    logging.disable(logging.CRITICAL)
+
+    if len(sys.argv) > 1:
+        codes = file_codes(sys.argv[1:])
+    else:
+        codes = shortcut_codes()
+
+    supplement._connect = connect
+    supplement.close_connection()
+
+    pabi_dir = Path(tempfile.mkdtemp())
+    signatures.cache_dir = lambda: pabi_dir
+
+    total_queries = 0
+    total_time = 0
+
+    for name, code in codes:
+        clear_signature_caches()
+        queries = 0
+
+        start = time.perf_counter()
+        decompile_bytecode(code, use_cache=False)
+        elapsed = time.perf_counter() - start
+
+        print(f"{name}: {queries} queries, {elapsed:.2f}s")
+
+        total_queries += queries
+        total_time += elapsed
+
+    print(f"total: {total_queries} queries, {total_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
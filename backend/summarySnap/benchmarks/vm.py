@@ -0,0 +1,97 @@
+"""
+    Measures how many instructions per second the symbolic VM executes.
+
+    Runs the loader and then every function of each contract through the VM,
+    up to the point where the decompiler would start simplifying.
+
+        python -m benchmarks.vm [code.bin ...]
+
+    Without arguments it uses the `addr_shortcuts` contracts (kitties,
+    unicorn, ...) that are already in the code cache - run panoramix on
+    them once first to fetch them.
+
+"""
+import logging
+import sys
+import time
+from pathlib import Path
+
+from snaps_backend.__main__ import addr_shortcuts
+from snaps_backend.loader import Loader
+from snaps_backend.utils.helpers import cache_dir
+from snaps_backend.vm import VM
+
+
+class CountingVM(VM):
+    executed = 0
+
+    def apply_stack(self, ret, line):
+        CountingVM.executed += 1
+        super().apply_stack(ret, line)
+
+
+def shortcut_codes():
+    for name, address in addr_shortcuts.items():
+        address = address.lower()
+        path = cache_dir() / "code" / address[:5] / f"{address}.bin"
+        if path.is_file():
+            yield name, path.read_text().strip()
+        else:
+            print(f"{name}: not in cache, skipping")
+
+
+def file_codes(paths):
+    for path in paths:
+        yield Path(path).stem, Path(path).read_text().strip()
+
+
+def run_contract(code):
+    loader = Loader()
+    loader.load_binary(code)
+    loader.run(CountingVM(loader, just_fdests=True))
+
+    for _hash, _name, target, stack in loader.func_list:
+        if target > 1 and loader.lines[target][1] == "jumpdest":
+            target += 1
+
+        try:
+            CountingVM(loader).run(target, stack=stack, timeout=60)
+        except Exception:
+            pass  # the decompiler reports these as problems, we only count
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+
+    if len(sys.argv) > 1:
+        codes = file_codes(sys.argv[1:])
+    else:
+        codes = shortcut_codes()
+
+    total_executed = 0
+    total_time = 0
+
+    for name, code in codes:
+        CountingVM.executed = 0
+
+        start = time.perf_counter()
+        run_contract(code)
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"{name}: {CountingVM.executed} instructions in {elapsed:.2f}s, "
+            f"{CountingVM.executed / elapsed:,.0f}/s"
+        )
+
+        total_executed += CountingVM.executed
+        total_time += elapsed
+
+    if total_time:
+        print(
+            f"total: {total_executed} instructions in {total_time:.2f}s, "
+            f"{total_executed / total_time:,.0f}/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
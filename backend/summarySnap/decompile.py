@@ -1,19 +1,10 @@
 import requests
-from bs4 import BeautifulSoup
 import json
 import re
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome.options import Options
 from dotenv import load_dotenv
 import os
 import time
-from selenium.webdriver.common.action_chains import ActionChains
 from flask_cors import CORS, cross_origin
-from revChatGPT.Official import Chatbot
 
 from flask import Flask
 from flask import request
@@ -23,7 +14,17 @@ load_dotenv()
 app = Flask(__name__)
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
-chatbot = Chatbot(api_key=os.environ["API_KEY"])
+_chatbot = None
+
+
+def get_chatbot():
+    # revChatGPT is slow to import, so it's loaded on first use - or when the
+    # server starts, see below, so that forked workers get it for free
+    global _chatbot
+    if _chatbot is None:
+        from revChatGPT.Official import Chatbot
+        _chatbot = Chatbot(api_key=os.environ["API_KEY"])
+    return _chatbot
 
 def decompile(source):
     r = requests.post('https://ethervm.io/decompile',
@@ -32,6 +33,8 @@ def decompile(source):
 
 
 def decompileDeployed(address):
+    from bs4 import BeautifulSoup  # only used here
+
     r = requests.get('https://ethervm.io/decompile/' + address)
     soup = BeautifulSoup(r.text, 'html.parser')
     arr = soup.find_all('div', class_='code javascript')
@@ -142,7 +145,7 @@ def find_calls(lines, cache, functions):
 
 
 def use_browser(gpt_code):
-    response = chatbot.ask(gpt_code)
+    response = get_chatbot().ask(gpt_code)
     print(response)
     return response["choices"][0]["text"]
 
@@ -170,7 +173,10 @@ def table_inlining(switch_table: dict, fourbyte: str, functions: dict):
 
 
 from snaps_backend.decompiler import decompile_address, decompile_bytecode
-from snaps_backend.utils.supplement import fetch_sig
+from snaps_backend.utils.supplement import fetch_sig, prepare_supplements
+
+# decompresses the signature database in the background, if it's not there yet
+prepare_supplements()
 
 ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
 def get_gpt_query_new(contract_addr, four_byte):
@@ -242,4 +248,5 @@ def hello_world():
 
 if __name__ == '__main__':
     load_dotenv()
+    get_chatbot()
     app.run(port=os.environ["PORT"], debug=True, host='0.0.0.0')
@@ -1,20 +1,21 @@
-import cProfile
+import json
 import logging
 import sys
 
 import coloredlogs
-import timeout_decorator
 
 from snaps_backend.decompiler import decompile_address, decompile_bytecode
+from snaps_backend.utils.config import config
 from snaps_backend.utils.helpers import C
+from snaps_backend.utils.supplement import prepare_supplements
 
 logger = logging.getLogger(__name__)
 
-if "--verbose" in sys.argv:
+if config.verbose:
     log_level = logging.DEBUG
-elif "--silent" in sys.argv:
+elif config.silent:
     log_level = logging.CRITICAL
-elif "--errors" in sys.argv:
+elif config.errors:
     log_level = logging.ERROR
 else:
     log_level = logging.INFO
@@ -72,22 +73,38 @@ def print_decompilation(this_addr):
         if not sys.argv[2].startswith("--"):
             function_name = sys.argv[2]
 
+    workers = None
+    for arg in sys.argv:
+        if arg.startswith("--workers="):
+            workers = int(arg[len("--workers=") :])
+
     if this_addr == "-":
         this_addr = sys.stdin.read().strip()
 
     if len(this_addr) == 42:
-        decompilation = decompile_address(this_addr, function_name)
+        decompilation = decompile_address(
+            this_addr, function_name, workers, profile=config.timings
+        )
     else:
-        decompilation = decompile_bytecode(this_addr, function_name)
+        decompilation = decompile_bytecode(
+            this_addr, function_name, workers, profile=config.timings
+        )
 
     print(decompilation.text)
 
+    if config.timings:
+        print(json.dumps(decompilation.json.get("profile"), indent=2))
+
 
 def main():
+    # overlaps decompressing the signature database (first run only) with
+    # loading the contract
+    prepare_supplements()
+
     if len(sys.argv) == 1:
         print(
             f"""
-        panoramix [address|shortcut|-] [func_name] [--verbose] [--silent] [--profile]
+        panoramix [address|shortcut|-] [func_name] [--verbose] [--silent] [--profile] [--timings] [--workers=N]
 
             address: {C.gray}e.g. 0x06012c8cf97BEaD5deAe237070F9587f8E7A266d
                     you can provide multiple, separating with comma{C.end}
@@ -97,6 +114,10 @@ def main():
 
             --silent: {C.gray}writes output only to the ./cache_pan/ directory{C.end}
 
+            --workers=N: {C.gray}decompile functions in N parallel processes{C.end}
+
+            --timings: {C.gray}print time and trace size for every stage{C.end}
+
         """
         )
         exit(1)
@@ -104,7 +125,9 @@ def main():
     if "," in sys.argv[1]:
         for addr in sys.argv[1].split(","):
             print_decompilation(addr)
-    elif "--profile" in sys.argv:
+    elif config.profile:
+        import cProfile
+
         with cProfile.Profile() as profile:
             print_decompilation(sys.argv[1])
         profile.dump_stats("panoramix.prof")
@@ -5,6 +5,7 @@ import snaps_backend.folder as folder
 import snaps_backend.sparser as sparser
 from snaps_backend.matcher import Any, match
 from snaps_backend.prettify import pprint_ast, pprint_trace, prettify, pretty_stor
+from snaps_backend.utils import budget, profiling
 from snaps_backend.utils.helpers import (
     COLOR_GREEN,
     ENDC,
@@ -79,7 +80,11 @@ class Contract:
 
     def postprocess(self):
         try:
-            self.stor_defs = sparser.rewrite_functions(self.functions)
+            with profiling.timed("sparser.rewrite_functions"):
+                self.stor_defs = sparser.rewrite_functions(self.functions)
+        except budget.BudgetExceeded as e:
+            logger.warning("Storage postprocessing skipped, %s budget exceeded.", e)
+            self.stor_defs = {}
         except Exception:
             # this is critical, because it causes full contract to display very
             # badly, and cannot be limited in scope to just one affected function
@@ -100,7 +105,7 @@ class Contract:
             f for f in self.functions if f.const and f.name.upper() != f.name
         ] + [f for f in self.functions if f.const and f.name.upper() == f.name]
 
-        self.make_asts()
+        profiling.stage("make_asts", self.make_asts)
 
     def make_asts(self):
         """
@@ -201,7 +206,7 @@ class Contract:
             f.ast = replace_f(f.ast, cleanup)
 
     def make_ast(self, trace):
-        trace = folder.fold(trace)
+        trace = profiling.stage("folder.fold", folder.fold, trace)
 
         def store_to_set(line):
             if m := match(line, ("store", ":size", ":off", ":idx", ":val")):
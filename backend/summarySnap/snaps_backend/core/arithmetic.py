@@ -17,11 +17,13 @@ from copy import copy
 
 import snaps_backend.core.algebra as algebra
 from snaps_backend.matcher import Any, match
+from snaps_backend.utils import tracing
 from snaps_backend.utils.helpers import opcode
 
 from snaps_backend.core.masks import get_bit
 
 logger = logging.getLogger(__name__)
+debug = tracing.channel(__name__)
 
 UINT_256_CEILING = 2 ** 256
 UINT_255_MAX = 2 ** 255 - 1
@@ -242,7 +244,7 @@ def eval_bool(exp, known_true=True, symbolic=True):
 
         try:  # a > b iff b < a iff b+1 <= a
             le = algebra.lt_op(algebra.add_op(left, 1), right, 1)
-            logger.debug("le %s %s %s", le, left, right)
+            debug("le %s %s %s", le, left, right)
 
             if le == True:
                 return False
@@ -0,0 +1,112 @@
+"""
+
+    Hash-consing for expressions.
+
+    Expressions stay plain tuples - so match(), opcode() and all the
+    `type(exp) == tuple` checks work as before - but intern_exp makes sure
+    that structurally equal ones are the same object. That saves memory on
+    traces that repeat big mask/storage subexpressions, and makes comparing
+    two interned traces cheap: tuple and list comparison checks identity
+    first, so equal subtrees are never walked.
+
+    A tuple is interned once all its elements are either interned tuples or
+    immutable scalars. The table key uses the ids of the (already interned)
+    subexpressions instead of the subexpressions themselves, so interning is
+    linear in the size of an expression - rehashing every subtree at every
+    level would make it quadratic in depth. Ids stay valid for as long as the
+    key is in the table, because the interned tuple keeps its elements alive.
+
+    Lists (trace blocks) are copied with their elements interned, and tuples
+    holding lists (if/while lines) are rebuilt but never shared.
+
+    The table lives as long as a scope() - the decompiler opens one per
+    function, so expressions don't outlive it, and concurrent decompilations
+    (threads, asyncio tasks) each get their own:
+
+        with interning.scope():
+            trace = simplify_trace(trace)
+
+    Outside of a scope, every intern_exp/intern_trace call uses a table of
+    its own.
+
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# scalars that may appear inside an interned tuple; floats are left out on
+# purpose - 0.0 == -0.0, but they don't print the same
+_scalar_types = frozenset((int, str, bool, bytes, type(None)))
+
+_table = ContextVar("interned", default=None)
+
+
+@contextmanager
+def scope():
+    token = _table.set({})
+    try:
+        yield
+    finally:
+        _table.reset(token)
+
+
+def _intern(exp, table):
+    """Returns (exp with interned subexpressions, whether exp itself is interned)."""
+
+    exp_type = type(exp)
+
+    if exp_type is tuple:
+        items = []
+        types = []
+        ids = []
+        shareable = True
+        changed = False
+
+        for el in exp:
+            new_el, interned = _intern(el, table)
+            changed = changed or new_el is not el
+            items.append(new_el)
+
+            el_type = type(new_el)
+            types.append(el_type)
+            if el_type is tuple and interned:
+                ids.append(id(new_el))
+            elif el_type in _scalar_types:
+                ids.append(new_el)
+            else:
+                shareable = False
+
+        res = tuple(items) if changed else exp
+
+        if not shareable:
+            return res, False
+
+        key = (*types, *ids)
+        if (found := table.get(key)) is not None:
+            return found, True
+
+        table[key] = res
+        return res, True
+
+    if exp_type is list:
+        return [_intern(el, table)[0] for el in exp], False
+
+    return exp, exp_type in _scalar_types
+
+
+def _current():
+    table = _table.get()
+    return {} if table is None else table
+
+
+def intern_exp(exp):
+    return _intern(exp, _current())[0]
+
+
+def intern_trace(trace):
+    table = _current()
+    return [_intern(line, table)[0] for line in trace]
+
+
+def interned_count():
+    table = _table.get()
+    return 0 if table is None else len(table)
@@ -1,7 +1,9 @@
 import logging
-import sys
+from bisect import bisect_left, insort
 
 from snaps_backend.matcher import Any, match
+from snaps_backend.utils.config import config
+from snaps_backend.utils import tracing
 from snaps_backend.utils.helpers import before_after, cached, contains, is_array, opcode, replace
 
 from snaps_backend.core.algebra import (
@@ -41,6 +43,7 @@ from snaps_backend.core.algebra import (
 from snaps_backend.core.masks import find_mask
 
 logger = logging.getLogger(__name__)
+debug = tracing.channel(__name__)
 
 
 def apply_mask_to_range(memloc, size, offset):
@@ -281,7 +284,7 @@ def split_setmem(line):
 
 
 def split_store(line):
-    logger.debug("split_store %s", line)
+    debug("split_store %s", line)
 
     if (
         m := match(
@@ -389,7 +392,7 @@ assert memloc_overwrite(("range", 64, "x"), ("range", 70, add_op("unknown", 100)
 def slice_exp(exp, left, right):
     size = sub_op(right, left)
 
-    logger.debug(f"slicing {exp}, offset {left} bytes, until {right} bytes")
+    debug("slicing %s, offset %s bytes, until %s bytes", exp, left, right)
     # e.g. mem[32 len 10], 2, 4 == mem[34,2]
 
     if m := match(exp, ("mem", ("range", ":rleft", ":rlen"))):
@@ -405,12 +408,13 @@ def slice_exp(exp, left, right):
         else:
             return None
 
-    logger.debug(f"sizeof exp {sizeof(exp)}")
+    if debug.on:
+        debug("sizeof exp %s", sizeof(exp))
     off = sub_op(sizeof(exp), bits(right))
-    logger.debug(f"applying mask, size 8*{size}, offset {off}")
+    debug("applying mask, size 8*%s, offset %s", size, off)
 
     m = mask_op(exp, size=bits(size), offset=off, shr=off)
-    logger.debug(f"result {m}")
+    debug("result %s", m)
     return m
 
 
@@ -449,8 +453,8 @@ def splits_mem(memloc, split, memval, split_val=None):
     m_right = add_op(m_left, m_len)
     s_right = add_op(s_left, s_len)
 
-    logger.debug(f"applying split [{s_left} (len {s_len}) {s_right}]")
-    logger.debug(f"            to [{m_left} (len {m_len}) {m_right}]")
+    debug("applying split [%s (len %s) %s]", s_left, s_len, s_right)
+    debug("            to [%s (len %s) %s]", m_left, m_len, m_right)
 
     if not safe_ge_zero(s_len):
         s_len = "undefined"
@@ -465,16 +469,17 @@ def splits_mem(memloc, split, memval, split_val=None):
     left = safe_max_op(s_left, m_left)
     right = safe_min_op(s_right, m_right)
 
-    logger.debug(f"split overwrites memory from {left} to {right}")
+    debug("split overwrites memory from %s to %s", left, right)
 
     # left/right relative to beginning of memory location
     in_left = sub_op(left, m_left)
     in_right = sub_op(right, m_left)
 
-    logger.debug(f"that is, relative to memloc {in_left} to {in_right}")
+    debug("that is, relative to memloc %s to %s", in_left, in_right)
     if safe_le_op(in_left, m_len) is not True or left is None:
-        logger.debug(
-            f"we are not sure that m_len: {m_len} is bigger than beginning of split, returning []"
+        debug(
+            "we are not sure that m_len: %s is bigger than beginning of split, returning []",
+            m_len,
         )
         return []
 
@@ -620,8 +625,6 @@ def replace_max_with_MAX(exp):
     return exp, res
 
 
-strict = "--strict" in sys.argv
-
 # @cached
 def fill_mem(exp, mem_idx, mem_val):
 
@@ -630,21 +633,21 @@ def fill_mem(exp, mem_idx, mem_val):
     #         there can be no match.
     #
     #         ugly, but shaves off 15% exec time
-    logger.debug(f"filling mem: {exp} with mem[{mem_idx}] == {mem_val}")
+    debug("filling mem: %s with mem[%s] == %s", exp, mem_idx, mem_val)
 
     if (m := match(mem_idx, ("range", ("var", ":num"), Any))) and not contains(
         exp, ("var", m.num)
     ):
-        assert not strict
+        assert not config.strict
         return exp
 
     if (m := match(exp, ("mem", ("range", ("var", ":num"), Any)))) and not contains(
         mem_idx, ("var", m.num)
     ):
-        assert not strict
+        assert not config.strict
         return exp
 
-    logger.debug("no speed improvements")
+    debug("no speed improvements")
 
     # /speed
 
@@ -666,23 +669,23 @@ def _fill_mem(exp, split, split_val):
     m_right = add_op(m_left, m_len)
     s_right = add_op(s_left, s_len)
 
-    logger.debug(f"orig memloc: {m_left} len {m_len} right {m_right}")
-    logger.debug(f"split memloc: {s_left} len {s_len} right {s_right}")
+    debug("orig memloc: %s len %s right %s", m_left, m_len, m_right)
+    debug("split memloc: %s len %s right %s", s_left, s_len, s_right)
 
     if (
         safe_le_op(m_right, s_left) is not False
     ):  # if the split is before memory, or we can't compare - not replacing
-        logger.debug("split before memory or can't compare - not replacing")
+        debug("split before memory or can't compare - not replacing")
         return exp
 
     if safe_le_op(s_right, m_left) is not False:  # -,,- after memory
-        logger.debug("split after memory or can't compare - not replacing")
+        debug("split after memory or can't compare - not replacing")
         return exp
 
     left = safe_max_op(s_left, m_left)
     right = safe_min_op(s_right, m_right)
 
-    logger.debug(f"split begins at {left} ends at {right}")
+    debug("split begins at %s ends at %s", left, right)
 
     if left is None or right is None:
         return exp  # if we can't figure out which one is smaller/larger, we're not replacing
@@ -704,33 +707,33 @@ def _fill_mem(exp, split, split_val):
     res_left = slice_exp(exp, 0, sub_op(left, m_left))
     if res_left is None:
         return exp
-    logger.debug(f"value left untouched on left: {res_left}")
+    debug("value left untouched on left: %s", res_left)
 
     res_right = slice_exp(exp, sub_op(right, m_left), sub_op(m_right, m_left))
     if res_right is None:
         return exp
 
-    logger.debug(f"value right untouched on right: {res_right}")
+    debug("value right untouched on right: %s", res_right)
 
     res = []
 
     if safe_gt_zero(sizeof(res_left)) is True:
-        logger.debug("size of left untouched > 0, adding to output")
+        debug("size of left untouched > 0, adding to output")
         res.append(res_left)
 
     elif safe_gt_zero(sizeof(res_left)) is None:
-        logger.debug("we don't know if left size > 0, aborting")
+        debug("we don't know if left size > 0, aborting")
         return exp
 
     center_in_start = sub_op(left, s_left)
     center_in_len = sub_op(right, s_left)
 
-    logger.debug(f"inserted value offset {center_in_start}, length {center_in_len}")
-    logger.debug(f"cutting this out of {split_val}")
+    debug("inserted value offset %s, length %s", center_in_start, center_in_len)
+    debug("cutting this out of %s", split_val)
 
     res_center = slice_exp(split_val, center_in_start, center_in_len)
 
-    logger.debug(f"inserted value after slicing: {res_center}")
+    debug("inserted value after slicing: %s", res_center)
 
     if res_center is None:
         return exp
@@ -753,6 +756,40 @@ def _fill_mem(exp, split, split_val):
     return ("data",) + tuple(res)
 
 
+def range_base(memloc):
+    """
+        Splits a range into its symbolic base, and a concrete offset and length:
+
+            ('range', ('add', 64, ('var', 1)), 32) -> ((('var', 1),), 64, 32)
+            ('range', 128, 32) -> ((), 128, 32)
+
+        Ranges with the same base can be compared just by their offsets.
+        Returns None if the length is symbolic.
+
+    """
+
+    op, begin, length = memloc
+    assert op == "range"
+
+    if type(length) != int:
+        return None
+
+    if type(begin) == int:
+        return (), begin, length
+
+    if opcode(begin) != "add":
+        return (begin,), 0, length
+
+    base, offset = [], 0
+    for e in begin[1:]:
+        if type(e) == int:
+            offset += e
+        else:
+            base.append(e)
+
+    return tuple(base), offset, length
+
+
 @cached
 def range_overlaps(range1, range2):
     op, r1_begin, r1_len = range1
@@ -760,6 +797,12 @@ def range_overlaps(range1, range2):
     op, r2_begin, r2_len = range2
     assert op == "range"
 
+    if (base1 := range_base(range1)) and (base2 := range_base(range2)):
+        if base1[0] == base2[0]:
+            # same base, no need for symbolic comparisons
+            _, r1_begin, r1_len = base1
+            _, r2_begin, r2_len = base2
+
     r1_end = add_op(r1_begin, r1_len)
     r2_end = add_op(r2_begin, r2_len)
 
@@ -785,6 +828,11 @@ def range_contains(outer, inner):
     op, inner_begin, inner_len = inner
     assert op == "range"
 
+    if (base1 := range_base(outer)) and (base2 := range_base(inner)):
+        if base1[0] == base2[0]:
+            _, outer_begin, outer_len = base1
+            _, inner_begin, inner_len = base2
+
     outer_end = add_op(outer_begin, outer_len)
     inner_end = add_op(inner_begin, inner_len)
 
@@ -824,3 +872,128 @@ assert range_contains(("range", 64, 32), ("range", 64, 10)) == True
 assert range_contains(("range", 64, 32), ("range", 64, 32)) == True
 assert range_contains(("range", 64, 32), ("range", ("var", 1), 32)) == None
 assert range_contains(("range", 10, 32), ("range", 100, "x")) == False
+assert range_overlaps(
+    ("range", ("add", 64, ("var", 1)), 32), ("range", ("add", 96, ("var", 1)), 32)
+) == False
+assert range_contains(
+    ("range", ("add", 64, ("var", 1)), 64), ("range", ("add", 96, ("var", 1)), 32)
+) == True
+
+
+"""
+
+    Range index
+
+    RangeIndex keeps a set of memory ranges under keys, and finds the ones that
+    may overlap a given range, without comparing against all of them.
+
+    Ranges are bucketed by their symbolic base (see range_base) - the same
+    var, or free memory pointer expression, or none for constant ranges.
+    Within a bucket, the offsets are kept sorted, so a query only looks at the
+    ranges that begin near it.
+
+    Only ranges that are disjoint for sure - same base, offsets that don't
+    meet - are left out. Ranges in other buckets, with a symbolic length, or
+    queries with a symbolic length get everything, so the result is a
+    superset of what range_overlaps would say.
+
+"""
+
+
+class RangeIndex:
+    def __init__(self):
+        self.buckets = {}  # base -> [(begin, key), ...] sorted
+        self.longest = {}  # base -> length of its longest range
+        self.ranges = {}  # key -> (base, begin, end), or None for the others
+        self.others = set()  # keys of ranges with a symbolic length
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __repr__(self):
+        return f"RangeIndex({len(self.ranges)} ranges, {len(self.buckets)} bases)"
+
+    def copy(self):
+        res = RangeIndex()
+        res.buckets = {base: list(bucket) for base, bucket in self.buckets.items()}
+        res.longest = dict(self.longest)
+        res.ranges = dict(self.ranges)
+        res.others = set(self.others)
+        return res
+
+    def add(self, key, memloc):
+        if (split := _index_split(memloc)) is None:
+            self.ranges[key] = None
+            self.others.add(key)
+            return
+
+        base, begin, length = split
+        insort(self.buckets.setdefault(base, []), (begin, key))
+        self.ranges[key] = (base, begin, begin + length)
+        self.longest[base] = max(self.longest.get(base, length), length)
+
+    def remove(self, key):
+        if (r := self.ranges.pop(key)) is None:
+            self.others.discard(key)
+            return
+
+        base, begin, _ = r
+        bucket = self.buckets[base]
+        del bucket[bisect_left(bucket, (begin, key))]
+
+        if not bucket:
+            del self.buckets[base]
+            del self.longest[base]
+
+    def overlapping(self, memloc):
+        """Returns the keys of the ranges that may overlap memloc."""
+
+        if (split := _index_split(memloc)) is None:
+            return list(self.ranges)
+
+        base, begin, length = split
+        end = begin + length
+        res = list(self.others)
+
+        for other, bucket in self.buckets.items():
+            if other != base:
+                res.extend(key for _, key in bucket)
+                continue
+
+            # a range that begins before memloc has to end after its beginning,
+            # one that doesn't has to begin before its end
+            lo = bisect_left(bucket, (begin - self.longest[base] + 1,))
+            hi = bisect_left(bucket, (end,))
+
+            for r_begin, key in bucket[lo:hi]:
+                if r_begin >= begin or self.ranges[key][2] > begin:
+                    res.append(key)
+
+        return res
+
+
+def _index_split(memloc):
+    if opcode(memloc) != "range" or (split := range_base(memloc)) is None:
+        return None
+
+    if split[2] <= 0:
+        return None
+
+    return split
+
+
+test_index = RangeIndex()
+test_index.add(1, ("range", 0, 32))
+test_index.add(2, ("range", 64, 32))
+test_index.add(3, ("range", 100, 32))
+assert test_index.overlapping(("range", 40, 32)) == [2]
+assert test_index.overlapping(("range", 32, 32)) == []
+test_index.remove(2)
+assert test_index.overlapping(("range", 40, 32)) == []
+assert sorted(test_index.overlapping(("range", 0, "x"))) == [1, 3]
+
+test_index = RangeIndex()
+test_index.add(1, ("range", ("add", 64, ("var", 1)), 32))
+assert test_index.overlapping(("range", ("add", 96, ("var", 1)), 32)) == []
+assert test_index.overlapping(("range", ("var", 1), 65)) == [1]
+assert test_index.overlapping(("range", ("var", 2), 1)) == [1]
@@ -6,16 +6,28 @@ import os
 import sys
 from contextlib import redirect_stdout
 
-import timeout_decorator
-
 import snaps_backend.folder as folder
-from snaps_backend.contract import Contract
+from snaps_backend.contract import Contract, deserialize
+from snaps_backend.core import interning
 from snaps_backend.function import Function
 from snaps_backend.loader import Loader
-from snaps_backend.prettify import explain, pprint_repr, pprint_trace, pretty_type
+from snaps_backend.prettify import (
+    explain,
+    pprint_repr,
+    pprint_trace,
+    prefetch_fnames,
+    pretty_type,
+)
 from snaps_backend.vm import VM
 from snaps_backend.whiles import make_whiles
-from snaps_backend.utils.helpers import C, rewrite_trace
+from snaps_backend.utils import budget as budgets
+from snaps_backend.utils import tracing
+from snaps_backend.utils.budget import Budget
+from snaps_backend.utils.config import config
+from snaps_backend.utils.helpers import C, cache_scope, rewrite_trace
+from snaps_backend.utils.profiling import Profile, collect, stage, timed
+from snaps_backend.utils.results import load_result, result_key, store_result
+from snaps_backend.utils.signatures import use_abi
 
 logger = logging.getLogger(__name__)
 
@@ -27,31 +39,171 @@ class Decompilation:
     json: dict = dataclasses.field(default_factory=dict)
 
 
-# Derives from BaseException so it bypasses all the "except Exception" that are
-# all around Panoramix code.
-class TimeoutInterrupt(BaseException):
-    """Thrown when a timeout occurs in the `timeout` context manager."""
+# default limits for every function, and for the contract's postprocessing
+FUNCTION_TIMEOUT = 60 * 3
 
-    def __init__(self, value="Timed Out"):
-        self.value = value
 
-    def __str__(self):
-        return repr(self.value)
+def decompile_bytecode(
+    code: str,
+    only_func_name=None,
+    workers=None,
+    use_cache=True,
+    profile=False,
+    budget=None,
+) -> Decompilation:
+    profile = Profile() if profile else None
 
+    loader = Loader()
+    with collect(profile):
+        # Code is actually hex.
+        stage("loader.load_binary", loader.load_binary, code)
+
+    # memoized results are rarely useful for the next contract, and a
+    # long-running process would keep them around until evicted
+    with cache_scope():
+        return _decompile_with_loader(
+            loader, only_func_name, workers, use_cache, profile, budget
+        )
+
+
+def decompile_address(
+    address: str,
+    only_func_name=None,
+    workers=None,
+    use_cache=True,
+    profile=False,
+    budget=None,
+) -> Decompilation:
+    profile = Profile() if profile else None
 
-def decompile_bytecode(code: str, only_func_name=None) -> Decompilation:
     loader = Loader()
-    loader.load_binary(code)  # Code is actually hex.
-    return _decompile_with_loader(loader, only_func_name)
+    with collect(profile):
+        stage("loader.load_addr", loader.load_addr, address)
 
+    with cache_scope():
+        return _decompile_with_loader(
+            loader, only_func_name, workers, use_cache, profile, budget
+        )
 
-def decompile_address(address: str, only_func_name=None) -> Decompilation:
-    loader = Loader()
-    loader.load_addr(address)
-    return _decompile_with_loader(loader, only_func_name)
 
+def print_header(problems, truncated=None):
+    truncated = truncated or {}
+
+    print(C.gray + "# Palkeoramix decompiler. " + C.end)
+
+    if len(problems) > 0:
+        print(C.gray + "#")
+        print("#  I failed with these: ")
+        for p in problems.values():
+            print(f"{C.end}{C.gray}#  - {C.end}{C.fail}{p}{C.end}{C.gray}")
+        print("#  All the rest is below.")
+        print("#" + C.end)
+
+    if len(truncated) > 0:
+        print(C.gray + "#")
+        print("#  I ran out of budget with these, they are shown partially: ")
+        for name, reason in truncated.items():
+            print(
+                f"{C.end}{C.gray}#  - {C.end}{C.fail}{name}{C.end}{C.gray} ({reason})"
+            )
+        print("#" + C.end)
+
+    print()
+
+
+def _decompile_function(loader, target, stack, profile=None, budget=None):
+    """
+        Symbolic execution of a single function, up to (and including) make_whiles.
+        Used both by the serial loop, and by the worker processes.
+
+        Stages are recorded into `profile`, if one is given. The VM and
+        simplify_trace stop early once `budget` is exceeded - the trace is
+        partial then, and `budget.truncated` says why.
+
+        With --trace, the last debug records of the function are printed to
+        stderr when it's done (see utils/tracing.py). Together with a
+        function name on the command line, that traces a single function.
+    """
+
+    if target > 1 and loader.lines[target][1] == "jumpdest":
+        target += 1
+
+    def dec():
+        trace = stage("vm", VM(loader).run, target, stack=stack, timeout=60)
+        explain("Initial decompiled trace", trace[1:])
+
+        if config.explain:
+            trace = rewrite_trace(
+                trace, lambda line: [] if type(line) == str else [line]
+            )
+            explain("Without assembly", trace)
+
+        trace = stage("make_whiles", make_whiles, trace)
+        explain("final", trace)
+
+        if config.explain:
+            explain("folded", folder.fold(trace))
+
+        return trace
+
+    tracer = tracing.Tracer() if config.trace else None
+
+    with collect(profile), budgets.use(budget), tracing.use(tracer):
+        try:
+            # expressions are rarely shared between functions
+            with interning.scope():
+                return dec()
+        finally:
+            if tracer is not None:
+                print(f"trace of the function at {target}:", file=sys.stderr)
+                tracer.dump()
+
+
+"""
+
+    Worker pool mode.
+
+    Every worker gets its own Loader (rebuilt from the binary, without the light
+    execution) and the contract's abi, so jobs never share the module/class-level
+    state. Traces are shipped back in the same form Contract.json() stores them,
+    and turned into tuples again with contract.deserialize. Profiles and the
+    truncation reason travel back with the trace - or attached to the
+    exception, if the job failed.
+
+"""
+
+_worker_loader = None
+
+
+def _init_worker(code, abi):
+    global _worker_loader
+
+    _worker_loader = Loader()
+    _worker_loader.load_binary(code)
+    use_abi(abi)
 
-def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
+
+def _decompile_job(target, stack, profile, budget):
+    profile = Profile() if profile else None
+    budget = budget.fresh()
+
+    try:
+        trace = _decompile_function(_worker_loader, target, stack, profile, budget)
+    except BaseException as e:
+        e.profile = profile
+        raise
+
+    return json.loads(json.dumps(trace)), profile, budget.truncated
+
+
+def _decompile_with_loader(
+    loader,
+    only_func_name=None,
+    workers=None,
+    use_cache=True,
+    profile=None,
+    budget=None,
+) -> Decompilation:
 
     """
 
@@ -119,9 +271,43 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
         and the list of functions within the contract.
     """
 
+    """
+        Results are cached by bytecode hash, for full runs only. A single
+        function can't be served from a full run: its printout depends on
+        the other functions decompiled with it (storage definitions,
+        constants, ordering).
+
+        `budget` holds the limits for every function and for the contract's
+        postprocessing, each of them gets a fresh copy. Whatever ran out of
+        it is listed in json["truncated"] (function hash, or "postprocess").
+
+        Flags that change the printout bypass the cache, and so do profiled
+        runs - they'd just be measuring the cache otherwise.
+    """
+
+    if budget is None:
+        budget = Budget(seconds=FUNCTION_TIMEOUT)
+
+    key = None
+    if (
+        use_cache
+        and only_func_name is None
+        and profile is None
+        and not (config.explain or config.repr or config.returns or config.trace)
+    ):
+        key = result_key(loader.binary, budget)
+
+        if (cached := load_result(key)) is not None:
+            logger.info("Decompilation found in cache.")
+            return Decompilation(**cached)
+
+    # log levels may have changed since the modules were imported
+    tracing.refresh()
+
     logger.info("Running light execution to find functions.")
 
-    loader.run(VM(loader, just_fdests=True))
+    with collect(profile):
+        stage("loader.run", loader.run, VM(loader, just_fdests=True))
 
     if len(loader.lines) == 0:
         # No code.
@@ -134,8 +320,11 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
     """
 
     problems = {}
+    truncated = {}  # hash -> reason
     functions = {}
+    profiles = {}  # hash -> Profile, if profiling
 
+    jobs = []
     for (hash, fname, target, stack) in loader.func_list:
         """
             hash contains function hash
@@ -148,43 +337,77 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
             # skip all the functions that are not it
             continue
 
-        logger.info("Parsing %s...", fname)
-        logger.debug("stack %s", stack)
+        jobs.append((hash, fname, target, stack))
 
+    def add_function(hash, fname, get_trace):
         try:
-            if target > 1 and loader.lines[target][1] == "jumpdest":
-                target += 1
+            trace, reason = get_trace()
+            with collect(profiles.get(hash)):
+                functions[hash] = stage("Function", Function, hash, trace)
 
-            @timeout_decorator.timeout(60 * 3, timeout_exception=TimeoutInterrupt)
-            def dec():
-                trace = VM(loader).run(target, stack=stack, timeout=60)
-                explain("Initial decompiled trace", trace[1:])
+            if reason is not None:
+                logger.warning("%s truncated, %s budget exceeded.", fname, reason)
+                truncated[hash] = reason
 
-                if "--explain" in sys.argv:
-                    trace = rewrite_trace(
-                        trace, lambda line: [] if type(line) == str else [line]
-                    )
-                    explain("Without assembly", trace)
+        except Exception as e:
+            if getattr(e, "profile", None) is not None:  # from a worker
+                profiles[hash] = e.profile
 
-                trace = make_whiles(trace)
-                explain("final", trace)
+            problems[hash] = fname
 
-                if "--explain" in sys.argv:
-                    explain("folded", folder.fold(trace))
+            logger.exception("Problem with %s%s", fname, C.end)
 
-                return trace
+            if config.strict:
+                raise
 
-            trace = dec()
+    if workers is not None and workers > 1 and len(jobs) > 1:
+        # imported here, it's a quarter of the import time of this module
+        from concurrent.futures import ProcessPoolExecutor
+
+        code = bytes(loader.binary).hex()
+
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(jobs)),
+            initializer=_init_worker,
+            initargs=(code, loader.abi),
+        ) as pool:
+            futures = []
+            for (hash, fname, target, stack) in jobs:
+                logger.info("Parsing %s...", fname)
+                logger.debug("stack %s", stack)
+                futures.append(
+                    pool.submit(
+                        _decompile_job, target, stack, profile is not None, budget
+                    )
+                )
 
-            functions[hash] = Function(hash, trace)
+            def get_result(hash, future):
+                trace, func_profile, reason = future.result()
+                if func_profile is not None:
+                    profiles[hash] = func_profile
+                return deserialize(trace), reason
 
-        except (Exception, TimeoutInterrupt):
-            problems[hash] = fname
+            # collected in func_list order, so the output doesn't depend on
+            # which worker finishes first
+            for (hash, fname, _, _), future in zip(jobs, futures):
+                add_function(hash, fname, lambda: get_result(hash, future))
 
-            logger.exception("Problem with %s%s", fname, C.end)
+    else:
+        for (hash, fname, target, stack) in jobs:
+            logger.info("Parsing %s...", fname)
+            logger.debug("stack %s", stack)
 
-            if "--strict" in sys.argv:
-                raise
+            if profile is not None:
+                profiles[hash] = Profile()
+
+            def get_trace():
+                func_budget = budget.fresh()
+                trace = _decompile_function(
+                    loader, target, stack, profiles.get(hash), func_budget
+                )
+                return trace, func_budget.truncated
+
+            add_function(hash, fname, get_trace)
 
     logger.info("Functions decompilation finished, now doing post-processing.")
 
@@ -196,7 +419,18 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
 
     contract = Contract(problems=problems, functions=functions,)
 
-    contract.postprocess()
+    with collect(profile), budgets.use(budget.fresh()) as postprocess_budget:
+        stage("contract.postprocess", contract.postprocess)
+
+    if postprocess_budget.truncated is not None:
+        logger.warning(
+            "Postprocessing truncated, %s budget exceeded.",
+            postprocess_budget.truncated,
+        )
+        truncated["postprocess"] = postprocess_budget.truncated
+
+    with collect(profile), timed("prefetch_fnames"):
+        prefetch_fnames([(func.trace, func.ast) for func in functions.values()])
 
     decompilation = Decompilation()
 
@@ -204,7 +438,8 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
         decompilation.asm.append(l)
 
     try:
-        decompilation.json = contract.json()
+        with collect(profile), timed("contract.json"):
+            decompilation.json = contract.json()
         # This would raise a TypeError if it's not serializable, which is an
         # important assumption people can make.
         json.dump(decompilation.json, open(os.devnull, "w"))
@@ -213,23 +448,19 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
         decompilation.json = {}
 
     text_output = io.StringIO()
-    with redirect_stdout(text_output):
+    with redirect_stdout(text_output), collect(profile), timed("print"):
 
         """
             Print out decompilation header
         """
 
-        print(C.gray + "# Palkeoramix decompiler. " + C.end)
-
-        if len(problems) > 0:
-            print(C.gray + "#")
-            print("#  I failed with these: ")
-            for p in problems.values():
-                print(f"{C.end}{C.gray}#  - {C.end}{C.fail}{p}{C.end}{C.gray}")
-            print("#  All the rest is below.")
-            print("#" + C.end)
-
-        print()
+        print_header(
+            problems,
+            {
+                functions[hash].name if hash in functions else hash: reason
+                for hash, reason in truncated.items()
+            },
+        )
 
         """
             Print out constants & storage
@@ -261,7 +492,7 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
                 shown_already.add(hash)
                 print(func.print())
 
-                if "--repr" in sys.argv:
+                if config.repr:
                     print()
                     pprint_repr(func.trace)
 
@@ -288,11 +519,11 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
 
                 print(func.print())
 
-                if "--returns" in sys.argv:
+                if config.returns:
                     for r in func.returns:
                         print(r)
 
-                if "--repr" in sys.argv:
+                if config.repr:
                     pprint_repr(func.orig_trace)
 
                 print()
@@ -304,4 +535,21 @@ def _decompile_with_loader(loader, only_func_name=None) -> Decompilation:
     decompilation.text = text_output.getvalue()
     text_output.close()
 
+    if truncated and decompilation.json:
+        decompilation.json["truncated"] = truncated
+
+    if profile is not None and decompilation.json:
+        decompilation.json["profile"] = {
+            "contract": profile.json(),
+            "functions": {hash: p.json() for hash, p in profiles.items()},
+        }
+
+    # failed and truncated functions are not worth keeping
+    if (
+        key is not None
+        and len(problems) == 0
+        and len(truncated) == 0
+    ):
+        store_result(key, vars(decompilation))
+
     return decompilation
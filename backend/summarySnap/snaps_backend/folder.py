@@ -3,6 +3,7 @@ import logging
 from snaps_backend.core.arithmetic import comp_bool, is_zero, simplify_bool
 from snaps_backend.matcher import match
 from snaps_backend.prettify import prettify
+from snaps_backend.utils import budget
 from snaps_backend.utils.helpers import (
     COLOR_BLUE,
     COLOR_BOLD,
@@ -130,6 +131,11 @@ def fold(trace):
 
         return log
 
+    except budget.BudgetExceeded as e:
+        # an unfolded trace is still correct, just longer
+        logger.warning("folding stopped, %s budget exceeded.", e)
+        return trace
+
     except Exception:
         # make folder fail gracefuly
         logger.exception(f"folder failed in a function.")
@@ -236,7 +242,7 @@ def fold_aux(trace):
                     if (
                         opcode(last_true) not in TERMINATING
                     ):  # or (last_true ~ ('if', _, _))):
-                        if_true.append(if_false[0])
+                        if_true = if_true + [if_false[0]]
 
                     if_true = fold_aux(if_true)
                     line = ("if", cond, if_true, if_false)
@@ -621,6 +627,7 @@ def merge_ifs(path):
 
 
 def fold_paths(for_merge):
+    budget.check()
 
     if len(for_merge) == 0:
         return []
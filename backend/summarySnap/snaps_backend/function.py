@@ -1,7 +1,6 @@
 import collections
 import json
 import logging
-from copy import deepcopy
 
 from snaps_backend.core.arithmetic import simplify_bool
 from snaps_backend.core.masks import mask_to_type, type_to_mask
@@ -20,6 +19,7 @@ from snaps_backend.utils.helpers import (
     FAIL,
     C,
     EasyCopy,
+    clean_color,
     color,
     find_f,
     find_f_list,
@@ -51,8 +51,26 @@ def find_parents(exp, child):
     return res
 
 
+def find_strings(exp):
+    res = set()
+
+    todo = [exp]
+    while todo:
+        exp = todo.pop()
+        if type(exp) in (list, tuple):
+            todo.extend(exp)
+        elif type(exp) == str:
+            res.add(exp)
+
+    return res
+
+
 class Function(EasyCopy):
     def __init__(self, hash, trace):
+        # see rendered()
+        self._rendered = {}
+        self._rendered_for = (None, None)
+
         self.hash = hash
         self.name = get_func_name(hash)
         self.color_name = get_func_name(hash, add_color=True)
@@ -64,8 +82,11 @@ class Function(EasyCopy):
 
         self.hash = hash
 
-        self.trace = deepcopy(trace)
-        self.orig_trace = deepcopy(self.trace)
+        # The Function owns the trace, nothing else keeps a reference to it.
+        # Stages never modify a trace in place - lines are tuples, and
+        # rewrites build new lists - so orig_trace can share it.
+        self.trace = trace
+        self.orig_trace = trace
 
         self.params = self.make_params()
 
@@ -117,9 +138,37 @@ class Function(EasyCopy):
             new_name, ",".join(p[0] for p in self.params.values())
         )
 
+    def rendered(self):
+        """
+            Memoized renderings of the function - printed text, strings found
+            in the trace. They're computed once, and dropped when `trace` or
+            `ast` is replaced (the stages never modify them in place).
+        """
+
+        trace, ast = self._rendered_for
+        if trace is not self.trace or ast is not self.ast:
+            self._rendered = {}
+            self._rendered_for = (self.trace, self.ast)
+
+        return self._rendered
+
+    def trace_strings(self):
+        cache = self.rendered()
+        if "strings" not in cache:
+            cache["strings"] = find_strings(self.trace)
+
+        return cache["strings"]
+
+    def has_selfdestruct(self):
+        return any("selfdestruct" in s for s in self.trace_strings())
+
+    def has_storage_writes(self):
+        return "store" in self.trace_strings()
+
     def ast_length(self):
         if self.trace is not None:
-            return len((self.print().split("\n"))), len(self.print())
+            text = self.print()
+            return text.count("\n") + 1, len(text)
         else:
             return 0, 0
 
@@ -132,7 +181,7 @@ class Function(EasyCopy):
         if self.trace is None:
             return 0
 
-        if "selfdestruct" in str(self.trace):
+        if self.has_selfdestruct():
             return -1
 
         else:
@@ -262,8 +311,18 @@ class Function(EasyCopy):
         return res
 
     def print(self):
-        out = self._print()
-        return "\n".join(out)
+        cache = self.rendered()
+        if "text" not in cache:
+            cache["text"] = "\n".join(self._print())
+
+        return cache["text"]
+
+    def plain_text(self):
+        cache = self.rendered()
+        if "plain" not in cache:
+            cache["plain"] = clean_color(self.print())
+
+        return cache["plain"]
 
     def _print(self):
         set_func(self.hash)
@@ -397,6 +456,8 @@ class Function(EasyCopy):
 
         exp_text.append(("payable", self.payable))
 
+        strings = self.trace_strings()
+
         self.read_only = True
         for op in [
             "store",
@@ -406,7 +467,7 @@ class Function(EasyCopy):
             "codecall",
             "create",
         ]:
-            if f"'{op}'" in str(self.trace):
+            if op in strings:
                 self.read_only = False
 
         exp_text.append(("read_only", self.read_only))
@@ -417,7 +478,7 @@ class Function(EasyCopy):
 
         self.const = self.read_only
         for exp in ["storage", "calldata", "calldataload", "store", "cd"]:
-            if exp in str(self.trace) or len(self.returns) != 1:
+            if any(exp in s for s in strings) or len(self.returns) != 1:
                 self.const = False
 
         if self.const:
@@ -1,5 +1,6 @@
 import json
 import logging
+from array import array
 import os
 import os.path
 import traceback
@@ -16,7 +17,7 @@ from snaps_backend.utils.helpers import (
     pretty_bignum,
     cache_dir,
 )
-from snaps_backend.utils.opcode_dict import opcode_dict
+from snaps_backend.utils.opcode_dict import opcode_table, push_widths
 from snaps_backend.utils.signatures import get_func_name, make_abi
 from snaps_backend.utils.supplement import fetch_sig
 
@@ -29,22 +30,187 @@ cache_sigs = {
 
 LOADER_TIMEOUT = 60
 
+JUMPDEST = 0x5B
 
-class Loader(EasyCopy):
-    signatures = {}
 
-    lines = {}  # global, let's assume one loader for now
-    binary = []  # array of ints, each int represents a byte in the source file
+def _line_op(byte):
+    op = opcode_table[byte]
+
+    if op == "UNKNOWN":
+        return op, byte
+
+    if op[:3] == "dup":
+        return "dup", int(op[3:])
+
+    if op[:4] == "swap":
+        return "swap", int(op[4:])
+
+    return op, None
+
+
+# (op, param) as they appear in Loader.lines, for every non-push byte
+_line_ops = tuple(_line_op(byte) for byte in range(256))
+
+
+class Bitmap:
+    """A set of offsets in [0, size), one bit per offset."""
+
+    __slots__ = ("size", "bits")
+
+    def __init__(self, size):
+        self.size = size
+        self.bits = bytearray((size + 7) // 8)
+
+    def add(self, offset):
+        self.bits[offset >> 3] |= 1 << (offset & 7)
+
+    def __contains__(self, offset):
+        return (
+            type(offset) == int
+            and 0 <= offset < self.size
+            and self.bits[offset >> 3] >> (offset & 7) & 1 == 1
+        )
+
+    def __iter__(self):
+        return (offset for offset in range(self.size) if offset in self)
+
+
+class Instructions:
+    """
+        Disassembled code, indexed by byte offset.
+
+        Behaves like the `{offset: (offset, op, param)}` dict Loader.lines
+        used to be - `i in lines`, `lines[i]` (KeyError if there is no
+        instruction at i), `len(lines)` - but is stored as parallel arrays:
+
+            offsets[n], opcodes[n] - offset and opcode byte of n-th instruction
+            param_index[n] - position of its argument in params, -1 if none
+            index[offset] - n for an instruction offset, -1 inside push data
+            next_offsets[offset] - offset of the following instruction
+
+        so that next_line is a single lookup instead of a scan.
+        jumpdests is a Bitmap of JUMPDEST offsets.
+
+    """
+
+    def __init__(self, binary):
+        size = len(binary)
+
+        offsets = array("I")
+        opcodes = array("B")
+        param_index = array("i")
+        params = []  # push arguments
+        line_params = []  # the same, but with big numbers prettified
+        index = array("i", [-1]) * size
+        next_offsets = array("I", [0]) * size
+        jumpdests = Bitmap(size)
+
+        line = 0
+        while line < size:
+            byte = binary[line]
+            width = push_widths[byte]
+
+            index[line] = len(offsets)
+            offsets.append(line)
+            opcodes.append(byte)
+
+            if width > 0:
+                # truncated pushes at the end of code take whatever bytes are left
+                imm = binary[line + 1 : line + 1 + width]
+                param = int.from_bytes(imm, "big")
+
+                param_index.append(len(params))
+                params.append(param)
+
+                if param > 1000000000000000:
+                    # convert big numbers into strings if possibble
+                    # should be moved to prettify really
+                    line_params.append(pretty_bignum(param))
+                else:
+                    line_params.append(param)
+
+                end = line + 1 + len(imm)
+                next_offsets[line:end] = array("I", [end]) * (end - line)
+                line = end
+                continue
+
+            if byte == JUMPDEST:
+                jumpdests.add(line)
+
+            param_index.append(-1)
+            next_offsets[line] = line + 1
+            line += 1
+
+        self.size = size
+        self.end = line  # one past the last instruction
+        self.offsets = offsets
+        self.opcodes = opcodes
+        self.param_index = param_index
+        self.params = params
+        self.line_params = line_params
+        self.index = index
+        self.next_offsets = next_offsets
+        self.jumpdests = jumpdests
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __contains__(self, offset):
+        return (
+            type(offset) == int
+            and 0 <= offset < self.size
+            and self.index[offset] >= 0
+        )
+
+    def __getitem__(self, offset):
+        if type(offset) != int or not 0 <= offset < self.size:
+            raise KeyError(offset)
+
+        n = self.index[offset]
+        if n < 0:
+            raise KeyError(offset)
+
+        p = self.param_index[n]
+        if p < 0:
+            return (offset,) + _line_ops[self.opcodes[n]]
+        else:
+            return (offset, opcode_table[self.opcodes[n]], self.line_params[p])
+
+    def items(self):
+        for offset in self.offsets:
+            yield offset, self[offset]
+
+    def parsed(self):
+        """(offset, op, param) with raw opcode names and integer params."""
+        for offset, byte, p in zip(self.offsets, self.opcodes, self.param_index):
+            op = opcode_table[byte]
+            if p >= 0:
+                yield offset, op, self.params[p]
+            else:
+                yield offset, op, byte if op == "UNKNOWN" else None
+
+    def next_line(self, i):
+        """Offset of the first instruction after i, or end if there is none."""
+        if 0 <= i < self.size:
+            return self.next_offsets[i]
+        elif i < 0:
+            return 0
+        else:
+            return None
+
+
+class Loader(EasyCopy):
+    lines = Instructions(b"")  # replaced by load_binary
+    binary = b""  # the code being decompiled
 
     @staticmethod
     def find_sig(sig, add_color=False):
         if "???" in sig:
             return None
 
-        if sig in Loader.signatures:
-            if "unknown" not in Loader.signatures[sig]:
-                return Loader.signatures[sig]
-
         if sig in cache_sigs[add_color]:
             return cache_sigs[add_color][sig]
 
@@ -73,6 +239,9 @@ class Loader(EasyCopy):
         return res
 
     def __init__(self):
+        self.signatures = {}  # per-loader, so concurrent jobs don't share names
+        self.abi = None
+
         self.last_line = None
         self.jump_dests = []
         self.func_dests = {}  # func_name -> jumpdest
@@ -153,20 +322,13 @@ class Loader(EasyCopy):
             logger.exception("Loader issue.")
             self.add_func(0, name="_fallback()")
 
-        make_abi(self.hash_targets)
+        self.abi = make_abi(self.hash_targets)
         for hash, (target, stack) in self.hash_targets.items():
             fname = get_func_name(hash)
             self.func_list.append((hash, fname, target, stack))
 
     def next_line(self, i):
-        i += 1
-        while i not in self.lines and self.last_line > i:
-            i += 1
-
-        if i <= self.last_line:
-            return i
-        else:
-            return None
+        return self.lines.next_line(i)
 
     def add_func(self, target, hash=None, name=None, stack=()):
 
@@ -188,76 +350,27 @@ class Loader(EasyCopy):
 
         self.func_dests[name] = target
 
+    @property
+    def parsed_lines(self):
+        return list(self.lines.parsed())
+
     def disasm(self):
-        for line_no, op, param in self.parsed_lines:
+        for line_no, op, param in self.lines.parsed():
             yield f"{hex(line_no)}, {op}, {hex(param) if param is not None else ''}"
 
     def load_binary(self, source):
-        stack = []
-        self.binary = []
-
         if source[:2] == "0x":
             source = source[2:]
 
-        while len(source[:2]) > 0:
-            num = int("0x" + source[:2], 16)
-            self.binary.append(num)
-            stack = [num] + stack
-            source = source[2:]
-
-        line = 0
-
-        parsed_lines = []
-
-        while len(stack) > 0:
-            popped = stack.pop()
-
-            orig_line = line
-
-            if popped not in opcode_dict:
-                op = "UNKNOWN"
-                param = popped
-
-            else:
-                param = None
-                op = opcode_dict[popped]
-
-                if op == "jumpdest":
-                    self.jump_dests.append(line)
-
-                if op[:4] == "push":
-                    num_words = int(op[4:])
-
-                    param = 0
-                    for i in range(num_words):
-                        try:
-                            param = param * 0x100 + stack.pop()
-                            line += 1
-                        except Exception:
-                            break
-
-            parsed_lines.append((orig_line, op, param))
-            line += 1
-
-        self.parsed_lines = parsed_lines
-        self.last_line = line
-        self.lines = {}
-
-        for line_no, op, param in parsed_lines:
-            if op[:4] == "push" and param > 1000000000000000:
-                param = pretty_bignum(
-                    param
-                )  # convert big numbers into strings if possibble
-                # should be moved to prettify really
-
-            if op[:3] == "dup":
-                param = int(op[3:])
-                op = "dup"
-
-            if op[:4] == "swap":
-                param = int(op[4:])
-                op = "swap"
+        if len(source) % 2 == 1:
+            # a trailing nibble is treated as a separate byte
+            binary = bytes.fromhex(source[:-1]) + bytes([int(source[-1], 16)])
+        else:
+            binary = bytes.fromhex(source)
 
-            self.lines[line_no] = (line_no, op, param)
+        self.binary = binary
+        self.lines = Instructions(binary)
+        self.jump_dests = list(self.lines.jumpdests)
+        self.last_line = self.lines.end
 
         return self.lines
@@ -1,5 +1,6 @@
 import copy
 import builtins
+import functools
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,19 +20,180 @@ class Match:
         raise NotImplementedError()  # For PyLint.
 
 
-class NoMatch(ValueError):
-    def __init__(self, expression, pattern):
-        self.expression = expression
-        self.pattern = pattern
+_SEQUENCE = (list, tuple)
+
+# Compiled matchers are cached by pattern. Patterns are mostly literals, but
+# some are built at runtime from expressions, so the cache is bounded, and the
+# least recently used ones go first.
+MAX_COMPILED = 4096
+
+
+def _is_capture(pattern):
+    return isinstance(pattern, str) and pattern.startswith(":")
+
+
+def _is_constant(pattern):
+    return not (
+        pattern is Any
+        or isinstance(pattern, _SEQUENCE)
+        or _is_capture(pattern)
+        or isinstance(pattern, type)
+    )
+
+
+class _Compiler:
+    """Generates the source of a function that matches one pattern.
+
+    The generated function takes the expression, and either returns a Match,
+    or None at the first check that fails. There is no recursion - every
+    element of the pattern is a line or two of straight code - and on every
+    level the constants (usually the opcode) are checked first, so most
+    expressions are rejected after a single comparison.
+
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.names = {
+            "Match": Match,
+            "isinstance": isinstance,
+            "len": len,
+            "SEQUENCE": _SEQUENCE,
+        }
+        self.captures = {}  # capture name -> local variable
+        self.vars = 0
+
+    def name(self, value):
+        name = f"k{len(self.names)}"
+        self.names[name] = value
+        return name
+
+    def var(self):
+        self.vars += 1
+        return f"e{self.vars}"
+
+    def fail_if(self, condition):
+        self.lines.append(f"    if {condition}: return None")
+
+    def compile(self, pattern):
+        self.node("e0", pattern)
+
+        captures = ", ".join(f"{n!r}: {v}" for n, v in self.captures.items())
+        self.lines.append("    m = Match()")
+        if captures:
+            self.lines.append(f"    m.__dict__.update({{{captures}}})")
+        self.lines.append("    return m")
+
+        args = "".join(f", {name}={name}" for name in self.names)
+        source = f"def matcher(e0{args}):\n" + "\n".join(self.lines)
+
+        namespace = dict(self.names)
+        exec(source, namespace)
+        return namespace["matcher"]
+
+    def node(self, var, pattern):
+        if pattern is Any:
+            return
+
+        if isinstance(pattern, _SEQUENCE):
+            self.sequence(var, pattern)
+
+        elif _is_capture(pattern):
+            self.capture(var, pattern[1:])
+
+        elif isinstance(pattern, type):
+            self.fail_if(f"not isinstance({var}, {self.name(pattern)})")
+
+        else:
+            self.fail_if(f"{var} != {self.name(pattern)}")
+
+    def sequence(self, var, pattern):
+        self.fail_if(f"not isinstance({var}, SEQUENCE)")
+
+        ellipsis = [i for i, elem in enumerate(pattern) if elem is Ellipsis]
+        if ellipsis:
+            # whatever is after the ellipsis is ignored
+            pattern = pattern[: ellipsis[0]]
+            self.fail_if(f"len({var}) < {len(pattern)}")
+        else:
+            self.fail_if(f"len({var}) != {len(pattern)}")
+
+        # constants and types have no side effects, so they can go first
+        for i, elem in enumerate(pattern):
+            if _is_constant(elem):
+                self.node(f"{var}[{i}]", elem)
+
+        for i, elem in enumerate(pattern):
+            if isinstance(elem, type) and elem is not Any:
+                self.node(f"{var}[{i}]", elem)
+
+        for i, elem in enumerate(pattern):
+            if isinstance(elem, _SEQUENCE) or _is_capture(elem):
+                elem_var = self.var()
+                self.lines.append(f"    {elem_var} = {var}[{i}]")
+                self.node(elem_var, elem)
+
+    def capture(self, var, attr):
+        if ":" in attr:
+            type_name, attr = attr.split(":")
+            expected = self.name(getattr(builtins, type_name))
+            self.fail_if(f"not isinstance({var}, {expected})")
+
+        if attr in self.captures:
+            self.fail_if(f"not {self.captures[attr]} == {var}")
+        else:
+            self.captures[attr] = f"c{len(self.captures)}"
+            self.lines.append(f"    {self.captures[attr]} = {var}")
+
+
+def compile_pattern(pattern):
+    """Returns a function that matches expressions against the pattern.
+
+    The function returns a Match, or None, just like match(). Use it for
+    patterns built at runtime, so that they don't go through the cache.
+
+    >>> is_add = compile_pattern(("add", ":left", ":right"))
+    >>> is_add(("add", 1, 2)).right
+    2
+    >>> is_add(("mul", 1, 2)) is None
+    True
+    """
+    return _Compiler().compile(pattern)
+
+
+_compiled = functools.lru_cache(maxsize=MAX_COMPILED)(compile_pattern)
+
+
+def _matcher(pattern):
+    try:
+        return _compiled(pattern)
+    except TypeError:  # If it contains lists.
+        # compiling on every call would cost more than matching
+        return functools.partial(_interpret, pattern)
+
+
+class _NoMatch(Exception):
+    pass
+
+
+def _interpret(pattern, expression):
+    """Matches like a compiled matcher, walking the pattern instead."""
+
+    m = Match()
+    try:
+        _match_helper(expression, pattern, m)
+    except _NoMatch:
+        return None
+    return m
 
 
 def _match_helper(expression, pattern, match):
     if pattern is Any:
         return
 
-    if isinstance(pattern, (list, tuple)):
-        if not isinstance(expression, (list, tuple)):
-            raise NoMatch(expression, pattern)
+    if isinstance(pattern, _SEQUENCE):
+        if not isinstance(expression, _SEQUENCE):
+            raise _NoMatch()
         while True:
             if len(pattern) == 0 and len(expression) == 0:
                 return
@@ -39,26 +201,26 @@ def _match_helper(expression, pattern, match):
                 if pattern[0] is Ellipsis:
                     return
                 else:
-                    raise NoMatch(expression, pattern)
+                    raise _NoMatch()
             if len(pattern) == 0 and len(expression) > 0:
-                raise NoMatch(expression, pattern)
+                raise _NoMatch()
             if pattern[0] is Ellipsis:
                 return
             _match_helper(expression[0], pattern[0], match)
             expression = expression[1:]
             pattern = pattern[1:]
 
-    if isinstance(pattern, str) and pattern.startswith(":"):
+    if _is_capture(pattern):
         attr = pattern[1:]
         if ":" in attr:
             type_name, attr = attr.split(":")
             if not isinstance(expression, getattr(builtins, type_name)):
-                raise NoMatch(expression, pattern)
+                raise _NoMatch()
         if hasattr(match, attr):
             if getattr(match, attr) == expression:
                 return
             else:
-                raise NoMatch(expression, pattern)
+                raise _NoMatch()
         setattr(match, attr, expression)
         return
 
@@ -66,10 +228,10 @@ def _match_helper(expression, pattern, match):
         if isinstance(expression, pattern):
             return
         else:
-            raise NoMatch(expression, pattern)
+            raise _NoMatch()
 
     if expression != pattern:
-        raise NoMatch(expression, pattern)
+        raise _NoMatch()
 
 
 def match(expression, pattern):
@@ -103,19 +265,7 @@ def match(expression, pattern):
     >>> match(("one", "two", 3, 4), (str, ':str:two', ...)).two
     'two'
     """
-    m = Match()
-    try:
-        _match_helper(expression, pattern, m)
-    except NoMatch as e:
-        logger.debug(
-            "match(%r, %r) failed to match %r with %r",
-            expression,
-            pattern,
-            e.expression,
-            e.pattern,
-        )
-        return None
-    return m
+    return _matcher(pattern)(expression)
 
 
 def replace(expression, pattern, replacement):
@@ -138,14 +288,16 @@ def replace(expression, pattern, replacement):
     >>> replace((1, ()), (':a', (':a', ...)), ':a')
     (1, ())
     """
-    m = Match()
-    try:
-        _match_helper(expression, pattern, m)
-    except NoMatch:
+    return _replace(expression, _matcher(pattern), replacement)
+
+
+def _replace(expression, matcher, replacement):
+    m = matcher(expression)
+    if m is None:
         if isinstance(expression, list):
-            return [replace(i, pattern, replacement) for i in expression]
+            return [_replace(i, matcher, replacement) for i in expression]
         if isinstance(expression, tuple):
-            return tuple(replace(i, pattern, replacement) for i in expression)
+            return tuple(_replace(i, matcher, replacement) for i in expression)
         return expression
 
     def replace_matched(e):
@@ -162,6 +314,158 @@ def replace(expression, pattern, replacement):
     return replace_matched(replacement)
 
 
+"""
+    Rule sets.
+
+    Code like prettify() tries a long chain of patterns one after another,
+    and for most expressions, all but one or two fail on the opcode. A Rules
+    set holds such a chain, and indexes it by the head opcode and length of
+    the expression, so that only the rules that could match are tried:
+
+        pretty_rules = Rules("prettify")
+
+        @pretty_rules.rule(("param", ":name"))
+        def pretty_param(exp, m, add_color):
+            return colorize(m.name, COLOR_GREEN, add_color)
+
+        res = pretty_rules.apply(exp, add_color)
+
+    Rules are tried in the order they were registered. A rule function gets
+    the expression, the Match and the extra arguments given to apply(), and
+    returns the result, or None if the rule doesn't apply after all - then
+    the next rule is tried. apply() returns None if no rule applied.
+
+    Every rule counts its hits and misses (matched but returned None, or
+    didn't match), print_rules() shows them.
+
+"""
+
+MAX_INDEX = 4096  # cached candidate lists, per rule set
+
+rules_dict = {}  # name -> Rules
+
+
+class Rule:
+    __slots__ = ("pattern", "func", "matcher", "hits", "misses")
+
+    def __init__(self, pattern, func):
+        self.pattern = pattern
+        self.func = func
+        self.matcher = _matcher(pattern)
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"Rule({self.func.__name__}, {self.pattern!r})"
+
+    def may_match(self, key):
+        """Whether an expression with this index key could match the pattern."""
+
+        pattern = self.pattern
+
+        if not isinstance(pattern, _SEQUENCE):
+            # a constant is never equal to a sequence
+            return key is None or not _is_constant(pattern)
+
+        fixed = pattern
+        ellipsis = [i for i, elem in enumerate(pattern) if elem is Ellipsis]
+        if ellipsis:
+            fixed = pattern[: ellipsis[0]]
+
+        if key is None:
+            # not a sequence, or an empty one
+            return len(fixed) == 0
+
+        head, length = key
+
+        if length < len(fixed) or (length > len(fixed) and not ellipsis):
+            return False
+
+        return not (fixed and _is_constant(fixed[0]) and head != fixed[0])
+
+
+class Rules:
+    def __init__(self, name):
+        self.name = name
+        self.rules = []
+        self.index = {}  # (opcode, length) or None -> candidate rules
+        rules_dict[name] = self
+
+    def __repr__(self):
+        return f"Rules({self.name!r}, {len(self.rules)} rules)"
+
+    def rule(self, *patterns):
+        """Registers the decorated function for every one of the patterns."""
+
+        def register(func):
+            for pattern in patterns:
+                self.add(pattern, func)
+            return func
+
+        return register
+
+    def add(self, pattern, func):
+        self.rules.append(Rule(pattern, func))
+        self.index.clear()
+
+    def candidates(self, exp):
+        if isinstance(exp, _SEQUENCE) and len(exp) > 0:
+            key = (exp[0], len(exp))
+        else:
+            key = None
+
+        try:
+            return self.index[key]
+        except KeyError:
+            pass
+        except TypeError:  # If the head is a list.
+            return [rule for rule in self.rules if rule.may_match(key)]
+
+        if len(self.index) >= MAX_INDEX:
+            self.index.clear()
+
+        res = self.index[key] = [rule for rule in self.rules if rule.may_match(key)]
+        return res
+
+    def apply(self, exp, *args):
+        for rule in self.candidates(exp):
+            m = rule.matcher(exp)
+            if m is not None:
+                res = rule.func(exp, m, *args)
+                if res is not None:
+                    rule.hits += 1
+                    return res
+
+            rule.misses += 1
+
+        return None
+
+    def stats(self):
+        return [
+            {
+                "rule": rule.func.__name__,
+                "pattern": rule.pattern,
+                "hits": rule.hits,
+                "misses": rule.misses,
+            }
+            for rule in self.rules
+        ]
+
+
+def rule_stats():
+    return {name: rules.stats() for name, rules in rules_dict.items()}
+
+
+def print_rules():
+    print(f"{'rule':<40} {'hits':>10} {'misses':>10}  pattern")
+    for name, stats in sorted(rule_stats().items()):
+        for st in stats:
+            rule = f"{name}.{st['rule']}"
+            print(
+                f"{rule:<40} {st['hits']:>10} {st['misses']:>10}  {st['pattern']!r}"
+            )
+
+
 if __name__ == "__main__":
     import doctest
 
@@ -1,5 +1,4 @@
 import logging
-import sys
 from copy import deepcopy
 from functools import partial
 
@@ -19,7 +18,8 @@ from snaps_backend.core.algebra import (
 from snaps_backend.core.arithmetic import is_zero, simplify_bool
 from snaps_backend.core.masks import get_bit, mask_to_type
 from snaps_backend.loader import Loader
-from snaps_backend.matcher import Any, match
+from snaps_backend.matcher import Any, Rules, match
+from snaps_backend.utils.config import config
 from snaps_backend.utils.helpers import (
     COLOR_BLUE,
     COLOR_BOLD,
@@ -45,6 +45,7 @@ from snaps_backend.utils.helpers import (
     to_exp2,
 )
 from snaps_backend.utils.signatures import get_param_name
+from snaps_backend.utils.supplement import prefetch_sig
 
 logger = logging.getLogger(__name__)
 
@@ -66,7 +67,7 @@ prev_trace = None
 def explain(title, trace):
     global prev_trace
 
-    if "--explain" not in sys.argv:
+    if not config.explain:
         return
 
     if trace == prev_trace:
@@ -80,7 +81,7 @@ def explain(title, trace):
 def explain_text(title, params):
     global prev_trace
 
-    if "--explain" not in sys.argv:
+    if not config.explain:
         return
 
     print("\n" + C.blue_back + f" {title}: " + C.end + "\n")
@@ -899,259 +900,323 @@ def pretty_num(exp, add_color):
     return str(exp)
 
 
-def prettify(exp, rem_bool=False, parentheses=True, top_level=False, add_color=False):
+pretty_names = {
+    "number": "block.number",
+    "calldatasize": "calldata.size",
+    "returndatasize": "return_data.size",
+    "difficulty": "block.difficulty",
+    "gasprice": "block.gasprice",
+    "timestamp": "block.timestamp",
+    "coinbase": "block.coinbase",
+    "gaslimit": "block.gas_limit",
+    "callvalue": "call.value",
+    "address": "this.address",
+    "caller": "caller",
+    "origin": "tx.origin",
+    "gas": "gas_remaining",
+}
 
-    col = partial(colorize, add_color=add_color)
-    pret = partial(prettify, add_color=add_color, parentheses=False)
+"""
 
-    if rem_bool:
-        exp = simplify_bool(exp)
-        if opcode(exp) == "bool":
-            return prettify(
-                exp,
-                rem_bool=rem_bool,
-                parentheses=parentheses,
-                top_level=top_level,
-                add_color=add_color,
-            )
+    prettify() tries the rules below in order, and returns the first
+    result - they're indexed by opcode, so only a few are tried for every
+    expression. The rest of prettify() - the rules that rewrite the
+    expression and carry on, instead of returning - follows them.
 
-    if type(exp) == int and exp % (24 * 3600) == 0 and exp > 24 * 3600:
-        exp = ("mul", exp // 3600, 24, 3600)
+"""
 
-    if type(exp) == int and exp % 3600 == 0 and exp > 3600:
-        exp = ("mul", exp // 3600, 3600)
-        # also tried return col('seconds(', COLOR_GRAY) + '1 hour' + col(')', COLOR_GRAY)
-        # but seemed less intuitive, e.g. 0xf64B584972FE6055a770477670208d737Fff282f calcMaxWithdraw
-        # and 3600 every programmer should know, by heart, means 1 hour :)
-        #
-        # also, not tackling single minutes because too often they are not time related
+pretty_rules = Rules("prettify")
 
-    if type(exp) in (int, float):
-        return pretty_num(exp, add_color)
 
-    if opcode(exp) in precompiled.values():
-        return f"{exp[0]}({pret(exp[1])})"
+def _pret(exp, add_color):
+    return prettify(exp, add_color=add_color, parentheses=False)
 
-    if (
-        m := match(exp, ("arr", ":int:num", ("mask_shl", Any, Any, Any, ":str:s")))
-    ) and len(m.s) == m.num + 2:
+
+def pretty_precompiled(exp, m, add_color):
+    return f"{exp[0]}({_pret(exp[1], add_color)})"
+
+
+for name in precompiled.values():
+    pretty_rules.add((name, ...), pretty_precompiled)
+
+
+@pretty_rules.rule(("arr", ":int:num", ("mask_shl", Any, Any, Any, ":str:s")))
+def pretty_arr_string(exp, m, add_color):
+    if len(m.s) == m.num + 2:
         return m.s
 
-    if m := match(exp, ("param", ":name")):
-        return col(m.name, COLOR_GREEN)
 
-    if m := match(exp, ("range", ":loc", ":size")):
-        return "{} {} {}".format(pret(m.loc), col("len", COLOR_HEADER), pret(m.size))
+@pretty_rules.rule(("param", ":name"))
+def pretty_param(exp, m, add_color):
+    return colorize(m.name, COLOR_GREEN, add_color)
 
-    if opcode(exp) == "data":
-        return ", ".join(pretty_memory(exp, add_color=add_color))
 
-    if opcode(exp) == "arr" and len(exp) > 1:
-        _, l, *terms = exp
-        return (
-            col("Array(len=", COLOR_GRAY)
-            + pret(l)
-            + col(", data=", COLOR_GRAY)
-            + pret(("data",) + tuple(terms))
-            + col(")", COLOR_GRAY)
-        )
+@pretty_rules.rule(("range", ":loc", ":size"))
+def pretty_range(exp, m, add_color):
+    return "{} {} {}".format(
+        _pret(m.loc, add_color),
+        colorize("len", COLOR_HEADER, add_color),
+        _pret(m.size, add_color),
+    )
 
-    if m := match(exp, ("blockhash", ":number")):
-        return f"block.hash({pret(m.number)})"
 
-    if m := match(exp, ("extcodehash", ":addr")):
-        return f"ext_code.hash({pret(m.addr)})"
+@pretty_rules.rule(("data", ...))
+def pretty_data(exp, m, add_color):
+    return ", ".join(pretty_memory(exp, add_color=add_color))
 
-    if m := match(exp, ("extcodesize", ":addr")):
-        return f"ext_code.size({pret(m.addr)})"
 
-    if m := match(exp, ("extcodecopy", ":addr", ":loc")):
-        return f"ext_code.copy({pret(m.addr)}, {pret(m.loc)})"
+@pretty_rules.rule(("arr", Any, ...))
+def pretty_arr(exp, m, add_color):
+    _, l, *terms = exp
+    return (
+        colorize("Array(len=", COLOR_GRAY, add_color)
+        + _pret(l, add_color)
+        + colorize(", data=", COLOR_GRAY, add_color)
+        + _pret(("data",) + tuple(terms), add_color)
+        + colorize(")", COLOR_GRAY, add_color)
+    )
 
-    if opcode(exp) == "max":
-        _, *terms = exp
-        return "max({})".format(", ".join([pret(e) for e in terms]))
 
-    if exp == "number":
-        return "block.number"
+@pretty_rules.rule(("blockhash", ":number"))
+def pretty_blockhash(exp, m, add_color):
+    return f"block.hash({_pret(m.number, add_color)})"
 
-    if exp == "calldatasize":
-        return "calldata.size"
 
-    if exp == "returndatasize":
-        return "return_data.size"
+@pretty_rules.rule(("extcodehash", ":addr"))
+def pretty_extcodehash(exp, m, add_color):
+    return f"ext_code.hash({_pret(m.addr, add_color)})"
 
-    if exp == "difficulty":
-        return "block.difficulty"
 
-    if exp == "gasprice":
-        return "block.gasprice"
+@pretty_rules.rule(("extcodesize", ":addr"))
+def pretty_extcodesize(exp, m, add_color):
+    return f"ext_code.size({_pret(m.addr, add_color)})"
 
-    if exp == "timestamp":
-        return "block.timestamp"
 
-    if exp == "coinbase":
-        return "block.coinbase"
+@pretty_rules.rule(("extcodecopy", ":addr", ":loc"))
+def pretty_extcodecopy(exp, m, add_color):
+    return f"ext_code.copy({_pret(m.addr, add_color)}, {_pret(m.loc, add_color)})"
 
-    if exp == "gaslimit":
-        return "block.gas_limit"
 
-    if exp == "callvalue":
-        return "call.value"
+@pretty_rules.rule(("max", ...))
+def pretty_max(exp, m, add_color):
+    _, *terms = exp
+    return "max({})".format(", ".join([_pret(e, add_color) for e in terms]))
 
-    if exp == "address":
-        return "this.address"
 
-    if exp == ("mask_shl", 160, 0, 0, "caller"):
-        return "caller"
+@pretty_rules.rule(("mask_shl", 160, 0, 0, "caller"))
+def pretty_caller(exp, m, add_color):
+    return "caller"
 
-    if exp == "caller":
-        return "caller"
 
-    if exp == ("mask_shl", 160, 0, 0, "origin"):
-        return "tx.origin"
+@pretty_rules.rule(("mask_shl", 160, 0, 0, "origin"))
+def pretty_origin(exp, m, add_color):
+    return "tx.origin"
 
-    if m := match(exp, ("mulmod", ":a", ":b", ":c")):
-        return f"mulmod({pret(m.a)}, {pret(m.b)}, {pret(m.c)})"  # mulmod should really be replaced by mul & mod in other stages
-        # but this is rare enough to ignore for now
 
-    if exp == "origin":
-        return "tx.origin"
+@pretty_rules.rule(("mulmod", ":a", ":b", ":c"))
+def pretty_mulmod(exp, m, add_color):
+    # mulmod should really be replaced by mul & mod in other stages
+    # but this is rare enough to ignore for now
+    a, b, c = (_pret(e, add_color) for e in (m.a, m.b, m.c))
+    return f"mulmod({a}, {b}, {c})"
 
-    if exp == "gas":
-        return "gas_remaining"
 
-    if exp == ("bool", 1):
-        return "True"
+@pretty_rules.rule(("bool", 1))
+def pretty_true(exp, m, add_color):
+    return "True"
 
-    if exp == ("bool", 0):
-        return "False"
 
-    if m := match(exp, ("code.data", ":c_start", ":c_len")):
-        return f"code.data[{pret(m.c_start)} len {pret(m.c_len)}]"
+@pretty_rules.rule(("bool", 0))
+def pretty_false(exp, m, add_color):
+    return "False"
 
-    if m := match(exp, ("balance", ":addr")):
-        return f"eth.balance({pret(m.addr)})"
 
-    if opcode(exp) == "sha3":
-        _, *terms = exp
-        return "sha3({})".format(", ".join([pret(e) for e in terms]))
+@pretty_rules.rule(("code.data", ":c_start", ":c_len"))
+def pretty_code_data(exp, m, add_color):
+    return (
+        f"code.data[{_pret(m.c_start, add_color)} len {_pret(m.c_len, add_color)}]"
+    )
 
-    #    if exp ~ ('mask_shl', 251, 5, 0, :val):
-    #        return pret(('mul', 32, val))
 
-    if (
-        (m := match(exp, ("mask_shl", ":size", 5, 0, ":val")))
-        or (m := match(exp, ("mask", ":size", 5, ":val")))
-    ) and m.size > 245:
-        size, val = m.size, m.val
+@pretty_rules.rule(("balance", ":addr"))
+def pretty_balance(exp, m, add_color):
+    return f"eth.balance({_pret(m.addr, add_color)})"
+
+
+@pretty_rules.rule(("sha3", ...))
+def pretty_sha3(exp, m, add_color):
+    _, *terms = exp
+    return "sha3({})".format(", ".join([_pret(e, add_color) for e in terms]))
+
+
+#    if exp ~ ('mask_shl', 251, 5, 0, :val):
+#        return _pret(('mul', 32, val))
+
+
+@pretty_rules.rule(("mask_shl", ":size", 5, 0, ":val"), ("mask", ":size", 5, ":val"))
+def pretty_round32(exp, m, add_color):
+    if m.size > 245:
+        val = m.val
         if m := match(val, ("add", 31, ":num")):
-            return f"ceil32({pret(m.num)})"
+            return f"ceil32({_pret(m.num, add_color)})"
         else:
-            return f"floor32({pret(val)})"
+            return f"floor32({_pret(val, add_color)})"
 
-    if (
-        m := match(exp, ("call.data", ("add", 36, ("param", ":p_name")), ":size"))
-    ) and m.size == ("cd", ("add", 4, ("param", m.p_name))):
-        return f"{col(m.p_name+'[', C.green)}" + "all" + col("]", C.green)
 
-    if (m := match(exp, (":name", ":offset", ":size"))) and is_array(
-        m.name
-    ):  # in ('call.data', 'ext_call.return_data'):
+@pretty_rules.rule(("call.data", ("add", 36, ("param", ":p_name")), ":size"))
+def pretty_call_data_param(exp, m, add_color):
+    if m.size == ("cd", ("add", 4, ("param", m.p_name))):
+        return (
+            colorize(m.p_name + "[", C.green, add_color)
+            + "all"
+            + colorize("]", C.green, add_color)
+        )
+
+
+@pretty_rules.rule((":name", ":offset", ":size"))
+def pretty_array_slice(exp, m, add_color):
+    if is_array(m.name):  # in ('call.data', 'ext_call.return_data'):
         if m.size == 32:
-            return m.name + f"[{pret(m.offset)}]"
+            return m.name + f"[{_pret(m.offset, add_color)}]"
         else:
-            return m.name + f"[{pret(m.offset)} len {pret(m.size)}]"
-
-    if (
-        (
-            m := match(
-                exp,
-                (
-                    "mask_shl",
-                    ":size",
-                    ":offset",
-                    ":shl",
-                    ("stor", ":s_size", ":s_off", ":s_idx"),
-                ),
+            return (
+                m.name
+                + f"[{_pret(m.offset, add_color)} len {_pret(m.size, add_color)}]"
             )
-        )
-        and safe_le_op(m.s_size, m.size)
-        and m.shl == 0
-    ):
-        return pret(("stor", m.s_size, m.s_off, m.s_idx))
 
-    if opcode(exp) == "stor":
-        return pretty_stor(exp, add_color=add_color)
 
-    if opcode(exp) == "type":
-        return pretty_stor(exp, add_color=add_color)
+@pretty_rules.rule(
+    ("mask_shl", ":size", ":offset", ":shl", ("stor", ":s_size", ":s_off", ":s_idx"))
+)
+def pretty_masked_stor(exp, m, add_color):
+    if safe_le_op(m.s_size, m.size) and m.shl == 0:
+        return _pret(("stor", m.s_size, m.s_off, m.s_idx), add_color)
+
 
-    if opcode(exp) == "field":
-        return pretty_stor(exp, add_color=add_color)
+@pretty_rules.rule(("stor", ...), ("type", ...), ("field", ...))
+def pretty_storage(exp, m, add_color):
+    return pretty_stor(exp, add_color=add_color)
 
-    if m := match(exp, ("cd", ":num")):
-        if m.num == 0:
-            return col("call.func_hash", C.green)
-        parsed_exp = get_param_name(exp, add_color=add_color)
 
-        if type(parsed_exp) != str:
-            return "cd[" + prettify(parsed_exp[1], add_color=add_color) + "]"
-        else:
-            return parsed_exp
-
-    if m := match(exp, ("var", ":int:idx")):
-        nice_names = [
-            "idx",
-            "s",
-            "t",
-            "u",
-            "v",
-            "w",
-            "x",
-            "y",
-            "z",
-            "a",
-            "b",
-            "c",
-            "d",
-            "e",
-            "f",
-            "g",
-            "h",
-        ]  # 'i','j','k','l','m','n','o','p','q','r',
-        if m.idx < len(nice_names):
-            name = nice_names[m.idx]
-        else:
-            name = "var" + str(m.idx)
+@pretty_rules.rule(("cd", ":num"))
+def pretty_cd(exp, m, add_color):
+    if m.num == 0:
+        return colorize("call.func_hash", C.green, add_color)
+    parsed_exp = get_param_name(exp, add_color=add_color)
 
-        return col(name, COLOR_BLUE)
+    if type(parsed_exp) != str:
+        return "cd[" + prettify(parsed_exp[1], add_color=add_color) + "]"
+    else:
+        return parsed_exp
+
+
+@pretty_rules.rule(("var", ":int:idx"))
+def pretty_var_idx(exp, m, add_color):
+    nice_names = [
+        "idx",
+        "s",
+        "t",
+        "u",
+        "v",
+        "w",
+        "x",
+        "y",
+        "z",
+        "a",
+        "b",
+        "c",
+        "d",
+        "e",
+        "f",
+        "g",
+        "h",
+    ]  # 'i','j','k','l','m','n','o','p','q','r',
+    if m.idx < len(nice_names):
+        name = nice_names[m.idx]
+    else:
+        name = "var" + str(m.idx)
 
-    if m := match(exp, ("var", ":name")):
-        return col(str(m.name), COLOR_BLUE)
+    return colorize(name, COLOR_BLUE, add_color)
 
-    if m := match(exp, ("mem", ("range", ":loc", 32))):
-        exp = ("mem", m.loc)
 
-    if m := match(exp, ("mem", ("range", ":loc", ":size"))):
-        return (
-            col("mem[", COLOR_HEADER)
-            + pret(m.loc)
-            + col(" len ", COLOR_HEADER)
-            + pret(m.size)
-            + col("]", COLOR_HEADER)
-        )
+@pretty_rules.rule(("var", ":name"))
+def pretty_var(exp, m, add_color):
+    return colorize(str(m.name), COLOR_BLUE, add_color)
+
+
+@pretty_rules.rule(("mem", ("range", ":loc", 32)))
+def pretty_mem_word(exp, m, add_color):
+    return _pret(("mem", m.loc), add_color)
+
+
+@pretty_rules.rule(("mem", ("range", ":loc", ":size")))
+def pretty_mem_range(exp, m, add_color):
+    return (
+        colorize("mem[", COLOR_HEADER, add_color)
+        + _pret(m.loc, add_color)
+        + colorize(" len ", COLOR_HEADER, add_color)
+        + _pret(m.size, add_color)
+        + colorize("]", COLOR_HEADER, add_color)
+    )
+
+
+@pretty_rules.rule(("mem", ":idx"))
+def pretty_mem(exp, m, add_color):
+    assert opcode(m.idx) != "range"
+
+    return (
+        colorize("mem[", COLOR_HEADER, add_color)
+        + _pret(m.idx, add_color)
+        + colorize("]", COLOR_HEADER, add_color)
+    )
 
-    if m := match(exp, ("mem", ":idx")):
-        assert opcode(m.idx) != "range"
 
-        return col("mem[", COLOR_HEADER) + pret(m.idx) + col("]", COLOR_HEADER)
+@pretty_rules.rule(("setvar", ":idx", ":val"))  # shouldn't be pretty line?
+def pretty_setvar(exp, m, add_color):
+    return _pret(("var", m.idx), add_color) + " = " + _pret(m.val, add_color)
 
-    if m := match(exp, ("setvar", ":idx", ":val")):  # shouldn't be pretty line?
-        return pret(("var", m.idx)) + " = " + pret(m.val, parentheses=False)
 
-    if m := match(exp, ("setmem", ":idx", ":val")):  # --,,--
-        return pret(("mem", m.idx)) + " = " + pret(m.val)
+@pretty_rules.rule(("setmem", ":idx", ":val"))  # --,,--
+def pretty_setmem(exp, m, add_color):
+    return _pret(("mem", m.idx), add_color) + " = " + _pret(m.val, add_color)
+
+
+def prettify(exp, rem_bool=False, parentheses=True, top_level=False, add_color=False):
+
+    col = partial(colorize, add_color=add_color)
+    pret = partial(prettify, add_color=add_color, parentheses=False)
+
+    if rem_bool:
+        exp = simplify_bool(exp)
+        if opcode(exp) == "bool":
+            return prettify(
+                exp,
+                rem_bool=rem_bool,
+                parentheses=parentheses,
+                top_level=top_level,
+                add_color=add_color,
+            )
+
+    if type(exp) == int and exp % (24 * 3600) == 0 and exp > 24 * 3600:
+        exp = ("mul", exp // 3600, 24, 3600)
+
+    if type(exp) == int and exp % 3600 == 0 and exp > 3600:
+        exp = ("mul", exp // 3600, 3600)
+        # also tried return col('seconds(', COLOR_GRAY) + '1 hour' + col(')', COLOR_GRAY)
+        # but seemed less intuitive, e.g. 0xf64B584972FE6055a770477670208d737Fff282f calcMaxWithdraw
+        # and 3600 every programmer should know, by heart, means 1 hour :)
+        #
+        # also, not tackling single minutes because too often they are not time related
+
+    if type(exp) in (int, float):
+        return pretty_num(exp, add_color)
+
+    if type(exp) == str and exp in pretty_names:
+        return pretty_names[exp]
+
+    res = pretty_rules.apply(exp, add_color)
+    if res is not None:
+        return res
 
     if m := match(exp, ("mask_shl", ":size", ":offset", ":shl", ":val")):
         size, offset, shl, val = m.size, m.offset, m.shl, m.val
@@ -1427,6 +1492,32 @@ def try_fname(exp, add_color=False):
         return None
 
 
+def prefetch_fnames(exp):
+    """
+        try_fname probes every constant that gets printed, which would be
+        a database query each. This looks up all the candidates in `exp`
+        (a trace, or anything made of lists and tuples) at once.
+    """
+
+    sigs = []
+
+    todo = [exp]
+    while todo:
+        e = todo.pop()
+
+        if type(e) in (list, tuple):
+            todo.extend(e)
+
+        elif type(e) == int and e >= 0:  # same candidates as in try_fname
+            sigs.append(hex(e)[:10])
+            if len(hex(e)) >= 63:
+                sigs.append(padded_hex(e, 64)[:10])
+            if len(hex(e)) >= 8:
+                sigs.append(padded_hex(e, 8)[:10])
+
+    prefetch_sig(sig for sig in sigs if "???" not in sig and len(sig) >= 8)
+
+
 def pretty_fname(exp, add_color=False, force=False):
     if type(exp) == int:
         if try_fname(exp) and "unknown_" not in try_fname(exp):
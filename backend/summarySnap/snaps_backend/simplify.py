@@ -1,4 +1,6 @@
 import collections
+import heapq
+import itertools
 import logging
 import sys
 from copy import copy
@@ -40,7 +42,9 @@ from snaps_backend.core.algebra import (
 )
 from snaps_backend.core.arithmetic import is_zero, to_real_int
 from snaps_backend.core.masks import get_bit, to_mask, to_neg_mask
+from snaps_backend.core.interning import intern_trace
 from snaps_backend.core.memloc import (
+    RangeIndex,
     apply_mask_to_range,
     fill_mem,
     memloc_overwrite,
@@ -57,6 +61,7 @@ from snaps_backend.prettify import (
     pprint_trace,
     pretty_repr,
 )
+from snaps_backend.utils import budget, profiling, tracing
 from snaps_backend.utils.helpers import (
     C,
     cached,
@@ -74,6 +79,7 @@ from snaps_backend.utils.helpers import (
     rewrite_trace_ifs,
     rewrite_trace_multiline,
     to_exp2,
+    trampoline,
     walk_trace,
 )
 
@@ -81,6 +87,7 @@ from snaps_backend.postprocess import cleanup_mul_1
 from snaps_backend.rewriter import postprocess_exp, postprocess_trace, rewrite_string_stores
 
 logger = logging.getLogger(__name__)
+debug = tracing.channel(__name__)
 logger.level = logging.CRITICAL  # switch to INFO for detailed
 
 
@@ -122,7 +129,7 @@ logger.level = logging.CRITICAL  # switch to INFO for detailed
         - the worst that will happen is that some edge cases in some contracts won't get simplified, but they
           will still be correct
 
-        - bulk_compare.py is your friend for testing your changes. in Eveem I use something like it for initial
+        - benchmarks/bulk_compare.py is your friend for testing your changes. in Eveem I use something like it for initial
           tests and then do a huge integration comparison before each release, checking thousands of contracts for
           changes
 
@@ -132,59 +139,182 @@ logger.level = logging.CRITICAL  # switch to INFO for detailed
 """
 
 
-def simplify_trace(trace):
+class LineCache:
+    """
 
-    old_trace = None
-    count = 0
-    while trace != old_trace and count < 40:
-        count += 1
+        What a line-local pass made of every line in its last run - the next
+        run only computes the lines that changed since then.
 
-        old_trace = trace
+        f(line) may depend on nothing but the line. Lines that hold blocks
+        (ifs, whiles) can't be hashed, so f is called for them every time, and
+        it's up to f to go into the blocks through the cache.
 
-        # fun fact:
-        # you can do prettify.pprint_trace(trace) or prettify.pprint_repr(trace)
-        # between every stage here to see changes that happen to the code.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.last = {}
+        self.current = {}
+        self.reused = 0
+        self.computed = 0
+
+    def start(self):
+        # keeps just the lines of the last run, not of every run before
+        self.last, self.current = self.current, {}
+
+    def __call__(self, line):
+        try:
+            return self.current[line]
+        except TypeError:  # it holds a block
+            return self.f(line)
+        except KeyError:
+            pass
+
+        if line in self.last:
+            self.reused += 1
+            res = self.last[line]
+        else:
+            self.computed += 1
+            res = self.f(line)
+
+        self.current[line] = res
+        return res
+
+
+def _simplify_expressions():
+    # replace_f(trace, simplify_exp), one line at a time
+    def simplify_line(line):
+        if type(line) != tuple or list not in map(type, line):
+            return replace_f(line, simplify_exp)
+
+        return simplify_exp(
+            tuple([lines(l) for l in e] if type(e) == list else lines(e) for e in line)
+        )
+
+    lines = LineCache(simplify_line)
+
+    def simplify_expressions(trace):
+        lines.start()
+        return [lines(line) for line in trace]
+
+    simplify_expressions.caches = (lines,)
+    return simplify_expressions
+
+
+def _split_setmems_and_storages():
+    setmems, stores = LineCache(split_setmem), LineCache(split_store)
 
-        trace = replace_f(trace, simplify_exp)
-        explain("simplify expressions", trace)
+    def split_setmems_and_storages(trace):
+        setmems.start()
+        stores.start()
+        trace = rewrite_trace(trace, setmems)
+        return rewrite_trace_full(trace, stores)
 
-        trace = cleanup_vars(trace)
-        explain("cleanup variables", trace)
+    split_setmems_and_storages.caches = (setmems, stores)
+    return split_setmems_and_storages
 
-        trace = cleanup_mems(trace)
-        explain("cleanup mems", trace)
 
-        trace = rewrite_trace(trace, split_setmem)
-        trace = rewrite_trace_full(trace, split_store)
-        explain("split setmems & storages", trace)
+def _loops_to_setmems(trace):
+    return rewrite_trace(trace, loop_to_setmem)
 
-        trace = cleanup_vars(trace)
-        explain("cleanup vars", trace)
 
-        trace = replace_f(trace, simplify_exp)
-        explain("simplify expressions", trace)
+def simplify_passes():
+    """(title, pass) - one round of simplify_trace runs them in this order.
 
-        trace = cleanup_mul_1(trace)
-        explain("simplify expressions", trace)
+    The passes that rewrite every line on its own keep LineCaches, so in later
+    rounds they only go over the lines that changed. Every simplify_trace
+    needs a fresh set of them.
 
-        trace = cleanup_msize(trace)
-        explain("calculate msize", trace)
+    """
+
+    # there is a logic to this ordering, but it would take a long
+    # time to explain. if you play with it, just run through bulk_compare.py
+    # and see how it affects the code.
+    return (
+        ("simplify expressions", _simplify_expressions()),
+        ("cleanup variables", cleanup_vars),
+        ("cleanup mems", cleanup_mems),
+        ("split setmems & storages", _split_setmems_and_storages()),
+        ("cleanup vars", cleanup_vars),
+        ("simplify expressions", _simplify_expressions()),
+        ("simplify expressions", cleanup_mul_1),
+        ("calculate msize", cleanup_msize),
+        ("replace storage with length", replace_bytes_or_string_length),
+        ("cleanup unused ifs", cleanup_conds),
+        ("convert loops to setmems", _loops_to_setmems),
+        ("move loop indexes outside of loops", propagate_storage_in_loops),
+    )
+
+
+def simplify_trace(trace):
+
+    # All the passes are pure functions of the trace, so every pass remembers
+    # the last trace it got and what it returned. If nothing touched the trace
+    # since then (usually the case in the last rounds, where only one or two
+    # passes still find something to do), the pass isn't run again. If
+    # something did, the line-local passes still only redo the lines that
+    # changed (see LineCache).
+
+    passes = simplify_passes()
+    last_input = [None] * len(passes)
+    last_output = [None] * len(passes)
+    changes = [0] * len(passes)
+    skipped = 0
+
+    trace = intern_trace(trace)
+    old_trace = None
+    count = 0
+    while trace != old_trace and count < 40:
+        if (truncated := budget.spend(rounds=1)) is not None:
+            logger.warning(
+                "simplify_trace stopped after %s rounds, %s budget exceeded.",
+                count,
+                truncated,
+            )
+            break
 
-        trace = replace_bytes_or_string_length(trace)
-        explain("replace storage with length", trace)
+        count += 1
 
-        trace = cleanup_conds(trace)
-        explain("cleanup unused ifs", trace)
+        old_trace = trace
 
-        trace = rewrite_trace(trace, loop_to_setmem)
-        explain("convert loops to setmems", trace)
+        # fun fact:
+        # you can do prettify.pprint_trace(trace) or prettify.pprint_repr(trace)
+        # between every stage here to see changes that happen to the code.
 
-        trace = propagate_storage_in_loops(trace)
-        explain("move loop indexes outside of loops", trace)
+        for idx, (title, f) in enumerate(passes):
+            name = "simplify_trace." + f.__name__.lstrip("_")
 
-        # there is a logic to this ordering, but it would take a long
-        # time to explain. if you play with it, just run through bulk_compare.py
-        # and see how it affects the code.
+            if last_input[idx] is not None and trace == last_input[idx]:
+                trace = last_output[idx]
+                skipped += 1
+                profiling.count(name, skipped=1)
+            else:
+                last_input[idx] = trace
+                trace = profiling.stage(name, f, trace)
+                last_output[idx] = trace
+
+                if trace != last_input[idx]:
+                    changes[idx] += 1
+
+            explain(title, trace)
+
+            if budget.exceeded() is not None:
+                break
+
+        # equal subexpressions share one object after this, so the
+        # `trace != old_trace` check above compares them by identity
+        trace = intern_trace(trace)
+
+    caches = [cache for _, f in passes for cache in getattr(f, "caches", ())]
+    debug(
+        "simplify_trace: %s rounds, %s passes skipped, changes per pass: %s, "
+        "lines computed/reused by the line-local passes: %s/%s",
+        count,
+        skipped,
+        changes,
+        sum(cache.computed for cache in caches),
+        sum(cache.reused for cache in caches),
+    )
 
     # final lightweight postprocessing
     # introduces new variables, simplifies code for human readability
@@ -331,7 +461,7 @@ def simplify_exp(exp):
         exp = (m.op, add_op(*t1), add_op(*t2))
 
     if m := match(exp, ("add", ":e")):
-        logger.debug("single add")
+        debug("single add")
         return simplify_exp(m.e)
 
     if m := match(exp, ("mul", 1, ":e")):
@@ -1068,7 +1198,7 @@ def loop_to_setmem_from_storage(line):
     setmem = path[0]
     cont = path[1]
 
-    logger.debug("loop_to setmem_from_storage: %s\n%s\n%s", setmem, cont, cond)
+    debug("loop_to setmem_from_storage: %s\n%s\n%s", setmem, cont, cond)
 
     # (setmem, mem_idx, mem_val)
     mem_idx, mem_val = setmem[1], setmem[2]
@@ -1094,7 +1224,7 @@ def loop_to_setmem_from_storage(line):
     if not only_add_in_expr(storage_key):
         return
 
-    logger.debug("now look at the continue")
+    debug("now look at the continue")
     update_memory_index = (
         "setvar",
         memory_index_var,
@@ -1108,7 +1238,7 @@ def loop_to_setmem_from_storage(line):
     if set(cont[2]) != {update_memory_index, update_storage_key}:
         return
 
-    logger.debug("setvars")
+    debug("setvars")
     memory_index_start = None
     storage_key_start = None
     memory_index_init = None
@@ -1123,7 +1253,7 @@ def loop_to_setmem_from_storage(line):
         else:
             return
 
-    logger.debug("while condition")
+    debug("while condition")
     if memory_index_var not in vars_in_expr(cond):
         return
     if opcode(cond) != "gt":
@@ -1135,7 +1265,7 @@ def loop_to_setmem_from_storage(line):
     mem_rng = ("range", memory_index_start, mem_count)
     storage_rng = ("range", storage_key_start, ("div", mem_count, 32))
 
-    logger.debug("mem_rng: %s, storage_rng: %s", mem_rng, storage_rng)
+    debug("mem_rng: %s, storage_rng: %s", mem_rng, storage_rng)
     return [("setmem", mem_rng, ("storage", 256, 0, storage_rng))]
 
 
@@ -1434,67 +1564,54 @@ assert affects(line_test, exp_test) == True
 """
 
 
-def trace_uses_mem(trace, mem_idx):
+def cleanup_mems(trace, in_loop=False):
     """
+        for every setmem, replace future occurences of it with it's value,
+        if possible, and drop the setmem if nothing reads it afterwards
 
-        checks if memory is used anywhere in the trace
+        This is a single forward pass. It gives the same result as making a
+        replace_mem pass over the rest of the trace for every setmem, in order,
+        and then checking if the rest of the trace still uses that memory:
 
-    """
+        - the values of the setmems are live until overwritten (LiveMems), and
+          get substituted into every line in the order those passes would have
+          made - so each line sees what the passes before would have made of it,
+        - for every setmem, MemUses watches the memory it wrote, as the lines
+          look right after its pass, until something reads it (keep the setmem)
+          or overwrites all of it, or the trace ends (drop it).
 
-    for idx, line in enumerate(trace):
+        Both find the setmems a line touches through a RangeIndex, instead
+        of checking each of them.
 
-        if m := match(line, ("setmem", ":memloc", ":memval")):
-            memloc, memval = m.memloc, m.memval
-            memval = simplify_exp(memval)
+    """
 
-            if exp_uses_mem(memval, mem_idx):
-                return True
+    return _cleanup_mems(trace, LiveMems(), MemUses(), MemScope(), in_loop)
 
-            split = memloc_overwrite(
-                mem_idx, memloc
-            )  # returns range that we're confident wasn't overwritten by memloc
-            res2 = trace[idx + 1 :]
-            for s_idx in split:
-                if trace_uses_mem(res2, s_idx):
-                    return True
 
-            return False
+class MemScope:
+    # shared by a cleanup_mems call and the branches it goes into
+    def __init__(self):
+        self.groups = itertools.count()  # numbers the setmems, in trace order
+        self.kept = set()  # setmems that turned out to be used
 
-        elif opcode(line) == "while":
-            if while_uses_mem(line, mem_idx):
-                return True
 
-        elif m := match(line, ("if", ":cond", ":if_true", ":if_false")):
+def _cleanup_mems(trace, live, uses, scope, in_loop=False):
+    res = []
+    groups = {}  # index in res -> setmem that is kept only if it's used
 
-            if (
-                exp_uses_mem(m.cond, mem_idx)
-                or trace_uses_mem(m.if_true, mem_idx)
-                or trace_uses_mem(m.if_false, mem_idx)
-            ):
-                return True
+    for line in trace:
+        if opcode(line) == "while":
+            line, versions = live.apply_while(line)
+            uses.check_while(versions, scope)
 
-        elif opcode(line) == "continue":
-            return True
+        elif opcode(line) == "if":
+            line = _cleanup_mems_if(line, live, uses, scope)
 
         else:
-            if exp_uses_mem(line, mem_idx):
-                return True
-
-    return False
+            versions = live.apply(line)
+            uses.check(versions, scope)
+            line = versions[-1][1]
 
-
-def cleanup_mems(trace, in_loop=False):
-    """
-        for every setmem, replace future occurences of it with it's value,
-        if possible
-
-    """
-
-    # pprint_trace(trace)
-
-    res = []
-
-    for idx, line in enumerate(trace):
         if match(line, ("setmem", ":rng", ("mem", ":rng"))):
             continue
 
@@ -1507,36 +1624,326 @@ def cleanup_mems(trace, in_loop=False):
             res.append(line)
 
         elif m := match(line, ("setmem", ":mem_idx", ":mem_val")):
-            mem_idx, mem_val = m.mem_idx, m.mem_val
+            if budget.exceeded() is not None:
+                # once out of budget the remaining setmems are kept as they are
+                res.append(line)
+                continue
 
-            # find all the future occurences of var and replace if possible
-            if not affects(line, mem_val):
-                remaining_trace = replace_mem(trace[idx + 1 :], mem_idx, mem_val)
-            else:
-                remaining_trace = trace[idx + 1 :]
+            group = next(scope.groups)
 
-            if in_loop or trace_uses_mem(remaining_trace, mem_idx):
-                res.append(line)
+            # replace all the future occurences, from the next line on
+            if not affects(line, m.mem_val):
+                live.add((group,), *mem_piece(m.mem_idx, m.mem_val))
 
-            res.extend(cleanup_mems(remaining_trace))
+            if in_loop:
+                scope.kept.add(group)
+                in_loop = False
+            else:
+                uses.add((group,), m.mem_idx)
 
-            break
+            groups[len(res)] = group
+            res.append(line)
 
         elif opcode(line) == "while":
             _, cond, path, *rest = line
             path = cleanup_mems(path)
             res.append(("while", cond, path,) + tuple(rest))
 
-        elif opcode(line) == "if":
-            _, cond, if_true, if_false = line
-            if_true = cleanup_mems(if_true)
-            if_false = cleanup_mems(if_false)
-            res.append(("if", cond, if_true, if_false))
-
         else:
             res.append(line)
 
-    return res
+    return [
+        line
+        for idx, line in enumerate(res)
+        if idx not in groups or groups[idx] in scope.kept
+    ]
+
+
+def _cleanup_mems_if(line, live, uses, scope):
+    # the live setmems, and the ones being watched, go into both branches -
+    # where the setmems of the branch itself come after them
+
+    _, cond, if_true, if_false = line
+    conds = [((), cond)]
+    live_true, live_false = live.copy(), live.copy()
+
+    for key in sorted(live.pieces):
+        mem_idx, mem_val = live.pieces[key]
+
+        if (new := replace_mem_exp(cond, mem_idx, mem_val)) != cond:
+            cond = new
+            conds.append((key, cond))
+
+        live_true.replace(
+            key,
+            *mem_piece(
+                apply_constraint(mem_idx, cond), apply_constraint(mem_val, cond)
+            ),
+        )
+        live_false.replace(
+            key,
+            *mem_piece(
+                apply_constraint(mem_idx, is_zero(cond)),
+                apply_constraint(mem_val, is_zero(cond)),
+            ),
+        )
+
+    uses.check(conds, scope)
+
+    if_true = _cleanup_mems(if_true, live_true, uses.copy(), scope)
+    if_false = _cleanup_mems(if_false, live_false, uses.copy(), scope)
+
+    return ("if", cond, if_true, if_false)
+
+
+def mem_piece(mem_idx, mem_val):
+    # the form in which replace_mem substitutes a setmem
+    mem_idx = simplify_exp(mem_idx)
+    mem_val = simplify_exp(mem_val)
+
+    if type(mem_val) is tuple and opcode(mem_val) != "mem":
+        mem_val = arithmetic.eval(mem_val)
+
+    return mem_idx, mem_val
+
+
+def version_at(versions, group):
+    # a line as the pass of the given setmem left it
+    for key, line in reversed(versions):
+        if key == () or key[0] <= group:
+            return line
+
+
+class LiveMems:
+    """
+
+        Values of the setmems that are substituted forward, under keys
+        ordered the way the passes of replace_mem would go over the trace.
+
+        A setmem's key is (n,), with n counting the setmems in trace order.
+        When a later setmem overwrites part of one, the parts left are
+        substituted from the next line on as key + (0,), key + (1,), ...
+
+    """
+
+    def __init__(self):
+        self.pieces = {}  # key -> (mem_idx, mem_val)
+        self.by_idx = RangeIndex()
+        self.by_read = RangeIndex()  # memory that the values read, for affects()
+        self.reads = {}  # key -> number of its reads in by_read
+        self.msize = set()  # keys of the values that depend on msize
+
+    def add(self, key, mem_idx, mem_val):
+        self.pieces[key] = (mem_idx, mem_val)
+        self.by_idx.add(key, mem_idx)
+
+        s = str(mem_val)
+        if "msize" in s:
+            self.msize.add(key)
+
+        if type(mem_val) == tuple and "mem" in s:
+            mems = find_mems(mem_val)
+            for idx, m in enumerate(mems):
+                self.by_read.add((key, idx), m[1])
+            self.reads[key] = len(mems)
+
+    def copy(self):
+        res = LiveMems()
+        res.pieces = dict(self.pieces)
+        res.by_idx = self.by_idx.copy()
+        res.by_read = self.by_read.copy()
+        res.reads = dict(self.reads)
+        res.msize = set(self.msize)
+        return res
+
+    def replace(self, key, mem_idx, mem_val):
+        if self.pieces[key] != (mem_idx, mem_val):
+            self.remove(key)
+            self.add(key, mem_idx, mem_val)
+
+    def remove(self, key):
+        del self.pieces[key]
+        self.by_idx.remove(key)
+        self.msize.discard(key)
+
+        for idx in range(self.reads.pop(key, 0)):
+            self.by_read.remove((key, idx))
+
+    def apply(self, line):
+        """
+            Substitutes the live values into a line that's not an if or a
+            while, and updates them for what a setmem overwrites.
+
+            Returns the versions of the line - [(key, line), ...], with the
+            line as it is after the values up to key were substituted.
+
+        """
+
+        setmem = opcode(line) == "setmem"
+        versions = [((), line)]
+        queue, queued, queried = [], set(), set()
+        split = []
+
+        def query(line):
+            found = []
+            for m in find_mems(line):
+                if m not in queried:
+                    queried.add(m)
+                    found.extend(self.by_idx.overlapping(m[1]))
+
+            if setmem and ("setmem", line[1]) not in queried:
+                # values it overwrites, values that read what it overwrites
+                queried.add(("setmem", line[1]))
+                found.extend(self.by_idx.overlapping(simplify_exp(line[1])))
+                found.extend(key for key, _ in self.by_read.overlapping(line[1]))
+                found.extend(self.msize)
+
+            for key in found:
+                if key not in queued and key > after:
+                    queued.add(key)
+                    heapq.heappush(queue, key)
+
+        after = ()
+        query(line)
+
+        while queue:
+            key = after = heapq.heappop(queue)
+            mem_idx, mem_val = self.pieces[key]
+
+            if setmem:
+                memloc = simplify_exp(line[1])
+                new = line
+                if contains(line, "mem"):
+                    new = replace_mem_exp(line, mem_idx, mem_val)
+
+                if range_overlaps(memloc, mem_idx):
+                    self.remove(key)
+                    for idx, s in enumerate(splits_mem(mem_idx, memloc, mem_val)):
+                        split.append((key + (idx,), *mem_piece(s[0], s[1])))
+                elif affects(line, mem_val):
+                    self.remove(key)
+
+            else:
+                new = replace_mem_line(line, mem_idx, mem_val)
+
+            if new != line:
+                line = new
+                versions.append((key, line))
+                query(line)
+
+        for key, mem_idx, mem_val in split:
+            self.add(key, mem_idx, mem_val)
+
+        return versions
+
+    def apply_while(self, line):
+        # a loop may overwrite a value, or what it reads, in ways a RangeIndex
+        # can't tell - those get checked one by one
+        versions = [((), line)]
+
+        for key in sorted(self.pieces):
+            mem_idx, mem_val = self.pieces[key]
+
+            if affects(line, mem_val) or affects(line, ("mem", mem_idx)):
+                self.remove(key)
+                continue
+
+            _, cond, path, jds, vars = line
+            vars = [replace_mem_exp(v, mem_idx, mem_val) for v in vars]
+            cond = replace_mem_exp(cond, mem_idx, mem_val)
+            path = replace_mem(path, mem_idx, mem_val)
+
+            line = ("while", cond, path, jds, vars)
+            versions.append((key, line))
+
+        return line, versions
+
+
+class MemUses:
+    """
+
+        Memory written by the setmems, watched until it's read - or overwritten
+        in whole, or the trace ends.
+
+        Every setmem is checked on the lines as its own replace_mem pass left
+        them, and parts of it are dropped as later setmems overwrite them.
+        Branches get a copy of the watched memory - a read in any branch keeps
+        the setmem, an overwrite only counts within the branch.
+
+    """
+
+    def __init__(self):
+        self.pending = {}  # key -> mem_idx
+        self.index = RangeIndex()
+
+    def add(self, key, mem_idx):
+        self.pending[key] = mem_idx
+        self.index.add(key, mem_idx)
+
+    def remove(self, key):
+        del self.pending[key]
+        self.index.remove(key)
+
+    def copy(self):
+        res = MemUses()
+        res.pending = dict(self.pending)
+        res.index = self.index.copy()
+        return res
+
+    def keep(self, key, scope):
+        scope.kept.add(key[0])
+        self.remove(key)
+
+    def check(self, versions, scope):
+        if not self.pending:
+            return
+
+        line = versions[0][1]
+        setmem = opcode(line) == "setmem"
+
+        if opcode(line) == "continue":
+            for key in list(self.pending):
+                self.keep(key, scope)
+            return
+
+        found = set()
+        for _, line in versions:
+            if setmem:
+                found.update(self.index.overlapping(line[1]))
+                line = simplify_exp(line[2])
+
+            for m in find_mems(line):
+                found.update(self.index.overlapping(m[1]))
+
+        split = []
+
+        for key in sorted(found):
+            mem_idx = self.pending[key]
+            line = version_at(versions, key[0])
+
+            if key[0] in scope.kept:
+                self.remove(key)
+
+            elif not setmem:
+                if exp_uses_mem(line, mem_idx):
+                    self.keep(key, scope)
+
+            elif exp_uses_mem(simplify_exp(line[2]), mem_idx):
+                self.keep(key, scope)
+
+            elif (rest := memloc_overwrite(mem_idx, line[1])) != [mem_idx]:
+                self.remove(key)
+                split.extend((key + (idx,), s) for idx, s in enumerate(rest))
+
+        for key, mem_idx in split:
+            self.add(key, mem_idx)
+
+    def check_while(self, versions, scope):
+        for key in sorted(self.pending):
+            if key[0] in scope.kept:
+                self.remove(key)
+            elif while_uses_mem(version_at(versions, key[0]), self.pending[key]):
+                self.keep(key, scope)
 
 
 @cached
@@ -1614,12 +2021,15 @@ def replace_mem(trace, mem_idx, mem_val):
         ... (the rest unchanged)
 
     """
-    mem_idx = simplify_exp(mem_idx)
-    mem_val = simplify_exp(mem_val)
-    mem_id = ("mem", mem_idx)
 
-    if type(mem_val) is tuple and opcode(mem_val) != "mem":
-        mem_val = arithmetic.eval(mem_val)
+    return trampoline(_replace_mem(trace, mem_idx, mem_val))
+
+
+def _replace_mem(trace, mem_idx, mem_val):
+    # replace_mem, yielding its recursive calls to trampoline()
+
+    mem_idx, mem_val = mem_piece(mem_idx, mem_val)
+    mem_id = ("mem", mem_idx)
 
     res = []
 
@@ -1627,13 +2037,16 @@ def replace_mem(trace, mem_idx, mem_val):
 
         if m := match(line, ("setmem", ":memloc", Any)):
             memloc = simplify_exp(m.memloc)
-            # replace in val
-            res.append(replace_mem_exp(line, mem_idx, mem_val))
+            # replace in val - if it reads any memory at all, which most don't
+            if contains(line, "mem"):
+                res.append(replace_mem_exp(line, mem_idx, mem_val))
+            else:
+                res.append(line)
             if range_overlaps(memloc, mem_idx):
                 split = splits_mem(mem_idx, memloc, mem_val)
                 res2 = trace[idx + 1 :]
                 for s in split:
-                    res2 = replace_mem(res2, s[0], s[1])
+                    res2 = yield (_replace_mem, res2, s[0], s[1])
 
                 res.extend(res2)
                 return res
@@ -1657,7 +2070,7 @@ def replace_mem(trace, mem_idx, mem_val):
 
             if not affects(line, ("mem", mem_idx)) and not affects(line, (mem_val)):
                 cond = replace_mem_exp(cond, mem_idx, mem_val)
-                path = replace_mem(path, mem_idx, mem_val)
+                path = yield (_replace_mem, path, mem_idx, mem_val)
 
             res.append(("while", cond, path, jds, vars))
 
@@ -1669,30 +2082,32 @@ def replace_mem(trace, mem_idx, mem_val):
             mem_idx_false = apply_constraint(mem_idx, is_zero(cond))
             mem_val_false = apply_constraint(mem_val, is_zero(cond))
 
-            if_true = replace_mem(if_true, mem_idx_true, mem_val_true)
-            if_false = replace_mem(if_false, mem_idx_false, mem_val_false)
+            if_true = yield (_replace_mem, if_true, mem_idx_true, mem_val_true)
+            if_false = yield (_replace_mem, if_false, mem_idx_false, mem_val_false)
 
             res.append(("if", cond, if_true, if_false))
 
         else:
-            # speed
-            test = "mem" in str(line)
-            if (
-                test
-                and (m := match(mem_idx, ("add", Any, ("var", ":num"))))
-                and str(("var", m.num)) not in str(line)
-            ):
-                test = False
-            # / speed
+            res.append(replace_mem_line(line, mem_idx, mem_val))
 
-            if test:
-                l = replace_mem_exp(line, mem_idx, mem_val)
-            else:
-                l = line
+    return res
 
-            res.append(l)
 
-    return res
+def replace_mem_line(line, mem_idx, mem_val):
+    # speed
+    test = "mem" in str(line)
+    if (
+        test
+        and (m := match(mem_idx, ("add", Any, ("var", ":num"))))
+        and str(("var", m.num)) not in str(line)
+    ):
+        test = False
+    # / speed
+
+    if test:
+        return replace_mem_exp(line, mem_idx, mem_val)
+
+    return line
 
 
 """
@@ -2172,7 +2587,7 @@ def while_uses_mem(line, mem_idx):
 
 
 def exp_uses_mem(exp, mem_idx):
-    mems = find_mems([exp])
+    mems = find_mems(exp)
 
     for m in mems:
         op, m_idx = m
@@ -4,6 +4,7 @@ from snaps_backend.core.algebra import divisible_bytes, minus_op, safe_le_op, to
 from snaps_backend.core.masks import mask_to_type
 from snaps_backend.matcher import Any, match
 from snaps_backend.prettify import pprint_trace, pretty_stor
+from snaps_backend.utils import budget
 from snaps_backend.utils.helpers import (
     COLOR_GRAY,
     COLOR_GREEN,
@@ -143,6 +144,8 @@ def rewrite_functions(functions):
 
     """
 
+    budget.check()
+
     storages = list(find_stores([f.trace for f in functions]))
 
     # (storage 256 0 (sha3 (cd 4) 7)
@@ -160,8 +163,12 @@ def rewrite_functions(functions):
     replace_names_in_assoc(names, storages_assoc)
     replace_names_in_assoc_bool(names, storages_assoc)
 
-    for func in functions:
-        func.trace = repl_stor(func.trace, storages_assoc)
+    # last chance to give up - the functions get their new traces below
+    budget.check()
+
+    traces = [repl_stor(func.trace, storages_assoc) for func in functions]
+    for func, trace in zip(functions, traces):
+        func.trace = trace
 
     stordefs = {}
 
@@ -0,0 +1,149 @@
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+"""
+
+    Cooperative execution budgets.
+
+    A Budget holds the limits for decompiling one function (or postprocessing
+    a contract): wall time, VM node count, simplify_trace rounds and memory
+    growth. Long-running loops - VM.run, simplify_trace, folder.fold_paths,
+    sparser - check the active budget at their heads, and once it's exceeded
+    they stop and return what they have so far. The reason is kept in
+    `budget.truncated`, so that the caller can tag the result.
+
+    Unlike the SIGALRM-based timeouts used before, budgets never interrupt
+    code at an arbitrary point, and work in any thread. The active budget is
+    a ContextVar, so every thread (and asyncio task) has its own.
+
+        with use(Budget(seconds=180)) as budget:
+            trace = make_whiles(VM(loader).run(target))
+
+        if budget.truncated:
+            ...
+
+    Without an active budget, the checks are no-ops.
+
+    What a budget guarantees: it's checked after every round of the VM's
+    node exploration, after every simplify_trace pass, at every setmem of
+    cleanup_mems, at every loop whiles.make reconstructs, and in the folder
+    and sparser loops.
+    Stages stop with a partial result: the VM and simplify_trace with what
+    they have so far, cleanup_mems and whiles.make by leaving the remaining
+    setmems and loops as they are, folder by not folding. Sparser can't, so
+    it raises BudgetExceeded, and the storage postprocessing is skipped.
+
+    What it doesn't: there's no hard wall-clock cap. Whatever runs between
+    two checks - one VM round, one expression simplification, one range
+    comparison - runs to completion, so a budget can be overshot by the
+    longest such step. Callers that need a hard limit have to run the
+    decompilation in a process they can kill.
+
+"""
+
+
+class BudgetExceeded(Exception):
+    """Raised by check(), for stages that can't return a partial result."""
+
+
+PAGE_SIZE = resource.getpagesize()
+
+
+def rss():
+    """
+        The process's resident memory right now, in bytes. Where there's no
+        /proc, the peak since the process started - which only tells whether
+        it grew past an earlier peak.
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Budget:
+    def __init__(self, seconds=None, nodes=None, rounds=None, memory=None):
+        self.seconds = seconds
+        self.nodes = nodes
+        self.rounds = rounds
+        # bytes the RSS may grow by - not its absolute size, which in a
+        # long-running worker depends on whatever ran before
+        self.memory = memory
+
+        self.start = time.monotonic()
+        self.start_rss = rss() if memory is not None else None
+        self.nodes_used = 0
+        self.rounds_used = 0
+        self.truncated = None  # reason, once exceeded
+
+    def __repr__(self):
+        return (
+            f"Budget(seconds={self.seconds}, nodes={self.nodes}, "
+            f"rounds={self.rounds}, memory={self.memory})"
+        )
+
+    def fresh(self):
+        """Same limits, nothing spent yet."""
+        return Budget(self.seconds, self.nodes, self.rounds, self.memory)
+
+    def exceeded(self):
+        if self.truncated is None:
+            self.truncated = self._exceeded()
+
+        return self.truncated
+
+    def _exceeded(self):
+        if self.seconds is not None and time.monotonic() - self.start > self.seconds:
+            return "time"
+
+        if self.nodes is not None and self.nodes_used > self.nodes:
+            return "vm nodes"
+
+        if self.rounds is not None and self.rounds_used > self.rounds:
+            return "simplify rounds"
+
+        if self.memory is not None and rss() - self.start_rss > self.memory:
+            return "memory"
+
+        return None
+
+
+_active = ContextVar("budget", default=None)
+
+
+@contextmanager
+def use(budget):
+    token = _active.set(budget)
+    try:
+        yield budget
+    finally:
+        _active.reset(token)
+
+
+def spend(nodes=0, rounds=0):
+    """Accounts for the work done, returns the truncation reason, if any."""
+
+    budget = _active.get()
+    if budget is None:
+        return None
+
+    budget.nodes_used += nodes
+    budget.rounds_used += rounds
+
+    return budget.exceeded()
+
+
+def exceeded():
+    return spend()
+
+
+def check():
+    if (reason := spend()) is not None:
+        raise BudgetExceeded(reason)
@@ -0,0 +1,31 @@
+import sys
+
+"""
+
+    Command line switches, parsed once on import.
+
+    Modules used to check `"--flag" in sys.argv` wherever they needed a
+    switch - including the VM, once per executed instruction. They read
+    `config.<flag>` instead now.
+
+"""
+
+
+class Config:
+    def __init__(self, argv=()):
+        self.explain = "--explain" in argv
+        self.verbose = "--verbose" in argv
+        self.silent = "--silent" in argv
+        self.errors = "--errors" in argv
+        self.strict = "--strict" in argv
+        self.repr = "--repr" in argv
+        self.returns = "--returns" in argv
+        self.profile = "--profile" in argv
+        self.timings = "--timings" in argv
+        self.trace = "--trace" in argv
+
+    def __repr__(self):
+        return f"Config({vars(self)})"
+
+
+config = Config(sys.argv)
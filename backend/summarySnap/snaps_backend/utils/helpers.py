@@ -3,7 +3,10 @@ import math
 import re
 import string
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
 from copy import copy, deepcopy
+from functools import wraps
 from pathlib import Path
 from appdirs import user_cache_dir
 
@@ -148,24 +151,132 @@ def before_after(func):
     return wrapper
 
 
-def cached(func):
-    cache = {}
+"""
+    Memoization.
+
+    Every @cached function gets its own bounded cache, registered in
+    `cached_dict` by qualified name. When a cache is full, entries are evicted
+    in insertion order, but entries that were hit since the last pass get a
+    second chance (CLOCK, an approximation of LRU that doesn't rehash the key
+    on every hit - keys are often large expressions).
+
+    decompile_bytecode and decompile_address run in `with cache_scope():`,
+    which clears the caches on exit, so nothing from one contract is kept
+    for the next in a long-running process. Caches that stay valid across
+    contracts (e.g. signature lookups) are declared @cached(scoped=False)
+    and survive that.
+
+    print_cached() shows the size and hit rate of every cache.
+
+"""
+
+CACHE_SIZE = 100_000  # default max entries per cached function
+
+cached_dict = {}  # name -> Cache
+
+
+class Cache:
+    def __init__(self, name, maxsize, scoped):
+        self.name = name
+        self.maxsize = maxsize
+        self.scoped = scoped
+        self.data = OrderedDict()  # key -> [value, hit since last eviction pass]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def put(self, key, value):
+        """Stores a value computed elsewhere, e.g. by a batched lookup."""
+
+        self.data[key] = [value, False]
+        if len(self.data) > self.maxsize:
+            self.evict()
+
+    def evict(self):
+        data = self.data
+        while len(data) > self.maxsize:
+            try:
+                key, entry = data.popitem(last=False)
+            except KeyError:  # cleared by another thread meanwhile
+                break
+            if entry[1]:
+                entry[1] = False
+                data[key] = entry
+            else:
+                self.evictions += 1
+
+    def clear(self):
+        self.data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def cached(func=None, maxsize=None, scoped=True):
+    if func is None:  # used as @cached(...)
+        return lambda func: cached(func, maxsize, scoped)
+
+    cache = Cache(
+        f"{func.__module__}.{func.__qualname__}",
+        CACHE_SIZE if maxsize is None else maxsize,
+        scoped,
+    )
+    cached_dict[cache.name] = cache
+    data = cache.data
 
+    @wraps(func)
     def wrapper(*args, **kwargs):
         key = args + tuple(kwargs.items())
         try:
-            return cache[key]
-        except TypeError: # If it contains lists.
+            entry = data[key]
+        except TypeError:  # If it contains lists.
             return func(*args, **kwargs)
         except KeyError:
             pass
+        else:
+            cache.hits += 1
+            entry[1] = True
+            return entry[0]
+
+        cache.misses += 1
         ret = func(*args, **kwargs)
-        cache[key] = ret
+        data[key] = [ret, False]
+        if len(data) > cache.maxsize:
+            cache.evict()
         return ret
 
+    wrapper.cache = cache
     return wrapper
 
 
+def clear_caches(scoped_only=True):
+    for cache in cached_dict.values():
+        if cache.scoped or not scoped_only:
+            cache.clear()
+
+
+@contextmanager
+def cache_scope():
+    try:
+        yield
+    finally:
+        clear_caches()
+
+
+def cache_stats():
+    return {name: cache.stats() for name, cache in cached_dict.items()}
+
+
 ARRAY_OPCODES = [
     "call.data",
     "ext_call.return_data",
@@ -300,7 +411,14 @@ def rewrite_trace_ifs(trace, f):
 
 
 def print_cached():
-    print(repr(cached_dict))
+    print(f"{'cache':<50} {'size':>8} {'hits':>10} {'misses':>10} {'hit rate':>8}")
+    for name, stats in sorted(cache_stats().items()):
+        calls = stats["hits"] + stats["misses"]
+        rate = f"{stats['hits'] / calls:.0%}" if calls else "-"
+        print(
+            f"{name:<50} {stats['size']:>8} "
+            f"{stats['hits']:>10} {stats['misses']:>10} {rate:>8}"
+        )
 
 
 class EasyCopy:
@@ -399,6 +517,42 @@ def walk_trace(trace, f):
     return res
 
 
+def trampoline(gen):
+    """
+        Runs a recursive function written as a generator, without growing
+        the Python stack. Instead of calling itself, the function yields
+        `(func, *args)`, and gets back the result of `func(*args)` - where
+        func is a generator function too:
+
+            def _length(lst):
+                if not lst:
+                    return 0
+                return 1 + (yield (_length, lst[1:]))
+
+            trampoline(_length(lst))
+
+        Useful for passes that recurse once per line of a trace, which can
+        be thousands of lines long.
+
+    """
+
+    stack = [gen]
+    value = None
+
+    while True:
+        try:
+            call = stack[-1].send(value)
+        except StopIteration as e:
+            stack.pop()
+            if not stack:
+                return e.value
+            value = e.value
+        else:
+            func, *args = call
+            stack.append(func(*args))
+            value = None
+
+
 def all_concrete(*args):
     for a in args:
         if type(a) not in (int, float):
@@ -337,3 +337,16 @@ stack_diffs = {
     "dup16": 1,
     "swap16": 0,
 }
+
+"""
+    256-entry lookups derived from opcode_dict, used by the loader
+    to disassemble a contract in a single pass
+
+    opcode_table[byte] - opcode name, or "UNKNOWN"
+    push_widths[byte] - number of immediate bytes (0 for everything but pushes)
+
+"""
+
+opcode_table = tuple(opcode_dict.get(byte, "UNKNOWN") for byte in range(256))
+
+push_widths = tuple(int(op[4:]) if op[:4] == "push" else 0 for op in opcode_table)
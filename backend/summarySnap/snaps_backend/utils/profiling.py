@@ -0,0 +1,132 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+"""
+
+    Per-stage timings of the decompilation pipeline.
+
+    A Profile collects, for every stage name: number of calls, total wall
+    time, and the size of the trace (lines - including lines of nested
+    blocks - and AST nodes) going into the first call and coming out of the
+    last one. Stages can also add their own counters, e.g. VM node count.
+
+    Code marks its stages with
+
+        trace = stage("make_whiles", make_whiles, trace)
+
+    or `with timed("name"):` for blocks that don't take a trace. Both record
+    into the profile activated with `with collect(profile):`, and cost just
+    one check when no profile is active - which is the default.
+
+    A stage that raises (e.g. because of the function timeout) is recorded
+    too, with an `interrupted` counter, so that the profile shows where the
+    time went.
+
+    Like budgets, the active profile is a ContextVar, so concurrent
+    decompilations record into their own profiles.
+
+"""
+
+
+class Profile:
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, elapsed=0.0, before=None, after=None, calls=1, **counters):
+        st = self.stages.get(name)
+        if st is None:
+            st = self.stages[name] = {"calls": 0, "time": 0.0}
+            if before is not None:
+                st["lines_before"], st["nodes_before"] = before
+
+        st["calls"] += calls
+        st["time"] += elapsed
+
+        if after is not None:
+            st["lines_after"], st["nodes_after"] = after
+
+        for counter, value in counters.items():
+            st[counter] = st.get(counter, 0) + value
+
+    def json(self):
+        return {
+            name: dict(st, time=round(st["time"], 6))
+            for name, st in self.stages.items()
+        }
+
+
+_active = ContextVar("profile", default=None)
+
+
+@contextmanager
+def collect(profile):
+    token = _active.set(profile)
+    try:
+        yield profile
+    finally:
+        _active.reset(token)
+
+
+def trace_size(trace):
+    lines = 0
+    nodes = 0
+
+    todo = [trace]
+    while todo:
+        exp = todo.pop()
+        nodes += 1
+
+        if type(exp) == list:
+            lines += len(exp)
+            todo.extend(exp)
+        elif type(exp) == tuple:
+            todo.extend(exp)
+
+    return lines, nodes
+
+
+def stage(name, f, *args, **kwargs):
+    profile = _active.get()
+    if profile is None:
+        return f(*args, **kwargs)
+
+    before = None
+    if args and type(args[0]) == list:
+        before = trace_size(args[0])
+
+    start = time.perf_counter()
+    try:
+        res = f(*args, **kwargs)
+    except BaseException:
+        profile.add(name, time.perf_counter() - start, before, interrupted=1)
+        raise
+
+    elapsed = time.perf_counter() - start
+    after = trace_size(res) if type(res) == list else None
+    profile.add(name, elapsed, before, after)
+
+    return res
+
+
+@contextmanager
+def timed(name):
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        profile.add(name, time.perf_counter() - start, interrupted=1)
+        raise
+
+    profile.add(name, time.perf_counter() - start)
+
+
+def count(name, **counters):
+    profile = _active.get()
+    if profile is not None:
+        profile.add(name, calls=0, **counters)
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from pathlib import Path
+
+from snaps_backend.utils.helpers import cache_dir, cached
+from snaps_backend.utils.supplement import supplements_id
+
+"""
+
+    Content-addressed store for finished decompilations.
+
+    Results are keyed by sha256 of the runtime bytecode, a version stamp of
+    the decompiler itself (a hash of the package sources), the signature
+    database and the budget limits - so changing any of them invalidates the
+    old entries automatically.
+
+    Layout mirrors the `code` and `pabi` caches:
+
+        cache_dir()/results/<key[:3]>/<key>.pickle
+
+    Every write goes to a temporary file in the same directory first, and is
+    then moved into place with os.replace, so concurrent processes never see
+    a partially written result. Reads touch the file, and the store is
+    trimmed to MAX_RESULTS_SIZE bytes by removing the least recently used
+    entries.
+
+    Trimming has to list the whole store, so it doesn't run on every write:
+    only on a process's first one, and then after every EVICT_SLACK bytes
+    written. The store can go over the limit by that much per process.
+
+"""
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS_SIZE = 256 * 1024 * 1024
+EVICT_SLACK = MAX_RESULTS_SIZE // 16
+
+# bytes written since the last eviction, racy between threads - which only
+# makes an eviction come a write early or late
+_unchecked = EVICT_SLACK
+
+
+def results_dir():
+    return cache_dir() / "results"
+
+
+@cached(scoped=False)
+def decompiler_version():
+    package_dir = Path(__file__).parent.parent
+
+    h = hashlib.sha256()
+    for path in sorted(package_dir.rglob("*.py")):
+        h.update(str(path.relative_to(package_dir)).encode())
+        h.update(path.read_bytes())
+
+    return h.hexdigest()[:16]
+
+
+def result_key(binary, budget=None):
+    h = hashlib.sha256(decompiler_version().encode())
+    h.update(supplements_id().encode())
+    h.update(repr(budget).encode())
+    h.update(bytes(binary))
+    return h.hexdigest()
+
+
+def _result_path(key):
+    return results_dir() / key[:3] / f"{key}.pickle"
+
+
+def load_result(key):
+    path = _result_path(key)
+
+    try:
+        with path.open("rb") as f:
+            result = pickle.load(f)
+        os.utime(path)  # mark as recently used
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception("Broken result cache entry %s, ignoring.", path)
+        return None
+
+    return result
+
+
+def store_result(key, result):
+    path = _result_path(key)
+    if not path.parent.is_dir():
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, path)
+    except Exception:
+        logger.exception("Failed to store result %s.", path)
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        return
+
+    global _unchecked
+
+    _unchecked += path.stat().st_size
+    if _unchecked >= EVICT_SLACK:
+        _unchecked = 0
+        evict_results()
+
+
+def evict_results(max_size=None):
+    max_size = MAX_RESULTS_SIZE if max_size is None else max_size
+
+    entries = []
+    total = 0
+    for path in results_dir().glob("*/*.pickle"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # evicted by another process
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    if total <= max_size:
+        return
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+        total -= size
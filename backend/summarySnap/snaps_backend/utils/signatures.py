@@ -23,7 +23,7 @@ from snaps_backend.utils.helpers import (
     opcode,
     cache_dir,
 )
-from snaps_backend.utils.supplement import fetch_sigs
+from snaps_backend.utils.supplement import fetch_sigs_many
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +31,18 @@ _abi = None
 _func = None
 
 
+def use_abi(abi):
+    """
+        Installs an abi generated by make_abi (e.g. in a worker process that
+        didn't run the loader itself).
+    """
+    global _func
+    global _abi
+
+    _abi = abi
+    _func = None
+
+
 def set_func_params_if_none(params):
     if "params" not in _func:
         res = []
@@ -136,22 +148,14 @@ def get_func_name(hash, add_color=False):
 def match_score(func, hashes):
     # returns % score of this function's
 
-    score_a = 0
+    # membership checks against a set, instead of scanning the lists
+    if type(hashes) is not frozenset:
+        hashes = frozenset(hashes)
 
-    for h in hashes:
-        if h in func["cooccurs"]:
-            score_a += 1
-
-    score_a = 10 * score_a / len(hashes)
-
-    score_b = 0
-
-    for h in func["cooccurs"]:
-        if h in hashes:
-            score_b += 1
-
-    score_b = score_b / len(func["cooccurs"])
+    cooccurs = func["cooccurs"]
 
+    score_a = 10 * len(hashes.intersection(cooccurs)) / len(hashes)
+    score_b = sum(1 for h in cooccurs if h in hashes) / len(cooccurs)
     score_c = 0 if "param" in str(func["params"]) else 100
 
     return score_a + score_b + score_c
@@ -179,7 +183,10 @@ def make_abi(hash_targets):
 
     logger.info("Cache for PABI not found, generating...")
 
-    hashes = list(hash_targets.keys())
+    hashes = frozenset(hash_targets.keys())
+
+    # one query for all the selectors, instead of one per selector
+    all_sigs = fetch_sigs_many(h for h in hash_targets if "0x" in h)
 
     result = {}
 
@@ -197,7 +204,7 @@ def make_abi(hash_targets):
 
         else:
 
-            sigs = fetch_sigs(h)
+            sigs = all_sigs[h]
 
             if len(sigs) > 0:
                 best_score = 0
@@ -1,13 +1,11 @@
 import json
 import logging
-import lzma
 import os
 import sqlite3
+import struct
 import sys
-import time
-import urllib.request
+import threading
 from pathlib import Path
-from zipfile import ZipFile
 
 from snaps_backend.utils.helpers import (
     COLOR_BLUE,
@@ -53,56 +51,287 @@ from snaps_backend.utils.helpers import (
 
 logger = logging.getLogger(__name__)
 
-conn = None
+
+"""
+
+    Connections.
+
+    The database is a read-only asset, so every thread gets its own
+    connection, opened with `mode=ro&immutable=1` - sqlite skips all the
+    locking and change detection then, and threads never wait for each
+    other. A process forked from one that already had a connection (the
+    decompiler's worker pool) opens a new one too, sqlite connections
+    must not cross a fork.
+
+    The sqlite3 module keeps prepared statements per connection
+    (`cached_statements`), so the queries below are compiled once per thread.
+
+    Which database to use (and whether it has to be decompressed first) is
+    decided only once per process: the optimized one if it was built, see
+    below, the legacy one otherwise.
+
+    Decompressing takes a while, so processes that know they'll need the
+    database call prepare_supplements() on start. That does it in a
+    background thread, while the rest of the code loads - lookups made
+    before it's done wait for it. `python -m snaps_backend.utils.supplement`
+    does it ahead of time, e.g. when building an image.
+
+"""
+
+SQL_FETCH_LEGACY = (
+    "SELECT hash, name, folded_name, params, cooccurs from functions where hash in "
+)
+SQL_FETCH_OPTIMIZED = (
+    "SELECT selector, name, folded_name, param_types, param_names, cooccurs "
+    "from sigs where selector in "
+)
+
+# hashes per query in the batched lookups, below sqlite's variable limit
+FETCH_CHUNK = 500
+
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KB = 16 * 1024
+
+_checked = False
+_optimized = False
+_check_lock = threading.Lock()
+_ready = threading.Event()
+_local = threading.local()
+
+
+def _after_fork():
+    global _check_lock
+
+    # the parent's lock may have been held by its background thread, which
+    # doesn't exist here; the half-written file is left to that thread
+    if not _checked:
+        _check_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
 
 
 def supplements_path():
     return cache_dir() / "supplement.db"
 
 
+def optimized_supplements_path():
+    return cache_dir() / "supplement.opt.db"
+
+
 def check_supplements():
-    panoramix_supplements = supplements_path()
-    if not panoramix_supplements.is_file():
-        compressed_supplements = (
-            Path(__file__).parent.parent / "data" / "supplement.db.xz"
-        )
-        logger.info(
-            "Decompressing %s into %s...", compressed_supplements, panoramix_supplements
-        )
-        with lzma.open(compressed_supplements) as inf, panoramix_supplements.open(
-            "wb"
-        ) as outf:
-            while (buf := inf.read(1024 * 1024)) :
-                outf.write(buf)
+    global _checked
+    global _optimized
+
+    if _checked:
+        return
 
-    assert panoramix_supplements.is_file()
+    with _check_lock:
+        if _checked:
+            return
 
+        if _is_optimized(optimized_supplements_path()):
+            _optimized = True
+            _checked = True
+            _ready.set()
+            return
 
-def _cursor():
-    global conn
+        panoramix_supplements = supplements_path()
+        if not panoramix_supplements.is_file():
+            _decompress_supplements(panoramix_supplements)
 
-    check_supplements()
+        assert panoramix_supplements.is_file()
+        _checked = True
+        _ready.set()
 
-    if conn is None:
-        conn = sqlite3.connect(supplements_path())
 
-    # try:
-    c = conn.cursor()
-    # except Exception:
-    #    # fails in multi-threading, this should help
-    #    conn = sqlite3.connect("supplement.db")
-    #    return conn.cursor()
+def compressed_supplements_path():
+    return Path(__file__).parent.parent / "data" / "supplement.db.xz"
 
-    return c
 
+def supplements_id():
+    """
+        Identifies the signature data that lookups use, without waiting for
+        the database to be ready - the legacy one is decompressed from the
+        shipped file, the optimized one is identified by its own stat.
+    """
 
-@cached
-def fetch_sigs(hash):
-    c = _cursor()
-    c.execute("SELECT * from functions where hash=?", (hash,))
+    res = []
+    for path in (compressed_supplements_path(), optimized_supplements_path()):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        res.append(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+
+    return ",".join(res)
+
+
+def _decompress_supplements(panoramix_supplements):
+    import lzma  # only ever needed once
+
+    compressed_supplements = compressed_supplements_path()
+    logger.info(
+        "Decompressing %s into %s...", compressed_supplements, panoramix_supplements,
+    )
+
+    # renamed into place when complete, so other processes never
+    # open a half-written database
+    partial = panoramix_supplements.with_name(
+        f"{panoramix_supplements.name}.{os.getpid()}.tmp"
+    )
+    with lzma.open(compressed_supplements) as inf, partial.open("wb") as outf:
+        while (buf := inf.read(1024 * 1024)) :
+            outf.write(buf)
+
+    os.replace(partial, panoramix_supplements)
+
+
+def supplements_ready():
+    """Whether lookups can go to the database right away."""
+    return _ready.is_set()
+
+
+def prepare_supplements(background=True):
+    """
+        Gets the database ready ahead of the first lookup. Returns the
+        background thread, if it started one.
+    """
+
+    if _ready.is_set():
+        return None
+
+    if not background:
+        check_supplements()
+        return None
+
+    thread = threading.Thread(
+        target=check_supplements, name="prepare_supplements", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def _connect(path=None):
+    if path is None:
+        path = optimized_supplements_path() if _optimized else supplements_path()
+
+    uri = path.as_uri() + "?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True)
+
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+
+    return conn
+
+
+def _connection():
+    conn = getattr(_local, "conn", None)
+
+    if conn is None or _local.pid != os.getpid():
+        check_supplements()
+
+        conn = _local.conn = _connect()
+        _local.pid = os.getpid()
+
+    return conn
+
+
+def close_connection():
+    """Closes the current thread's connection, e.g. when a worker thread exits."""
+
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+
+    _local.conn = None
+
+
+"""
+
+    Lookups.
+
+    Both schemas are read into the same rows:
+    (hash, name, folded_name, params, cooccurs), with params and cooccurs
+    decoded into lists. For every hash, rows come in the order they were
+    inserted into the legacy table.
+
+"""
+
+
+def _selector(hash):
+    """The int selector of a canonical '0x12345678' hash, None otherwise."""
+
+    try:
+        selector = int(hash, 16)
+    except (TypeError, ValueError):
+        return None
+
+    if "{:#010x}".format(selector) != hash:
+        return None
+
+    return selector
+
+
+def _fetch_legacy(conn, hashes):
+    rows = {hash: [] for hash in hashes}
+
+    for i in range(0, len(hashes), FETCH_CHUNK):
+        chunk = hashes[i : i + FETCH_CHUNK]
+        sql = SQL_FETCH_LEGACY + "(" + ",".join("?" * len(chunk)) + ")"
+
+        # rows come out of the hash index, so for every hash in rowid order
+        for hash, name, folded_name, params, cooccurs in conn.execute(sql, chunk):
+            rows[hash].append(
+                (hash, name, folded_name, json.loads(params), cooccurs.split(","))
+            )
+
+    return rows
+
+
+def _fetch_optimized(conn, hashes):
+    rows = {hash: [] for hash in hashes}
+
+    selectors = {}
+    for hash in hashes:
+        if (selector := _selector(hash)) is not None:
+            selectors[selector] = hash
+
+    selector_list = list(selectors)
+    for i in range(0, len(selector_list), FETCH_CHUNK):
+        chunk = selector_list[i : i + FETCH_CHUNK]
+        sql = SQL_FETCH_OPTIMIZED + "(" + ",".join("?" * len(chunk)) + ")"
+
+        for selector, name, folded_name, types, names, cooccurs in conn.execute(
+            sql, chunk
+        ):
+            hash = selectors[selector]
+            rows[hash].append(
+                (
+                    hash,
+                    name,
+                    folded_name,
+                    _unpack_params(types, names),
+                    _unpack_selectors(cooccurs),
+                )
+            )
+
+    return rows
+
+
+def _fetch_rows_many(hashes):
+    """Returns hash -> rows."""
+
+    hashes = list(hashes)
+    conn = _connection()
+
+    if _optimized:
+        return _fetch_optimized(conn, hashes)
+    else:
+        return _fetch_legacy(conn, hashes)
 
-    results = c.fetchall()
 
+def _sigs_from_rows(results):
     res = []
     for row in results:
         res.append(
@@ -110,41 +339,261 @@ def fetch_sigs(hash):
                 "hash": row[0],
                 "name": row[1],
                 "folded_name": row[2],
-                "params": json.loads(row[3]),
-                "cooccurs": row[4].split(","),
+                "params": row[3],
+                "cooccurs": row[4],
             }
         )
 
     return res
 
 
-@cached
-def fetch_sig(hash):
-    if type(hash) == str:
-        hash = int(hash, 16)
-    hash = "{:#010x}".format(hash)
-
-    c = _cursor()
-    c.execute(
-        "SELECT hash, name, folded_name, params, cooccurs from functions where hash=?",
-        (hash,),
-    )
-
-    results = c.fetchall()
+def _sig_from_rows(hash, results):
     if len(results) == 0:
         return None
 
     # Take the one that cooccurs with the most things, it's probably the most relevant.
-    row = max(results, key=lambda row: len(row[4]))
+    # Measured on the comma-separated string, like in the legacy table, so that
+    # ties and malformed entries resolve the same way they always did.
+    row = max(results, key=lambda row: len(",".join(row[4])))
 
     return {
         "hash": hash,
         "name": row[1],
         "folded_name": row[2],
-        "params": json.loads(row[3]),
+        "params": row[3],
     }
 
 
+def _normalize_hash(hash):
+    if type(hash) == str:
+        hash = int(hash, 16)
+    return "{:#010x}".format(hash)
+
+
+@cached(scoped=False)
+def fetch_sigs(hash):
+    return _sigs_from_rows(_fetch_rows_many([hash])[hash])
+
+
+@cached(scoped=False)
+def fetch_sig(hash):
+    hash = _normalize_hash(hash)
+    return _sig_from_rows(hash, _fetch_rows_many([hash])[hash])
+
+
+"""
+
+    Batched lookups.
+
+    A contract needs the signatures of all its selectors (make_abi), and
+    prettify probes every constant it prints (Loader.find_sig). Instead of a
+    query per hash, these fetch all of them in FETCH_CHUNK-sized queries, and
+    store the results in the fetch_sigs/fetch_sig caches - so the per-hash
+    calls that follow don't touch the database.
+
+"""
+
+
+def fetch_sigs_many(hashes):
+    """fetch_sigs for many hashes at once, returns hash -> sigs."""
+
+    hashes = list(dict.fromkeys(hashes))
+    cache = fetch_sigs.cache
+
+    missing = [hash for hash in hashes if (hash,) not in cache]
+    if missing:
+        rows = _fetch_rows_many(missing)
+        for hash in missing:
+            cache.put((hash,), _sigs_from_rows(rows[hash]))
+
+    return {hash: fetch_sigs(hash) for hash in hashes}
+
+
+def prefetch_sig(hashes):
+    """Warms the fetch_sig cache for the given hashes, returns nothing."""
+
+    cache = fetch_sig.cache
+
+    missing = {}  # as given -> normalized
+    for hash in dict.fromkeys(hashes):
+        if (hash,) in cache:
+            continue
+
+        try:
+            missing[hash] = _normalize_hash(hash)
+        except ValueError:
+            continue  # left for fetch_sig to deal with
+
+    if missing:
+        rows = _fetch_rows_many(set(missing.values()))
+        for hash, normalized in missing.items():
+            cache.put((hash,), _sig_from_rows(normalized, rows[normalized]))
+
+
+"""
+
+    Optimized database.
+
+    The legacy `functions` table is keyed by the hash as text, keeps params
+    as json and cooccurs as a comma-separated string, all of them decoded on
+    every hit. `python -m snaps_backend.utils.supplement` builds
+    supplement.opt.db from it, with:
+
+        sigs(selector, seq, name, folded_name, param_types, param_names,
+             cooccurs)
+
+    - (selector, seq) is the primary key of a WITHOUT ROWID table, so
+      all the rows of a selector are found with one b-tree lookup, and are
+      stored right there. seq is the legacy rowid, so that the row order
+      stays the same.
+    - params are split into their types and names, joined with PARAM_SEP.
+    - cooccurs is a packed array of big-endian uint32 selectors.
+
+    Once it's there, it's used instead of supplement.db. Rebuild it after
+    supplement.db changes - the lookups don't notice.
+
+"""
+
+OPTIMIZED_VERSION = "1"
+
+OPTIMIZED_SCHEMA = """
+    CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE sigs (
+        selector INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        name TEXT,
+        folded_name TEXT,
+        param_types TEXT,
+        param_names TEXT,
+        cooccurs BLOB,
+        PRIMARY KEY (selector, seq)
+    ) WITHOUT ROWID;
+"""
+
+PARAM_SEP = "\x1f"  # ascii unit separator, never in types nor names
+
+
+def _pack_params(params):
+    if len(params) == 0:
+        return None, None
+
+    for p in params:
+        if set(p) != {"type", "name"} or PARAM_SEP in p["type"] + p["name"]:
+            raise ValueError(f"params not supported by the optimized schema: {p}")
+
+    return (
+        PARAM_SEP.join(p["type"] for p in params),
+        PARAM_SEP.join(p["name"] for p in params),
+    )
+
+
+def _unpack_params(types, names):
+    if types is None:
+        return []
+
+    return [
+        {"type": t, "name": n}
+        for t, n in zip(types.split(PARAM_SEP), names.split(PARAM_SEP))
+    ]
+
+
+def _pack_selectors(hashes):
+    if hashes == [""]:  # "".split(",")
+        return b""
+
+    selectors = [_selector(h) for h in hashes]
+    if None in selectors:
+        raise ValueError(f"cooccurs not supported by the optimized schema: {hashes}")
+
+    return struct.pack(f">{len(selectors)}I", *selectors)
+
+
+def _unpack_selectors(packed):
+    if len(packed) == 0:
+        return [""]  # what the legacy "".split(",") gives
+
+    selectors = struct.unpack(f">{len(packed) // 4}I", packed)
+    return ["{:#010x}".format(s) for s in selectors]
+
+
+def _is_optimized(path):
+    if not path.is_file():
+        return False
+
+    try:
+        conn = _connect(path)
+        try:
+            version = conn.execute(
+                "SELECT value from meta where key='version'"
+            ).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        logger.warning("Cannot read %s, using the legacy database.", path)
+        return False
+
+    return version is not None and version[0] == OPTIMIZED_VERSION
+
+
+def build_optimized_supplements(src=None, dst=None):
+    src = src or supplements_path()
+    dst = dst or optimized_supplements_path()
+
+    logger.info("Building %s from %s...", dst, src)
+
+    legacy = _connect(src)
+
+    partial = dst.with_name(f"{dst.name}.{os.getpid()}.tmp")
+    if partial.exists():
+        partial.unlink()
+
+    conn = sqlite3.connect(partial)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executescript(OPTIMIZED_SCHEMA)
+
+    skipped = 0
+
+    def rows():
+        nonlocal skipped
+
+        for seq, hash, name, folded_name, params, cooccurs in legacy.execute(
+            "SELECT rowid, hash, name, folded_name, params, cooccurs from functions"
+        ):
+            selector = _selector(hash)
+            if selector is None:  # fetch_sig(s) never asks for these
+                skipped += 1
+                continue
+
+            types, names = _pack_params(json.loads(params))
+            yield (
+                selector,
+                seq,
+                name,
+                folded_name,
+                types,
+                names,
+                _pack_selectors(cooccurs.split(",")),
+            )
+
+    with conn:
+        conn.executemany("INSERT INTO sigs VALUES (?, ?, ?, ?, ?, ?, ?)", rows())
+        conn.execute(
+            "INSERT INTO meta VALUES ('version', ?)", (OPTIMIZED_VERSION,),
+        )
+
+    conn.execute("VACUUM")
+    conn.close()
+    legacy.close()
+
+    os.replace(partial, dst)
+
+    if skipped:
+        logger.warning("Skipped %s rows with non-canonical hashes.", skipped)
+
+    logger.info("Done.")
+
+
 """
     
     Abi crawler and parser. used to refill supplement.py with new ABI/func definitions.
@@ -294,3 +743,14 @@ def crawl_abis_from_cache():
                 parse_insert_abi(abi)
 
     crawl_cache()
+
+
+if __name__ == "__main__":
+    # python -m snaps_backend.utils.supplement [supplement.db] [supplement.opt.db]
+    # decompresses supplement.db if needed, and builds the optimized one
+    logging.basicConfig(level=logging.INFO)
+
+    if len(sys.argv) < 2 and not supplements_path().is_file():
+        _decompress_supplements(supplements_path())
+
+    build_optimized_supplements(*(Path(arg) for arg in sys.argv[1:3]))
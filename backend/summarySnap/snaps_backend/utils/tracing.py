@@ -0,0 +1,157 @@
+import logging
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+"""
+
+    Debug tracing for the hot parts of the decompiler - the VM, memloc,
+    simplification.
+
+    Those used to call `logger.debug(f"... {exp}")`, which formats whole
+    expressions on every call, even with debug logging off. Instead, every
+    module gets a channel once, on import:
+
+        debug = tracing.channel(__name__)
+
+    and calls it like logger.debug - the message is formatted only when it's
+    actually logged or dumped:
+
+        debug("filling mem: %s with mem[%s] == %s", exp, mem_idx, mem_val)
+
+    `debug.on` is a plain attribute, so call sites that would do extra work
+    just to build the arguments check it first:
+
+        if debug.on:
+            debug("sizeof exp %s", sizeof(exp))
+
+    The channels follow the logging configuration as of the last refresh(),
+    which the decompiler calls at the start of every decompilation.
+
+    A Tracer is the structured alternative to debug logging: a ring buffer
+    that keeps the last records, with their arguments, of whatever runs
+    while it's active - e.g. of one function, to see what happened right
+    before it failed:
+
+        with tracing.use(Tracer()) as tracer:
+            ...
+
+        tracer.dump()
+
+    Like budgets, the active tracer is a ContextVar, so it's per thread.
+
+"""
+
+TRACER_SIZE = 10_000  # records kept by default
+
+_active = ContextVar("tracer", default=None)
+_tracers = 0  # active anywhere, in any thread
+
+channels = {}  # module name -> Channel
+
+
+class Lazy:
+    """Calls `func(*args)` only when converted to a string."""
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
+class Channel:
+    __slots__ = ("name", "logger", "on")
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = logging.getLogger(name)
+        self.on = False
+        self.refresh()
+
+    def __repr__(self):
+        return f"Channel({self.name!r}, on={self.on})"
+
+    def refresh(self):
+        self.on = _tracers > 0 or self.logger.isEnabledFor(logging.DEBUG)
+
+    def __call__(self, msg, *args):
+        if not self.on:
+            return
+
+        tracer = _active.get()
+        if tracer is not None:
+            tracer.record(self.name, msg, args)
+
+        self.logger.debug(msg, *args)
+
+
+def channel(name):
+    if name not in channels:
+        channels[name] = Channel(name)
+
+    return channels[name]
+
+
+def refresh():
+    """Re-reads the log levels, call it after changing them."""
+
+    for ch in channels.values():
+        ch.refresh()
+
+
+class Tracer:
+    def __init__(self, size=TRACER_SIZE):
+        self.records = deque(maxlen=size)  # (time, module, msg, args)
+        self.count = 0  # including the ones that fell out of the buffer
+        self.start = time.monotonic()
+
+    def __repr__(self):
+        return f"Tracer({len(self.records)} of {self.count} records)"
+
+    def record(self, name, msg, args):
+        self.records.append((time.monotonic(), name, msg, args))
+        self.count += 1
+
+    def lines(self):
+        for at, name, msg, args in self.records:
+            try:
+                text = msg % args if args else msg
+            except Exception:
+                text = f"{msg} {args}"
+
+            yield f"{at - self.start:10.6f} {name} {text}"
+
+    def dump(self, file=None):
+        file = file or sys.stderr
+
+        skipped = self.count - len(self.records)
+        if skipped > 0:
+            print(f"... {skipped} earlier records skipped", file=file)
+
+        for line in self.lines():
+            print(line, file=file)
+
+
+@contextmanager
+def use(tracer):
+    global _tracers
+
+    if tracer is None:
+        yield None
+        return
+
+    token = _active.set(tracer)
+    _tracers += 1
+    refresh()
+    try:
+        yield tracer
+    finally:
+        _active.reset(token)
+        _tracers -= 1
+        refresh()
@@ -1,7 +1,5 @@
 import logging
 import time
-import sys
-from copy import copy
 
 from snaps_backend.core import arithmetic
 import snaps_backend.utils.opcode_dict as opcode_dict
@@ -20,6 +18,8 @@ from snaps_backend.core.algebra import (
 from snaps_backend.core.arithmetic import is_zero, simplify_bool
 from snaps_backend.matcher import match
 from snaps_backend.prettify import pprint_trace
+from snaps_backend.utils import budget, profiling, tracing
+from snaps_backend.utils.config import config
 from snaps_backend.utils.helpers import (
     C,
     EasyCopy,
@@ -32,6 +32,7 @@ from snaps_backend.utils.helpers import (
 from .stack import Stack, fold_stacks
 
 logger = logging.getLogger(__name__)
+debug = tracing.channel(__name__)
 
 
 """
@@ -59,19 +60,104 @@ def mem_load(pos, size=32):
 def find_nodes(node, f):
     assert type(node) == Node
 
-    if f(node):
-        res = [node]
-    else:
-        res = []
-
-    for n in node.next:
-        res.extend(find_nodes(n, f))
+    # pre-order, iteratively - node trees get deeper than the recursion limit
+    res = []
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        if f(node):
+            res.append(node)
+        todo.extend(reversed(node.next))
 
     return res
 
 
 MAX_NODE_COUNT = 10_000
-node_count = 0
+
+# every HISTORY_SNAPSHOT-th History keeps a full dict, see History
+HISTORY_SNAPSHOT = 32
+
+
+class History:
+    """
+        A persistent jd -> node map of the nodes on the path to a Node.
+
+        Nodes used to copy their parent's history dict, which made a path
+        of depth d cost O(d^2) memory. A History only holds the one entry
+        it adds and a pointer to the parent's History, so it's shared by
+        all the paths going through it. To keep lookups from walking the
+        whole path, every HISTORY_SNAPSHOT-th level stores a full dict.
+
+        Supports `jd in history` and `history[jd]`; later entries win.
+
+    """
+
+    __slots__ = ("parent", "jd", "node", "size", "snapshot")
+
+    def __init__(self, parent=None, jd=None, node=None):
+        self.parent = parent
+        self.jd = jd
+        self.node = node
+
+        if parent is None:
+            self.size = 0
+            self.snapshot = {}
+            return
+
+        self.size = parent.size + 1
+        self.snapshot = None
+
+        if self.size % HISTORY_SNAPSHOT == 0:
+            entries = []
+            h = self
+            while h.snapshot is None:
+                entries.append(h)
+                h = h.parent
+
+            snapshot = dict(h.snapshot)
+            for h in reversed(entries):
+                snapshot[h.jd] = h.node
+
+            self.snapshot = snapshot
+
+    def add(self, jd, node):
+        return History(self, jd, node)
+
+    def get(self, jd, default=None):
+        h = self
+        while h.snapshot is None:
+            if h.jd == jd:
+                return h.node
+            h = h.parent
+
+        return h.snapshot.get(jd, default)
+
+    def __contains__(self, jd):
+        # values are never None
+        return self.get(jd) is not None
+
+    def __getitem__(self, jd):
+        node = self.get(jd)
+        if node is None:
+            raise KeyError(jd)
+        return node
+
+
+EMPTY_HISTORY = History()
+
+# ops that end a basic block, handled by VM.handle_jumps
+TERMINATING_OPS = frozenset(
+    (
+        "jump",
+        "jumpi",
+        "selfdestruct",
+        "stop",
+        "return",
+        "invalid",
+        "assert_fail",
+        "revert",
+    )
+)
 
 
 class Node:
@@ -84,9 +170,7 @@ class Node:
         return self.__str__()
 
     def __init__(self, vm, start, safe, stack, condition=True, trace=None):
-        global node_count
-
-        node_count += 1
+        vm.node_count += 1
 
         self.vm = vm
         self.prev = []
@@ -95,20 +179,52 @@ class Node:
         self.start = start
         self.safe = safe
         self.stack = stack
-        self.history = {}
+        self.history = EMPTY_HISTORY
         self.depth = 0
-        self.label_history = {}
+        self.label_history = EMPTY_HISTORY
         self.label = None
 
         self.condition = condition
 
         stack_obj = Stack(stack)
-        self.jd = (start, len(stack), tuple(stack_obj.jump_dests(vm.loader.jump_dests)))
+        self.jd = (start, len(stack), tuple(stack_obj.jump_dests(vm.lines.jumpdests)))
 
     def make_trace(self):
-        if self.trace is None:
-            return [("undefined", "decompilation didn't finish")]
+        # jumps and ifs are followed with an explicit stack, paths can be
+        # deeper than the recursion limit - every node appends to the list of
+        # the path it's on
+        res = []
+        stack = [(self, res)]
+
+        while stack:
+            node, path = stack.pop()
+
+            if node.trace is None:
+                path.append(("undefined", "decompilation didn't finish"))
+                continue
+
+            path.extend(node.trace_begin())
+
+            last = node.trace[-1]
+
+            if opcode(last) == "jump":
+                path.extend(node.trace[:-1])
+                stack.append((last[1], path))
+
+            elif m := match(last, ("if", ":cond", ":if_true", ":if_false")):
+                if_true, if_false = [], []
+                path.extend(node.trace[:-1])
+                path.append(("if", m.cond, if_true, if_false))
+
+                stack.append((m.if_false, if_false))
+                stack.append((m.if_true, if_true))
+
+            else:
+                path.extend(node.trace)
+
+        return res
 
+    def trace_begin(self):
         begin_vars = []
         if self.is_label():
             for _, var_idx, var_val, _ in self.label.begin_vars:
@@ -125,17 +241,7 @@ class Node:
 
         begin += [("label", self, tuple(begin_vars))] if self.is_label() else []
 
-        last = self.trace[-1]
-
-        if opcode(last) == "jump":
-            return begin + self.trace[:-1] + last[1].make_trace()
-
-        if m := match(last, ("if", ":cond", ":if_true", ":if_false")):
-            if_true = m.if_true.make_trace()
-            if_false = m.if_false.make_trace()
-            return begin + self.trace[:-1] + [("if", m.cond, if_true, if_false)]
-
-        return begin + self.trace
+        return begin
 
     def set_label(self, loop_dest, vars, stack):
         self.label = loop_dest
@@ -152,12 +258,11 @@ class Node:
         self.prev = prev
         self.depth = prev.depth + 1
 
-        self.history = copy(prev.history)
-        self.history[prev.jd] = prev
+        self.history = prev.history.add(prev.jd, prev)
 
-        self.label_history = copy(prev.label_history)
+        self.label_history = prev.label_history
         if prev.label:
-            self.label_history[prev.jd] = prev.label
+            self.label_history = self.label_history.add(prev.jd, prev.label)
 
         prev.next.append(self)
 
@@ -165,7 +270,7 @@ class Node:
         return self.label is not None
 
     def run(self):
-        logger.debug("Node.run(%s)", self)
+        debug("Node.run(%s)", self)
         self.prev_trace = self.trace
         self.trace = self.vm._run(self.start, self.safe, self.stack, self.condition)
 
@@ -183,6 +288,13 @@ class Node:
             if_false.set_prev(self)
 
 
+def format_trace(exp, format_args):
+    try:
+        return str(exp).format(*format_args)
+    except Exception:
+        return str(exp)
+
+
 class VM(EasyCopy):
     def __init__(self, loader, just_fdests=False):
 
@@ -194,15 +306,25 @@ class VM(EasyCopy):
         self.just_fdests = just_fdests
 
         self.counter = 0
-        global node_count
-        node_count = 0
+
+        # kept per-VM, so that separate runs (e.g. in worker processes)
+        # don't share the budget
+        self.node_count = 0
 
     def run(self, start, history={}, condition=None, re_run=False, stack=(), timeout=0):
         time_start = time.monotonic()
+        nodes_spent = 0
 
         def should_quit():
-            return node_count > MAX_NODE_COUNT or (
-                timeout and (time.monotonic() - time_start > timeout)
+            nonlocal nodes_spent
+
+            truncated = budget.spend(nodes=self.node_count - nodes_spent)
+            nodes_spent = self.node_count
+
+            return (
+                truncated is not None
+                or self.node_count > MAX_NODE_COUNT
+                or (timeout and (time.monotonic() - time_start > timeout))
             )
 
         func_node = Node(vm=self, start=start, safe=True, stack=list(stack))
@@ -214,6 +336,9 @@ class VM(EasyCopy):
         root = Node(vm=self, trace=trace, start=start, safe=True, stack=list(stack))
         func_node.set_prev(root)
 
+        # nodes that weren't run yet, in the order find_nodes would return them
+        frontier = [func_node]
+
         """
 
             BFS symbolic execution, ends up with a decompiled
@@ -224,6 +349,8 @@ class VM(EasyCopy):
 
         """
 
+        iterations = 0
+
         for j in range(20):  # 20
 
             for i in range(200):  # 300
@@ -234,7 +361,8 @@ class VM(EasyCopy):
 
                 """
 
-                self.expand_trace(root)
+                iterations += 1
+                frontier = self.expand_trace(frontier)
 
                 """
                     find all the jumps that lead to an already
@@ -244,7 +372,8 @@ class VM(EasyCopy):
                     replace them with 'loop' identifier
                 """
 
-                self.replace_loops(root)
+                self.replace_loops(frontier)
+                frontier = [node for node in frontier if node.trace is None]
 
                 """
                     repeat until there are no more jumps
@@ -252,50 +381,53 @@ class VM(EasyCopy):
 
                 """
 
-                nodes = find_nodes(root, lambda n: n.trace is None)
-
-                if len(nodes) == 0 or should_quit():
+                if len(frontier) == 0 or should_quit():
                     break
 
-            trace = self.continue_loops(root)
+            self.continue_loops(root)
 
-            tr = root.make_trace()
-            nodes = find_nodes(root, lambda n: n.trace is None)
+            # continue_loops moves nodes around (and cuts off whole subtrees),
+            # so the frontier has to be found again
+            frontier = find_nodes(root, lambda n: n.trace is None)
 
-            if len(nodes) == 0 or should_quit():
+            if len(frontier) == 0 or should_quit():
                 break
 
         if should_quit():
             logger.warning(
                 "VM stopped prematurely. Node count %i and seconds %i.",
-                node_count,
+                self.node_count,
                 time.monotonic() - time_start,
             )
 
+        profiling.count("vm", node_count=self.node_count, bfs_iterations=iterations)
+
         tr = root.make_trace()
         return tr
 
-    def expand_trace(self, root):
-        nodes = find_nodes(root, lambda n: n.trace is None)
+    def expand_trace(self, frontier):
+        """Runs the frontier nodes, returns the new one."""
 
-        for node in nodes:
+        # frontier nodes are leaves, so their new children
+        # take their place in the pre-order
+        new_frontier = []
+        for node in frontier:
             node.run()
+            new_frontier.extend(n for n in node.next if n.trace is None)
 
-    def replace_loops(self, root):
-        nodes = find_nodes(root, lambda n: n.trace is None)
-
-        for node in nodes:
-            if (
-                node.jd in node.history
-                and node.jd[1] > 0
-                and len(node.history[node.jd].stack) == len(node.stack)
-            ):  # jd[1] == stack_len
-                folded, vars = fold_stacks(
-                    node.history[node.jd].stack, node.stack, node.depth
-                )
+        return new_frontier
+
+    def replace_loops(self, frontier):
+        for node in frontier:
+            if node.jd[1] == 0:  # jd[1] == stack_len
+                continue
+
+            loop_dest = node.history.get(node.jd)
+            if loop_dest is not None and len(loop_dest.stack) == len(node.stack):
+                folded, vars = fold_stacks(loop_dest.stack, node.stack, node.depth)
                 loop_line = (
                     "loop",
-                    node.history[node.jd],
+                    loop_dest,
                     node.stack,
                     folded,
                     tuple(vars),
@@ -343,7 +475,7 @@ class VM(EasyCopy):
                 node.set_label(loop_dest, tuple(vars), new_stack)
 
     def _run(self, start, safe, stack, condition):
-        logger.debug("VM._run stack=%s", stack)
+        debug("VM._run stack=%s", stack)
         self.stack = Stack(stack)
         trace = []
 
@@ -383,7 +515,7 @@ class VM(EasyCopy):
                     stack=tuple(self.stack.stack),
                     condition=condition,
                 )
-                logger.debug("jumpdest %s", n)
+                debug("jumpdest %s", n)
                 trace.append(("jump", n))
                 return trace
 
@@ -399,31 +531,19 @@ class VM(EasyCopy):
         i, op = line[0], line[1]
         stack = self.stack
 
-        if "--explain" in sys.argv and op in (
-            "jump",
-            "jumpi",
-            "selfdestruct",
-            "stop",
-            "return",
-            "invalid",
-            "assert_fail",
-            "revert",
-        ):
+        if op not in TERMINATING_OPS:
+            if op == "UNKNOWN":
+                trace.append(("invalid",))
+                return trace
+
+            return None
+
+        if config.explain:
             trace.append(C.asm(f"       {stack}"))
             trace.append("")
             trace.append(f"[{line[0]}] {C.asm(op)}")
 
-        if op in (
-            "jump",
-            "jumpi",
-            "selfdestruct",
-            "stop",
-            "return",
-            "invalid",
-            "assert_fail",
-            "revert",
-        ):
-            logger.debug("[%s] %s", i, op)
+        debug("[%s] %s", i, op)
 
         if op == "jump":
             target = stack.pop()
@@ -487,7 +607,7 @@ class VM(EasyCopy):
                     return trace
 
             trace.append(("if", if_condition, n_true, n_false,))
-            logger.debug("jumpi -> if %s", trace[-1])
+            debug("jumpi -> if %s", trace[-1])
             return trace
 
         elif op in ["return", "revert"]:
@@ -510,18 +630,12 @@ class VM(EasyCopy):
             trace.append((op,))
             return trace
 
-        elif op == "UNKNOWN":
-            trace.append(("invalid",))
-            return trace
-
         return None
 
     def apply_stack(self, ret, line):
         def trace(exp, *format_args):
-            try:
-                logger.debug("Trace: %s", str(exp).format(*format_args))
-            except Exception:
-                pass
+            if debug.on:
+                debug("Trace: %s", tracing.Lazy(format_trace, exp, format_args))
 
             if type(exp) == str:
                 ret.append(exp.format(*format_args))
@@ -534,7 +648,7 @@ class VM(EasyCopy):
 
         previous_len = stack.len()
 
-        if "--verbose" in sys.argv or "--explain" in sys.argv:
+        if config.verbose or config.explain:
             trace(C.asm("       " + str(stack)))
             trace("")
 
@@ -552,399 +666,371 @@ class VM(EasyCopy):
         if len(line) > 2:
             param = line[2]
 
-        if op in [
-            "exp",
-            "and",
-            "eq",
-            "div",
-            "lt",
-            "gt",
-            "slt",
-            "sgt",
-            "mod",
-            "xor",
-            "signextend",
-            "smod",
-            "sdiv",
-        ]:
-            stack.append(arithmetic.eval((op, stack.pop(), stack.pop(),)))
-
-        elif op[:4] == "push":
-            stack.append(param)
-
-        elif op == "pop":
-            stack.pop()
-
-        elif op == "dup":
-            stack.dup(param)
-
-        elif op == "mul":
-            stack.append(mul_op(stack.pop(), stack.pop()))
-
-        elif op == "or":
-            stack.append(or_op(stack.pop(), stack.pop()))
-
-        elif op == "add":
-            stack.append(add_op(stack.pop(), stack.pop()))
-
-        elif op == "sub":
-            left = stack.pop()
-            right = stack.pop()
-
-            if type(left) == int and type(right) == int:
-                stack.append(arithmetic.sub(left, right))
-            else:
-                stack.append(sub_op(left, right))
+        handler = op_handlers.get(op, VM.op_unhandled)
+        handler(self, stack, trace, line, op, param)
 
-        elif op in ["mulmod", "addmod"]:
-            stack.append(("mulmod", stack.pop(), stack.pop(), stack.pop()))
+        if stack.len() - previous_len != opcode_dict.stack_diffs[op]:
+            logger.error("line: %s", line)
+            logger.error("stack: %s", stack)
+            logger.error(
+                "expected %s, got %s stack diff",
+                opcode_dict.stack_diffs[op],
+                stack.len() - previous_len,
+            )
+            assert False, f"opcode {op} not processed correctly"
 
-        elif op == "shl":
-            off = stack.pop()
-            exp = stack.pop()
-            if all_concrete(off, exp):
-                stack.append(exp << off)
-            else:
-                stack.append(mask_op(exp, shl=off))
+        stack.cleanup()
 
-        elif op == "shr":
-            off = stack.pop()
-            exp = stack.pop()
-            if all_concrete(off, exp):
-                stack.append(exp >> off)
-            else:
-                stack.append(mask_op(exp, offset=minus_op(off), shr=off))
-
-        elif op == "sar":
-            off = stack.pop()
-            exp = stack.pop()
-            if all_concrete(off, exp):
-                sign = exp & (1 << 255)
-                if off >= 256:
-                    if sign:
-                        stack.append(2 ** 256 - 1)
-                    else:
-                        stack.append(0)
-                else:
-                    shifted = exp >> off
-                    if sign:
-                        shifted |= (2 ** 256 - 1) << (256 - off)
-                    stack.append(shifted)
-            else:
-                # FIXME: This won't give the right result...
-                stack.append(mask_op(exp, offset=minus_op(off), shr=off))
+    # Opcode handlers, looked up in op_handlers (below the class) by apply_stack.
+    # `op` and `param` are line[1] and line[2] - with dup/swap already split
+    # into ("dup", n) / ("swap", n) by the loader.
 
-        elif op in ["not", "iszero"]:
-            stack.append((op, stack.pop()))
+    def op_unhandled(self, stack, trace, line, op, param):
+        # TODO: Maybe raise an error directly?
+        assert op not in [
+            "jump",
+            "jumpi",
+            "revert",
+            "return",
+            "stop",
+            "jumpdest",
+            "UNKNOWN",
+        ]
 
-        elif op == "sha3":
-            p = stack.pop()
-            n = stack.pop()
-            res = mem_load(p, n)
+    def op_arithmetic(self, stack, trace, line, op, param):
+        stack.append(arithmetic.eval((op, stack.pop(), stack.pop(),)))
 
-            self.counter += 1
-            vname = f"_{self.counter}"
-            vval = (
-                "sha3",
-                res,
-            )
+    def op_push(self, stack, trace, line, op, param):
+        stack.append(param)
 
-            trace(("setvar", vname, vval))
-            stack.append(("var", vname))
+    def op_pop(self, stack, trace, line, op, param):
+        stack.pop()
 
-        elif op == "calldataload":
-            stack.append(("cd", stack.pop(),))
+    def op_dup(self, stack, trace, line, op, param):
+        stack.dup(param)
 
-        elif op == "byte":
-            val = stack.pop()
-            num = stack.pop()
-            off = sub_op(256, to_bytes(num))
-            stack.append(mask_op(val, 8, off, shr=off))
+    def op_swap(self, stack, trace, line, op, param):
+        stack.swap(param)
 
-        elif op == "selfbalance":
-            stack.append(("balance", "address",))
+    def op_mul(self, stack, trace, line, op, param):
+        stack.append(mul_op(stack.pop(), stack.pop()))
 
-        elif op == "balance":
-            addr = stack.pop()
-            if opcode(addr) == "mask_shl" and addr[:4] == ("mask_shl", 160, 0, 0):
-                stack.append(("balance", addr[4],))
+    def op_or(self, stack, trace, line, op, param):
+        stack.append(or_op(stack.pop(), stack.pop()))
+
+    def op_add(self, stack, trace, line, op, param):
+        stack.append(add_op(stack.pop(), stack.pop()))
+
+    def op_sub(self, stack, trace, line, op, param):
+        left = stack.pop()
+        right = stack.pop()
+
+        if type(left) == int and type(right) == int:
+            stack.append(arithmetic.sub(left, right))
+        else:
+            stack.append(sub_op(left, right))
+
+    def op_mulmod(self, stack, trace, line, op, param):
+        stack.append(("mulmod", stack.pop(), stack.pop(), stack.pop()))
+
+    def op_shl(self, stack, trace, line, op, param):
+        off = stack.pop()
+        exp = stack.pop()
+        if all_concrete(off, exp):
+            stack.append(exp << off)
+        else:
+            stack.append(mask_op(exp, shl=off))
+
+    def op_shr(self, stack, trace, line, op, param):
+        off = stack.pop()
+        exp = stack.pop()
+        if all_concrete(off, exp):
+            stack.append(exp >> off)
+        else:
+            stack.append(mask_op(exp, offset=minus_op(off), shr=off))
+
+    def op_sar(self, stack, trace, line, op, param):
+        off = stack.pop()
+        exp = stack.pop()
+        if all_concrete(off, exp):
+            sign = exp & (1 << 255)
+            if off >= 256:
+                if sign:
+                    stack.append(2 ** 256 - 1)
+                else:
+                    stack.append(0)
             else:
-                stack.append(("balance", addr,))
+                shifted = exp >> off
+                if sign:
+                    shifted |= (2 ** 256 - 1) << (256 - off)
+                stack.append(shifted)
+        else:
+            # FIXME: This won't give the right result...
+            stack.append(mask_op(exp, offset=minus_op(off), shr=off))
+
+    def op_unary(self, stack, trace, line, op, param):
+        stack.append((op, stack.pop()))
+
+    def op_sha3(self, stack, trace, line, op, param):
+        p = stack.pop()
+        n = stack.pop()
+        res = mem_load(p, n)
+
+        self.counter += 1
+        vname = f"_{self.counter}"
+        vval = (
+            "sha3",
+            res,
+        )
 
-        elif op == "swap":
-            stack.swap(param)
+        trace(("setvar", vname, vval))
+        stack.append(("var", vname))
 
-        elif op[:3] == "log":
-            p = stack.pop()
-            s = stack.pop()
-            topics = []
-            param = int(op[3])
-            for i in range(param):
-                el = stack.pop()
-                topics.append(el)
+    def op_calldataload(self, stack, trace, line, op, param):
+        stack.append(("cd", stack.pop(),))
+
+    def op_byte(self, stack, trace, line, op, param):
+        val = stack.pop()
+        num = stack.pop()
+        off = sub_op(256, to_bytes(num))
+        stack.append(mask_op(val, 8, off, shr=off))
+
+    def op_selfbalance(self, stack, trace, line, op, param):
+        stack.append(("balance", "address",))
+
+    def op_balance(self, stack, trace, line, op, param):
+        addr = stack.pop()
+        if opcode(addr) == "mask_shl" and addr[:4] == ("mask_shl", 160, 0, 0):
+            stack.append(("balance", addr[4],))
+        else:
+            stack.append(("balance", addr,))
 
-            trace(("log", mem_load(p, s),) + tuple(topics))
+    def op_log(self, stack, trace, line, op, param):
+        p = stack.pop()
+        s = stack.pop()
+        topics = []
+        param = int(op[3])
+        for i in range(param):
+            el = stack.pop()
+            topics.append(el)
 
-        elif op == "sload":
-            sloc = stack.pop()
-            stack.append(("storage", 256, 0, sloc))
+        trace(("log", mem_load(p, s),) + tuple(topics))
 
-        elif op == "sstore":
-            sloc = stack.pop()
-            val = stack.pop()
-            trace(("store", 256, 0, sloc, val))
+    def op_sload(self, stack, trace, line, op, param):
+        sloc = stack.pop()
+        stack.append(("storage", 256, 0, sloc))
 
-        elif op == "mload":
-            memloc = stack.pop()
+    def op_sstore(self, stack, trace, line, op, param):
+        sloc = stack.pop()
+        val = stack.pop()
+        trace(("store", 256, 0, sloc, val))
 
-            self.counter += 1
-            vname = f"_{self.counter}"
-            trace(("setvar", vname, ("mem", ("range", memloc, 32))))
-            stack.append(("var", vname))
+    def op_mload(self, stack, trace, line, op, param):
+        memloc = stack.pop()
 
-        elif op == "mstore":
-            memloc = stack.pop()
-            val = stack.pop()
-            trace(("setmem", ("range", memloc, 32), val,))
+        self.counter += 1
+        vname = f"_{self.counter}"
+        trace(("setvar", vname, ("mem", ("range", memloc, 32))))
+        stack.append(("var", vname))
 
-        elif op == "mstore8":
-            memloc = stack.pop()
-            val = stack.pop()
+    def op_mstore(self, stack, trace, line, op, param):
+        memloc = stack.pop()
+        val = stack.pop()
+        trace(("setmem", ("range", memloc, 32), val,))
 
-            trace(("setmem", ("range", memloc, 8), val,))
+    def op_mstore8(self, stack, trace, line, op, param):
+        memloc = stack.pop()
+        val = stack.pop()
+
+        trace(("setmem", ("range", memloc, 8), val,))
+
+    def op_extcodecopy(self, stack, trace, line, op, param):
+        addr = stack.pop()
+        mem_pos = stack.pop()
+        code_pos = stack.pop()
+        data_len = stack.pop()
+
+        trace(
+            (
+                "setmem",
+                ("range", mem_pos, data_len),
+                ("extcodecopy", addr, ("range", code_pos, data_len)),
+            )
+        )
 
-        elif op == "extcodecopy":
-            addr = stack.pop()
-            mem_pos = stack.pop()
-            code_pos = stack.pop()
-            data_len = stack.pop()
+    def op_codecopy(self, stack, trace, line, op, param):
+        mem_pos = stack.pop()
+        call_pos = stack.pop()
+        data_len = stack.pop()
+
+        if (type(call_pos), type(data_len)) == (
+            int,
+            int,
+        ) and call_pos + data_len < len(self.loader.binary):
+            res = 0
+            for i in range(call_pos - 1, call_pos + data_len - 1):
+                res = res << 8
+                res += self.loader.binary[
+                    i
+                ]  # this breaks with out of range for some contracts
+                # may be because we're usually getting compiled code binary
+                # and not runtime binary
+            trace(
+                ("setmem", ("range", mem_pos, data_len), res)
+            )  # ('bytes', data_len, res)))
 
+        else:
             trace(
                 (
                     "setmem",
                     ("range", mem_pos, data_len),
-                    ("extcodecopy", addr, ("range", code_pos, data_len)),
+                    ("code.data", call_pos, data_len,),
                 )
             )
 
-        elif op == "codecopy":
-            mem_pos = stack.pop()
-            call_pos = stack.pop()
-            data_len = stack.pop()
-
-            if (type(call_pos), type(data_len)) == (
-                int,
-                int,
-            ) and call_pos + data_len < len(self.loader.binary):
-                res = 0
-                for i in range(call_pos - 1, call_pos + data_len - 1):
-                    res = res << 8
-                    res += self.loader.binary[
-                        i
-                    ]  # this breaks with out of range for some contracts
-                    # may be because we're usually getting compiled code binary
-                    # and not runtime binary
-                trace(
-                    ("setmem", ("range", mem_pos, data_len), res)
-                )  # ('bytes', data_len, res)))
-
-            else:
-                trace(
-                    (
-                        "setmem",
-                        ("range", mem_pos, data_len),
-                        ("code.data", call_pos, data_len,),
-                    )
-                )
-
-        elif op == "codesize":
-            stack.append(len(self.loader.binary))
-
-        elif op == "calldatacopy":
-            mem_pos = stack.pop()
-            call_pos = stack.pop()
-            data_len = stack.pop()
+    def op_codesize(self, stack, trace, line, op, param):
+        stack.append(len(self.loader.binary))
 
-            if data_len != 0:
-                call_data = ("call.data", call_pos, data_len)
-                #                call_data = mask_op(('call.data', bits(add_op(data_len, call_pos))), size=bits(data_len), shl=bits(call_pos))
-                trace(("setmem", ("range", mem_pos, data_len), call_data))
+    def op_calldatacopy(self, stack, trace, line, op, param):
+        mem_pos = stack.pop()
+        call_pos = stack.pop()
+        data_len = stack.pop()
 
-        elif op == "returndatacopy":
-            mem_pos = stack.pop()
-            ret_pos = stack.pop()
-            data_len = stack.pop()
+        if data_len != 0:
+            call_data = ("call.data", call_pos, data_len)
+            #                call_data = mask_op(('call.data', bits(add_op(data_len, call_pos))), size=bits(data_len), shl=bits(call_pos))
+            trace(("setmem", ("range", mem_pos, data_len), call_data))
 
-            if data_len != 0:
-                return_data = ("ext_call.return_data", ret_pos, data_len)
-                #                return_data = mask_op(('ext_call.return_data', bits(add_op(data_len, ret_pos))), size=bits(data_len), shl=bits(ret_pos))
-                trace(("setmem", ("range", mem_pos, data_len), return_data))
+    def op_returndatacopy(self, stack, trace, line, op, param):
+        mem_pos = stack.pop()
+        ret_pos = stack.pop()
+        data_len = stack.pop()
 
-        elif op == "call":
-            self.handle_call(op, trace)
+        if data_len != 0:
+            return_data = ("ext_call.return_data", ret_pos, data_len)
+            #                return_data = mask_op(('ext_call.return_data', bits(add_op(data_len, ret_pos))), size=bits(data_len), shl=bits(ret_pos))
+            trace(("setmem", ("range", mem_pos, data_len), return_data))
 
-        elif op == "staticcall":
-            self.handle_call(op, trace)
+    def op_call(self, stack, trace, line, op, param):
+        self.handle_call(op, trace)
 
-        elif op == "delegatecall":
-            gas = stack.pop()
-            addr = stack.pop()
+    def op_delegatecall(self, stack, trace, line, op, param):
+        gas = stack.pop()
+        addr = stack.pop()
 
-            arg_start = stack.pop()
-            arg_len = stack.pop()
-            ret_start = stack.pop()
-            ret_len = stack.pop()
+        arg_start = stack.pop()
+        arg_len = stack.pop()
+        ret_start = stack.pop()
+        ret_len = stack.pop()
 
-            call_trace = (
-                "delegatecall",
-                gas,
-                addr,
-            )  # arg_start, arg_len, ret_start, ret_len)
+        call_trace = (
+            "delegatecall",
+            gas,
+            addr,
+        )  # arg_start, arg_len, ret_start, ret_len)
 
-            if arg_len == 0:
-                fname = None
-                fparams = None
+        if arg_len == 0:
+            fname = None
+            fparams = None
 
-            elif arg_len == 4:
-                fname = mem_load(arg_start, 4)
-                fparams = 0
+        elif arg_len == 4:
+            fname = mem_load(arg_start, 4)
+            fparams = 0
 
-            else:
-                fname = mem_load(arg_start, 4)
-                fparams = mem_load(add_op(arg_start, 4), sub_op(arg_len, 4))
+        else:
+            fname = mem_load(arg_start, 4)
+            fparams = mem_load(add_op(arg_start, 4), sub_op(arg_len, 4))
 
-            call_trace += (fname, fparams)
+        call_trace += (fname, fparams)
 
-            trace(call_trace)
+        trace(call_trace)
 
-            self.call_len = ret_len
-            stack.append("delegate.return_code")
+        self.call_len = ret_len
+        stack.append("delegate.return_code")
 
-            if 0 != ret_len:
-                return_data = ("delegate.return_data", 0, ret_len)
+        if 0 != ret_len:
+            return_data = ("delegate.return_data", 0, ret_len)
 
-                trace(("setmem", ("range", ret_start, ret_len), return_data))
+            trace(("setmem", ("range", ret_start, ret_len), return_data))
 
-        elif op == "callcode":
-            gas = stack.pop()
-            addr = stack.pop()
-            value = stack.pop()
+    def op_callcode(self, stack, trace, line, op, param):
+        gas = stack.pop()
+        addr = stack.pop()
+        value = stack.pop()
 
-            arg_start = stack.pop()
-            arg_len = stack.pop()
-            ret_start = stack.pop()
-            ret_len = stack.pop()
+        arg_start = stack.pop()
+        arg_len = stack.pop()
+        ret_start = stack.pop()
+        ret_len = stack.pop()
 
-            call_trace = (
-                "callcode",
-                gas,
-                addr,
-                value,
-            )
+        call_trace = (
+            "callcode",
+            gas,
+            addr,
+            value,
+        )
 
-            if arg_len == 0:
-                fname = None
-                fparams = None
+        if arg_len == 0:
+            fname = None
+            fparams = None
 
-            elif arg_len == 4:
-                fname = mem_load(arg_start, 4)
-                fparams = 0
+        elif arg_len == 4:
+            fname = mem_load(arg_start, 4)
+            fparams = 0
 
-            else:
-                fname = mem_load(arg_start, 4)
-                fparams = mem_load(add_op(arg_start, 4), sub_op(arg_len, 4))
+        else:
+            fname = mem_load(arg_start, 4)
+            fparams = mem_load(add_op(arg_start, 4), sub_op(arg_len, 4))
 
-            call_trace += (fname, fparams)
+        call_trace += (fname, fparams)
 
-            trace(call_trace)
+        trace(call_trace)
 
-            self.call_len = ret_len
-            stack.append("callcode.return_code")
+        self.call_len = ret_len
+        stack.append("callcode.return_code")
 
-            if 0 != ret_len:
-                return_data = ("callcode.return_data", 0, ret_len)
+        if 0 != ret_len:
+            return_data = ("callcode.return_data", 0, ret_len)
 
-                trace(("setmem", ("range", ret_start, ret_len), return_data))
+            trace(("setmem", ("range", ret_start, ret_len), return_data))
 
-        elif op == "create":
-            wei, mem_start, mem_len = stack.pop(), stack.pop(), stack.pop()
+    def op_create(self, stack, trace, line, op, param):
+        wei, mem_start, mem_len = stack.pop(), stack.pop(), stack.pop()
 
-            call_trace = ("create", wei)
+        call_trace = ("create", wei)
 
-            code = mem_load(mem_start, mem_len)
-            call_trace += (code,)
+        code = mem_load(mem_start, mem_len)
+        call_trace += (code,)
 
-            trace(call_trace)
+        trace(call_trace)
 
-            stack.append("create.new_address")
+        stack.append("create.new_address")
 
-        elif op == "create2":
-            wei, mem_start, mem_len, salt = (
-                stack.pop(),
-                stack.pop(),
-                stack.pop(),
-                stack.pop(),
-            )
+    def op_create2(self, stack, trace, line, op, param):
+        wei, mem_start, mem_len, salt = (
+            stack.pop(),
+            stack.pop(),
+            stack.pop(),
+            stack.pop(),
+        )
 
-            call_trace = ("create2", wei, ("mem", ("range", mem_start, mem_len)), salt)
+        call_trace = ("create2", wei, ("mem", ("range", mem_start, mem_len)), salt)
 
-            trace(call_trace)
+        trace(call_trace)
 
-            stack.append("create2.new_address")
-
-        elif op == "pc":
-            stack.append(line[0])
-
-        elif op == "msize":
-            self.counter += 1
-            vname = f"_{self.counter}"
-            trace(("setvar", vname, "msize"))
-            stack.append(("var", vname))
-
-        elif op in ("extcodesize", "extcodehash", "blockhash"):
-            stack.append((op, stack.pop(),))
-
-        elif op in [
-            "callvalue",
-            "caller",
-            "address",
-            "number",
-            "gas",
-            "origin",
-            "timestamp",
-            "chainid",
-            "difficulty",
-            "gasprice",
-            "coinbase",
-            "gaslimit",
-            "calldatasize",
-            "returndatasize",
-        ]:
-            stack.append(op)
+        stack.append("create2.new_address")
 
-        else:
-            # TODO: Maybe raise an error directly?
-            assert op not in [
-                "jump",
-                "jumpi",
-                "revert",
-                "return",
-                "stop",
-                "jumpdest",
-                "UNKNOWN",
-            ]
+    def op_pc(self, stack, trace, line, op, param):
+        stack.append(line[0])
 
-        if stack.len() - previous_len != opcode_dict.stack_diffs[op]:
-            logger.error("line: %s", line)
-            logger.error("stack: %s", stack)
-            logger.error(
-                "expected %s, got %s stack diff",
-                opcode_dict.stack_diffs[op],
-                stack.len() - previous_len,
-            )
-            assert False, f"opcode {op} not processed correctly"
+    def op_msize(self, stack, trace, line, op, param):
+        self.counter += 1
+        vname = f"_{self.counter}"
+        trace(("setvar", vname, "msize"))
+        stack.append(("var", vname))
 
-        stack.cleanup()
+    def op_environment(self, stack, trace, line, op, param):
+        stack.append(op)
 
     def handle_call(self, op, trace):
         stack = self.stack
@@ -1015,3 +1101,85 @@ class VM(EasyCopy):
             except CannotCompare:
                 return_data = ("ext_call.return_data", 0, ret_len)
                 trace(("setmem", ("range", ret_start, ret_len), return_data))
+
+
+ARITHMETIC_OPS = (
+    "exp",
+    "and",
+    "eq",
+    "div",
+    "lt",
+    "gt",
+    "slt",
+    "sgt",
+    "mod",
+    "xor",
+    "signextend",
+    "smod",
+    "sdiv",
+)
+
+ENVIRONMENT_OPS = (
+    "callvalue",
+    "caller",
+    "address",
+    "number",
+    "gas",
+    "origin",
+    "timestamp",
+    "chainid",
+    "difficulty",
+    "gasprice",
+    "coinbase",
+    "gaslimit",
+    "calldatasize",
+    "returndatasize",
+)
+
+# op -> VM method executing it, ops missing here go to VM.op_unhandled
+op_handlers = {
+    **{op: VM.op_arithmetic for op in ARITHMETIC_OPS},
+    **{f"push{n}": VM.op_push for n in range(1, 33)},
+    **{f"log{n}": VM.op_log for n in range(5)},
+    **{op: VM.op_environment for op in ENVIRONMENT_OPS},
+    "pop": VM.op_pop,
+    "dup": VM.op_dup,
+    "swap": VM.op_swap,
+    "mul": VM.op_mul,
+    "or": VM.op_or,
+    "add": VM.op_add,
+    "sub": VM.op_sub,
+    "mulmod": VM.op_mulmod,
+    "addmod": VM.op_mulmod,
+    "shl": VM.op_shl,
+    "shr": VM.op_shr,
+    "sar": VM.op_sar,
+    "not": VM.op_unary,
+    "iszero": VM.op_unary,
+    "sha3": VM.op_sha3,
+    "calldataload": VM.op_calldataload,
+    "byte": VM.op_byte,
+    "selfbalance": VM.op_selfbalance,
+    "balance": VM.op_balance,
+    "sload": VM.op_sload,
+    "sstore": VM.op_sstore,
+    "mload": VM.op_mload,
+    "mstore": VM.op_mstore,
+    "mstore8": VM.op_mstore8,
+    "extcodecopy": VM.op_extcodecopy,
+    "codecopy": VM.op_codecopy,
+    "codesize": VM.op_codesize,
+    "calldatacopy": VM.op_calldatacopy,
+    "returndatacopy": VM.op_returndatacopy,
+    "call": VM.op_call,
+    "staticcall": VM.op_call,
+    "delegatecall": VM.op_delegatecall,
+    "callcode": VM.op_callcode,
+    "create": VM.op_create,
+    "create2": VM.op_create2,
+    "pc": VM.op_pc,
+    "msize": VM.op_msize,
+    "extcodesize": VM.op_unary,
+    "extcodehash": VM.op_unary,
+    "blockhash": VM.op_unary,
+}
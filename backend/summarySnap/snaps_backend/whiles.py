@@ -58,6 +58,7 @@ from snaps_backend.prettify import (
     pretty_repr,
 )
 from snaps_backend.simplify import simplify_trace
+from snaps_backend.utils import budget, profiling
 from snaps_backend.utils.helpers import (
     C,
     contains,
@@ -89,14 +90,14 @@ logger.level = logging.CRITICAL  # switch to INFO for detailed
 
 
 def make_whiles(trace):
-    trace = make(trace)
+    trace = profiling.stage("whiles.make", make, trace)
     explain("Loops -> whiles", trace)
 
     # clean up jumpdests
     trace = rewrite_trace(
         trace, lambda line: [] if opcode(line) == "jumpdest" else [line]
     )
-    trace = simplify_trace(trace)
+    trace = profiling.stage("simplify_trace", simplify_trace, trace)
 
     return trace
 
@@ -117,6 +118,12 @@ def make(trace):
 
         elif m := match(line, ("label", ":jd", ":vars", ...)):
             jd, vars = m.jd, m.vars
+
+            if budget.exceeded() is not None:
+                # out of budget, the rest is left as if it couldn't be turned
+                # into a loop
+                continue
+
             try:
                 before, inside, remaining, cond = to_while(trace[idx + 1 :], jd)
             except Exception:
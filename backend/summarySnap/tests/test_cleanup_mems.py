@@ -0,0 +1,140 @@
+import sys
+import time
+
+from snaps_backend.simplify import cleanup_mems
+from snaps_backend.utils.helpers import cache_scope
+
+TRACE = [
+    ("setmem", ("range", 64, 32), 256),
+    ("setmem", ("range", 128, 32), ("cd", 4)),
+    ("setmem", ("range", 160, 32), ("cd", 36)),
+    ("log", ("mem", ("range", 128, 64)), 1),
+    ("setmem", ("range", 160, 4), ("mask_shl", 32, 224, 0, ("cd", 68))),
+    ("log", ("mem", ("range", 160, 32)), 2),
+    ("setmem", ("range", 192, 32), ("storage", 256, 0, 1)),
+    (
+        "if",
+        ("iszero", ("cd", 4)),
+        [("log", ("mem", ("range", 192, 32)), 3), ("stop",)],
+        [("setmem", ("range", 192, 32), 7), ("return", ("mem", ("range", 192, 32)))],
+    ),
+    (
+        "while",
+        ("gt", ("var", 0), 0),
+        [
+            ("setmem", ("range", 224, 32), ("var", 0)),
+            ("log", ("mem", ("range", 224, 32)), 4),
+            ("continue", 1, [("setvar", 0, ("add", -1, ("var", 0)))]),
+        ],
+        1,
+        [("setvar", 0, ("cd", 4))],
+    ),
+    ("setmem", ("range", 256, 32), ("add", 1, ("mem", ("range", 128, 32)))),
+    (
+        "call",
+        ("gas",),
+        ("cd", 100),
+        0,
+        ("mem", ("range", 252, 4)),
+        ("mem", ("range", 256, 32)),
+    ),
+    ("return", ("mem", ("range", 128, 160))),
+]
+
+# what the recursive implementation returned for TRACE
+EXPECTED = [
+    ("log", ("data", ("cd", 4), ("cd", 36)), 1),
+    (
+        "log",
+        (
+            "data",
+            ("mask_shl", 32, 224, 0, ("cd", 68)),
+            ("mask_shl", 224, 0, 0, ("cd", 36)),
+        ),
+        2,
+    ),
+    (
+        "if",
+        ("iszero", ("cd", 4)),
+        [("log", ("storage", 256, 0, 1), 3), ("stop",)],
+        [("return", 7)],
+    ),
+    (
+        "while",
+        ("gt", ("var", 0), 0),
+        [
+            ("setmem", ("range", 224, 32), ("var", 0)),
+            ("log", ("var", 0), 4),
+            ("continue", 1, [("setvar", 0, ("add", -1, ("var", 0)))]),
+        ],
+        1,
+        [("setvar", 0, ("cd", 4))],
+    ),
+    (
+        "call",
+        ("gas",),
+        ("cd", 100),
+        0,
+        ("mem", ("range", 252, 4)),
+        ("add", 1, ("cd", 4)),
+    ),
+    (
+        "return",
+        (
+            "data",
+            ("cd", 4),
+            ("mask_shl", 32, 224, 0, ("cd", 68)),
+            ("mask_shl", 224, 0, 0, ("cd", 36)),
+            ("storage", 256, 0, 1),
+            ("mem", ("range", 224, 32)),
+            ("add", 1, ("cd", 4)),
+        ),
+    ),
+]
+
+
+def test_cleanup_mems():
+    with cache_scope():
+        assert cleanup_mems(TRACE) == EXPECTED
+
+
+def test_cleanup_mems_long_trace():
+    # every setmem overwrites the previous one, so each pass is short - but
+    # the recursive implementation went a call deeper for each of them
+    setmems = 2000
+    trace = [("setmem", ("range", 128, 32), ("cd", 4 + 32 * i)) for i in range(setmems)]
+    trace.append(("return", ("mem", ("range", 128, 32))))
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)  # the default, in case something raised it
+    try:
+        with cache_scope():
+            res = cleanup_mems(trace)
+    finally:
+        sys.setrecursionlimit(limit)
+
+    assert res == [("return", ("cd", 4 + 32 * (setmems - 1)))]
+
+
+def test_cleanup_mems_distinct_setmems():
+    # every setmem writes somewhere else, so all of them stay live until the
+    # end - the pass must not check every line against all of them
+    setmems = 5000
+    trace, expected = [], []
+    for i in range(setmems):
+        trace.append(("setmem", ("range", 128 + 32 * i, 32), ("cd", 4 + 32 * i)))
+        if i % 10 == 9:
+            trace.append(("log", ("mem", ("range", 128 + 32 * (i - 5), 32)), i))
+            expected.append(("log", ("cd", 4 + 32 * (i - 5)), i))
+
+    trace.append(("return", ("mem", ("range", 128 + 32 * (setmems - 1), 32))))
+    expected.append(("return", ("cd", 4 + 32 * (setmems - 1))))
+
+    start = time.perf_counter()
+    with cache_scope():
+        res = cleanup_mems(trace)
+    elapsed = time.perf_counter() - start
+
+    assert res == expected
+    # takes about a second - a pass per setmem took minutes
+    assert elapsed < 20, elapsed
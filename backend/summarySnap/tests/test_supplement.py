@@ -0,0 +1,48 @@
+import sqlite3
+
+from snaps_backend.utils import supplement
+
+
+def legacy_db(rows):
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE functions "
+        "(hash text, name text, folded_name text, params text, cooccurs text)"
+    )
+    conn.executemany("INSERT INTO functions VALUES (?, ?, ?, ?, ?)", rows)
+    return conn
+
+
+def fetch_sig(conn, hash):
+    rows = supplement._fetch_legacy(conn, [hash])
+    return supplement._sig_from_rows(hash, rows[hash])
+
+
+def test_sig_picks_longest_cooccurs_string():
+    # more entries in the first one, but a longer string in the second
+    conn = legacy_db(
+        [
+            ("0x12345678", "short", "short()", "[]", "a,b,c"),
+            ("0x12345678", "long", "long()", "[]", "0x11111111"),
+        ]
+    )
+
+    assert fetch_sig(conn, "0x12345678")["name"] == "long"
+
+
+def test_sig_tie_goes_to_first_row():
+    conn = legacy_db(
+        [
+            ("0x12345678", "first", "first()", "[]", "0x11111111"),
+            ("0x12345678", "second", "second()", "[]", "0x22222222"),
+            ("0x87654321", "other", "other()", "[]", "0x11111111,0x22222222"),
+        ]
+    )
+
+    assert fetch_sig(conn, "0x12345678")["name"] == "first"
+
+
+def test_sig_missing():
+    conn = legacy_db([])
+
+    assert fetch_sig(conn, "0x12345678") is None
@@ -0,0 +1,47 @@
+import sys
+from types import SimpleNamespace
+
+from snaps_backend.vm import Node
+
+
+def node(trace):
+    # just what make_trace looks at
+    n = Node.__new__(Node)
+    n.vm = SimpleNamespace(just_fdests=False)
+    n.label = None
+    n.trace = trace
+    return n
+
+
+def test_make_trace():
+    exit_true = node([("return", 1)])
+    exit_false = node([("revert", 0)])
+    branch = node([("setvar", 1, 2), ("if", ("iszero", 1), exit_true, exit_false)])
+    root = node([("setvar", 0, 1), ("jump", branch)])
+    unfinished = node(None)
+
+    assert root.make_trace() == [
+        ("setvar", 0, 1),
+        ("setvar", 1, 2),
+        ("if", ("iszero", 1), [("return", 1)], [("revert", 0)]),
+    ]
+    assert node([("jump", unfinished)]).make_trace() == [
+        ("undefined", "decompilation didn't finish")
+    ]
+
+
+def test_make_trace_long_path():
+    nodes = 5000
+    tail = node([("stop",)])
+    for i in range(nodes):
+        tail = node([("setvar", 0, i), ("jump", tail)])
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(1000)  # the default, in case something raised it
+    try:
+        trace = tail.make_trace()
+    finally:
+        sys.setrecursionlimit(limit)
+
+    assert len(trace) == nodes + 1
+    assert trace[0] == ("setvar", 0, nodes - 1)